@@ -17,9 +17,18 @@ sys.path.insert(0, str(backend_path))
 
 from main import app
 
+server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=8000, log_level="info"))
+
 def run_server():
     """Run the FastAPI server in a separate thread"""
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info")
+    server.run()
+
+def wait_until_ready(server_thread):
+    """Block until the server accepts connections; exit if it failed to start"""
+    while not server.started:
+        if not server_thread.is_alive():
+            sys.exit("Server failed to start")
+        time.sleep(0.02)
 
 def main():
     """Launch the pywebview application"""
@@ -27,8 +36,8 @@ def main():
     server_thread = threading.Thread(target=run_server, daemon=True)
     server_thread.start()
     
-    # Give the server time to start
-    time.sleep(2)
+    # Open the window as soon as the server is listening
+    wait_until_ready(server_thread)
     
     # Create and show the webview window
     webview.create_window(
@@ -40,6 +49,10 @@ def main():
     )
     
     webview.start(debug=False)
+    
+    # Shut down cleanly so the backend flushes its journal and startup snapshot
+    server.should_exit = True
+    server_thread.join()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,120 @@
+"""FastAPI routes for note attachments"""
+
+import re
+
+from fastapi import APIRouter, File, HTTPException, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from app.blobstore import DIGEST, AttachmentTooLarge
+from app.concurrency import run_blocking
+from app.routes import etag_matches
+from app.vaults import VaultLocal, current_vault
+
+router = APIRouter()
+
+# Global note app instance; under /api/vaults/{vault} it is that vault's
+note_app = VaultLocal('note_app')
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Blobs are named by their content, so a URL's bytes never change
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+class AttachmentResponse(BaseModel):
+    hash: str
+    url: str
+    size: int
+    mime: str
+
+def set_note_app(app):
+    """Set the global note app instance"""
+    note_app.default = app
+
+def attachments_url():
+    """Return the URL prefix of the current vault's attachments"""
+    vault = current_vault.get()
+    if vault is None:
+        return "/api/attachments"
+    return f"/api/vaults/{vault.name}/attachments"
+
+def parse_range(header, size):
+    """Return (start, end) of a single 'bytes=' range, None to send everything
+
+    Raises HTTPException 416 for a range outside the file.
+    """
+    match = RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        # Multiple or malformed ranges: answering with the whole file is allowed
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(0, size - int(last))
+        end = size - 1
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={'Content-Range': f'bytes */{size}'}
+        )
+    return start, end
+
+@router.post("/", response_model=AttachmentResponse)
+async def upload_attachment(file: UploadFile = File(...)):
+    """Store an uploaded file and return the URL notes use to link to it
+
+    Uploading content that is already stored returns the existing attachment.
+    """
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+
+    mime = file.content_type or 'application/octet-stream'
+    try:
+        # The multipart parser spools large uploads to disk; copy it over in chunks
+        attachment = await run_blocking(note_app, note_app.add_attachment, file.file, mime)
+    except AttachmentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    finally:
+        await file.close()
+
+    return {
+        'hash': attachment['hash'],
+        'url': f"{attachments_url()}/{attachment['hash']}",
+        'size': attachment['size'],
+        'mime': attachment['mime'],
+    }
+
+@router.get("/{digest}")
+async def get_attachment(digest: str, request: Request):
+    """Serve an attachment, honouring If-None-Match and single byte ranges"""
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+
+    attachment = DIGEST.match(digest) and await run_blocking(note_app, note_app.get_attachment, digest)
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+    etag = f'"{digest}"'
+    headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL, 'Accept-Ranges': 'bytes'}
+    if etag_matches(request.headers.get('if-none-match', ''), etag):
+        return Response(status_code=304, headers=headers)
+
+    size = attachment['size']
+    byte_range = None
+    range_header = request.headers.get('range')
+    if range_header and request.headers.get('if-range', etag) == etag:
+        byte_range = parse_range(range_header, size)
+
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+
+    # A sync generator is iterated in a worker thread, off the event loop
+    body = note_app.attachments.read(digest, attachment['compressed'], start, end) if size else iter(())
+    return StreamingResponse(body, status_code=status, media_type=attachment['mime'], headers=headers)
@@ -0,0 +1,257 @@
+"""Content-addressed store for note attachments (pasted images and files)
+
+Each uploaded file is stored once under `.attachments/` in the notes
+directory, named by the SHA-256 of its bytes, so pasting the same image
+into many notes keeps a single copy. Text-like formats (SVG, plain text,
+JSON, ...) are zlib-compressed on disk; images such as PNG and JPEG are
+already compressed and stored as they are.
+
+Note bodies refer to a blob as `/api/attachments/<sha256>`, or
+`/api/vaults/<vault>/attachments/<sha256>` in a vault other than the
+default one. The
+`attachment_refs` table records which blobs each note's current content
+references and is kept up to date on every save, so gc() can delete
+blobs nothing refers to without reading every note.
+"""
+
+import hashlib
+import os
+import re
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from app.metrics import FILE_BYTES_READ, FILE_BYTES_WRITTEN
+
+ATTACHMENTS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS attachments (
+        hash TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        stored_size INTEGER NOT NULL,
+        mime TEXT NOT NULL,
+        compressed INTEGER NOT NULL,
+        touched TEXT NOT NULL
+    )
+'''
+
+ATTACHMENT_REFS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS attachment_refs (
+        note_id INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        PRIMARY KEY (note_id, hash)
+    ) WITHOUT ROWID
+'''
+
+# How note bodies link to an attachment
+REFERENCE = re.compile(r'/api/(?:vaults/[A-Za-z0-9_-]+/)?attachments/([0-9a-f]{64})')
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+CHUNK_SIZE = 64 * 1024
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/xml', 'application/javascript',
+    'image/svg+xml', 'image/bmp',
+}
+
+
+def is_compressible(mime):
+    """Return True for formats that are not compressed already"""
+    return mime.startswith('text/') or mime in COMPRESSIBLE_TYPES or mime.endswith(('+xml', '+json'))
+
+
+def references(content):
+    """Return the attachment digests a note body links to"""
+    if '/attachments/' not in content:
+        return set()
+    return set(REFERENCE.findall(content))
+
+
+class AttachmentTooLarge(Exception):
+    """An upload exceeded the configured size limit"""
+
+
+class BlobStore:
+    """Attachment files and their index for one notes directory"""
+
+    def __init__(self, notes_dir, max_bytes=100 * 1024 * 1024, compress_level=6):
+        self.blobs_dir = Path(notes_dir) / '.attachments'
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+
+    def create_schema(self, conn):
+        """Create the attachment tables; return True if they did not exist yet"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attachment_refs'"
+        ).fetchone()
+        conn.execute(ATTACHMENTS_SCHEMA)
+        conn.execute(ATTACHMENT_REFS_SCHEMA)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_attachment_refs_hash ON attachment_refs(hash)')
+        return exists is None
+
+    def relative_path(self, digest):
+        """Return a blob's path relative to the notes directory"""
+        return os.path.join(self.blobs_dir.name, digest[:2], digest[2:])
+
+    def path(self, digest):
+        return self.blobs_dir / digest[:2] / digest[2:]
+
+    def receive(self, source, mime):
+        """Stream a file object into a temporary blob
+
+        Returns (tmp_path, digest, size, stored_size, compressed). Raises
+        AttachmentTooLarge, after removing the temporary file, when the
+        upload exceeds max_bytes.
+        """
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.blobs_dir / f"{uuid.uuid4().hex}.tmp"
+        compressed = is_compressible(mime)
+        compressor = zlib.compressobj(self.compress_level) if compressed else None
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp, 'wb') as f:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise AttachmentTooLarge(f"Attachments are limited to {self.max_bytes} bytes")
+                    hasher.update(chunk)
+                    f.write(compressor.compress(chunk) if compressor else chunk)
+                if compressor:
+                    f.write(compressor.flush())
+                f.flush()
+                # The note linking to the blob may be saved right after the upload
+                os.fsync(f.fileno())
+                stored_size = f.tell()
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        FILE_BYTES_WRITTEN.inc(stored_size, kind='attachment')
+        return tmp, hasher.hexdigest(), size, stored_size, compressed
+
+    def commit(self, conn, tmp, digest, size, stored_size, compressed, mime):
+        """Index a received blob and move it into place, inside the caller's transaction
+
+        When the blob is already stored the upload is dropped and the existing
+        one is only marked as recently uploaded, so gc() leaves it alone for
+        the grace period. Returns the attachment's metadata.
+        """
+        now = datetime.now().isoformat()
+        path = self.path(digest)
+        if self.get(conn, digest) is not None and path.exists():
+            conn.execute('UPDATE attachments SET touched = ? WHERE hash = ?', (now, digest))
+            tmp.unlink()
+        else:
+            conn.execute('''
+                INSERT OR REPLACE INTO attachments (hash, size, stored_size, mime, compressed, touched)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (digest, size, stored_size, mime, int(compressed), now))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, path)
+        return self.get(conn, digest)
+
+    def get(self, conn, digest):
+        """Return an attachment's metadata, or None"""
+        row = conn.execute(
+            'SELECT hash, size, stored_size, mime, compressed, touched FROM attachments WHERE hash = ?',
+            (digest,)
+        ).fetchone()
+        if row is None:
+            return None
+        attachment = dict(row)
+        attachment['compressed'] = bool(attachment['compressed'])
+        return attachment
+
+    def read(self, digest, compressed, start=0, end=None):
+        """Yield the bytes start..end (inclusive) of a blob in chunks"""
+        remaining = None if end is None else end - start + 1
+        with open(self.path(digest), 'rb') as f:
+            if not compressed:
+                f.seek(start)
+                while remaining is None or remaining > 0:
+                    chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    FILE_BYTES_READ.inc(len(chunk))
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    yield chunk
+                return
+
+            # Compressed blobs are small text files; decompress and skip to start
+            decompressor = zlib.decompressobj()
+            skip = start
+            while remaining is None or remaining > 0:
+                raw = f.read(CHUNK_SIZE)
+                if not raw:
+                    break
+                FILE_BYTES_READ.inc(len(raw))
+                chunk = decompressor.decompress(raw)
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk = chunk[dropped:]
+                    skip -= dropped
+                if remaining is not None:
+                    chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                if chunk:
+                    yield chunk
+
+    def update_refs(self, conn, note_id, content):
+        """Record the attachments a note's content links to
+
+        Returns True when links were dropped, i.e. gc() may have blobs to reclaim.
+        """
+        new = references(content)
+        old = {row[0] for row in conn.execute(
+            'SELECT hash FROM attachment_refs WHERE note_id = ?', (note_id,)
+        )}
+        if new == old:
+            return False
+        conn.executemany('DELETE FROM attachment_refs WHERE note_id = ? AND hash = ?',
+                         [(note_id, digest) for digest in old - new])
+        conn.executemany('INSERT INTO attachment_refs (note_id, hash) VALUES (?, ?)',
+                         [(note_id, digest) for digest in new - old])
+        return bool(old - new)
+
+    def build_refs(self, conn, notes):
+        """Index the links of every (note_id, content) pair of an existing vault"""
+        conn.executemany(
+            'INSERT OR IGNORE INTO attachment_refs (note_id, hash) VALUES (?, ?)',
+            ((note_id, digest) for note_id, content in notes for digest in references(content))
+        )
+
+    def forget(self, conn, note_ids):
+        """Drop the links of deleted notes; return True if they had any"""
+        dropped = 0
+        for note_id in note_ids:
+            dropped += conn.execute('DELETE FROM attachment_refs WHERE note_id = ?', (note_id,)).rowcount
+        return dropped > 0
+
+    def garbage(self, conn, grace_seconds):
+        """Return digests of unlinked attachments last uploaded before the grace period"""
+        cutoff = (datetime.now() - timedelta(seconds=grace_seconds)).isoformat()
+        rows = conn.execute('''
+            SELECT hash FROM attachments
+            WHERE touched < ? AND NOT EXISTS (
+                SELECT 1 FROM attachment_refs WHERE attachment_refs.hash = attachments.hash
+            )
+        ''', (cutoff,)).fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, conn, digests, grace_seconds):
+        """Delete attachments that are still garbage, inside the caller's transaction
+
+        Files are removed before the transaction commits, so an upload of
+        the same content waits for it and then writes the file again.
+        Returns the deleted digests.
+        """
+        still_garbage = set(self.garbage(conn, grace_seconds))
+        deleted = [digest for digest in digests if digest in still_garbage]
+        for digest in deleted:
+            conn.execute('DELETE FROM attachments WHERE hash = ?', (digest,))
+            self.path(digest).unlink(missing_ok=True)
+        return deleted
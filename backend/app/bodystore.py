@@ -0,0 +1,286 @@
+"""Note body files, plain or compressed
+
+Note bodies are `{id}.md` files in the notes directory. With `[storage]
+compress_content` on they are `{id}.mdz` files instead: zlib-compressed,
+or zstd-compressed when the optional `zstandard` package is installed,
+with a dictionary trained on the vault's own notes. A single note gives
+the compressor little text to find repeats in, while the notes of one
+vault share headings, templates and vocabulary; the dictionary primes the
+compressor with those.
+
+A compressed file is MAGIC, one codec byte, the 8-byte id of its
+dictionary (the start of the dictionary's SHA-256, zeros for none) and the
+compressed UTF-8 body. Dictionaries are kept in `.dictionaries/`, named by
+their id, and never change; `current` names the one new files use. Older
+dictionaries stay until no file uses them, so training a new one never
+makes existing files unreadable.
+
+`mixed` is set while the vault may still hold files in the other format,
+after compress_content was switched and until NoteApp has converted every
+body: reads then fall back to the other file and writes remove it.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from pathlib import Path
+
+from app.journal import write_file_atomic
+from app.metrics import FILE_BYTES_READ
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PLAIN = '.md'
+COMPRESSED = '.mdz'
+
+DICTIONARY_DIR = '.dictionaries'
+CURRENT = 'current'
+
+MAGIC = b'NZ'
+ZLIB = b'z'
+ZSTD = b's'
+NO_DICTIONARY = bytes(8)
+HEADER_SIZE = len(MAGIC) + 1 + len(NO_DICTIONARY)
+
+# A dictionary is only trained from at least this many notes, on at most
+# MAX_SAMPLES of them and the first SAMPLE_BYTES of each
+MIN_SAMPLES = 64
+MAX_SAMPLES = 1000
+SAMPLE_BYTES = 8 * 1024
+
+# Words with the whitespace after them, as they repeat inside a text
+WORD = re.compile(rb'\S{3,32}\s')
+
+
+def build_dictionary(samples, size):
+    """Return up to size bytes of the lines and words most samples share
+
+    Used with zlib, which has no dictionary trainer of its own. zlib finds
+    matches near the end of the dictionary most cheaply, so the strings
+    that save the most come last.
+    """
+    counts = Counter()
+    for sample in samples:
+        # Counted once per sample: what many notes share beats what one note repeats
+        pieces = {line for line in sample.splitlines() if 4 <= len(line) <= 256}
+        pieces.update(WORD.findall(sample))
+        counts.update(pieces)
+    shared = sorted(
+        ((count * len(piece), piece) for piece, count in counts.items() if count > 1),
+        reverse=True
+    )
+    picked = []
+    total = 0
+    for _, piece in shared:
+        if total + len(piece) + 1 > size:
+            break
+        picked.append(piece)
+        total += len(piece) + 1
+    picked.reverse()
+    return b'\n'.join(picked)
+
+
+class BodyStore:
+    """Reads and writes note bodies as .md or compressed .mdz files"""
+
+    def __init__(self, notes_dir, compress=False, level=6, dictionary_bytes=32 * 1024):
+        self.notes_dir = Path(notes_dir)
+        self.compress = compress
+        self.suffix = COMPRESSED if compress else PLAIN
+        self.other_suffix = PLAIN if compress else COMPRESSED
+        self.level = level
+        self.dictionary_bytes = dictionary_bytes
+        self.dictionaries_dir = self.notes_dir / DICTIONARY_DIR
+        # Until NoteApp knows the vault holds one format only
+        self.mixed = True
+        self._lock = threading.Lock()
+        self._dictionaries = {}
+        self._zstd_dictionaries = {}
+        self.dictionary_id = NO_DICTIONARY
+        try:
+            dictionary_id = bytes.fromhex((self.dictionaries_dir / CURRENT).read_text().strip())
+        except (FileNotFoundError, ValueError):
+            pass
+        else:
+            if (self.dictionaries_dir / dictionary_id.hex()).exists():
+                self.dictionary_id = dictionary_id
+
+    def path(self, note_id, suffix=None):
+        return self.notes_dir / f"{note_id}{suffix or self.suffix}"
+
+    def read(self, note_id):
+        """Return a note's body, or None if it has no file"""
+        # The preferred file is tried again in case a conversion just
+        # replaced the other one with it
+        suffixes = (self.suffix, self.other_suffix, self.suffix) if self.mixed else (self.suffix,)
+        for suffix in suffixes:
+            try:
+                if suffix == PLAIN:
+                    with open(self.path(note_id, suffix), 'r', encoding='utf-8') as f:
+                        FILE_BYTES_READ.inc(os.fstat(f.fileno()).st_size)
+                        return f.read()
+                with open(self.path(note_id, suffix), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            FILE_BYTES_READ.inc(len(data))
+            return self.decode(data)
+        return None
+
+    def write(self, note_id, content, fsync=False):
+        """Atomically replace a note's file with content"""
+        write_file_atomic(self.path(note_id), self.encode(content) if self.compress else content, fsync=fsync)
+        if self.mixed:
+            self.path(note_id, self.other_suffix).unlink(missing_ok=True)
+
+    def remove(self, note_id):
+        """Remove a note's file"""
+        self.path(note_id).unlink(missing_ok=True)
+        if self.mixed:
+            self.path(note_id, self.other_suffix).unlink(missing_ok=True)
+
+    def convert(self, note_id):
+        """Rewrite a note's file in the current format and dictionary; return True if rewritten"""
+        if self.path(note_id, self.other_suffix).exists():
+            content = self.read(note_id)
+        elif self.compress:
+            try:
+                with open(self.path(note_id), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return False
+            if data[HEADER_SIZE - len(NO_DICTIONARY):HEADER_SIZE] == self.dictionary_id:
+                return False
+            content = self.decode(data)
+        else:
+            return False
+        if content is None:
+            return False
+        self.write(note_id, content)
+        return True
+
+    def encode(self, content):
+        """Return the .mdz file data of a note body"""
+        with self._lock:
+            dictionary_id = self.dictionary_id
+        data = content.encode('utf-8')
+        if zstandard is not None:
+            codec = ZSTD
+            dictionary = self._zstd_dictionary(dictionary_id)
+            data = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary).compress(data)
+        else:
+            codec = ZLIB
+            dictionary = self._dictionary(dictionary_id)
+            if dictionary is None:
+                data = zlib.compress(data, self.level)
+            else:
+                compressor = zlib.compressobj(self.level, zdict=dictionary)
+                data = compressor.compress(data) + compressor.flush()
+        return MAGIC + codec + dictionary_id + data
+
+    def decode(self, data):
+        """Return the note body in .mdz file data"""
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a compressed note file")
+        codec = data[len(MAGIC):len(MAGIC) + 1]
+        dictionary_id = data[len(MAGIC) + 1:HEADER_SIZE]
+        data = data[HEADER_SIZE:]
+        if codec == ZLIB:
+            dictionary = self._dictionary(dictionary_id)
+            if dictionary is None:
+                return zlib.decompress(data).decode('utf-8')
+            decompressor = zlib.decompressobj(zdict=dictionary)
+            return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+        if codec == ZSTD:
+            if zstandard is None:
+                raise ValueError("Reading zstd-compressed notes needs the zstandard package")
+            decompressor = zstandard.ZstdDecompressor(dict_data=self._zstd_dictionary(dictionary_id))
+            return decompressor.decompress(data).decode('utf-8')
+        raise ValueError(f"Unknown note compression {codec!r}")
+
+    def _dictionary(self, dictionary_id):
+        """Return a dictionary's bytes, None for NO_DICTIONARY"""
+        if dictionary_id == NO_DICTIONARY:
+            return None
+        with self._lock:
+            dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None:
+            dictionary = (self.dictionaries_dir / dictionary_id.hex()).read_bytes()
+            with self._lock:
+                self._dictionaries[dictionary_id] = dictionary
+        return dictionary
+
+    def _zstd_dictionary(self, dictionary_id):
+        """Return a dictionary prepared for zstd, None for NO_DICTIONARY
+
+        Prepared once, as preparing costs far more than compressing a note.
+        """
+        if dictionary_id == NO_DICTIONARY:
+            return None
+        with self._lock:
+            prepared = self._zstd_dictionaries.get(dictionary_id)
+        if prepared is None:
+            prepared = zstandard.ZstdCompressionDict(self._dictionary(dictionary_id))
+            prepared.precompute_compress(level=self.level)
+            with self._lock:
+                self._zstd_dictionaries[dictionary_id] = prepared
+        return prepared
+
+    def train(self, samples):
+        """Train a dictionary on note bodies and make it current
+
+        Returns the paths written, relative to the notes directory; none when
+        there are too few samples to train on.
+        """
+        samples = [content.encode('utf-8')[:SAMPLE_BYTES] for content in samples if content]
+        if len(samples) < MIN_SAMPLES:
+            return []
+        dictionary = b''
+        if zstandard is not None:
+            try:
+                dictionary = zstandard.train_dictionary(self.dictionary_bytes, samples).as_bytes()
+            except zstandard.ZstdError:
+                pass
+        if not dictionary:
+            dictionary = build_dictionary(samples, self.dictionary_bytes)
+        if not dictionary:
+            return []
+        dictionary_id = hashlib.sha256(dictionary).digest()[:len(NO_DICTIONARY)]
+        self.dictionaries_dir.mkdir(exist_ok=True)
+        write_file_atomic(self.dictionaries_dir / dictionary_id.hex(), dictionary, fsync=True)
+        write_file_atomic(self.dictionaries_dir / CURRENT, dictionary_id.hex(), fsync=True)
+        with self._lock:
+            self._dictionaries[dictionary_id] = dictionary
+            self.dictionary_id = dictionary_id
+        return [f"{DICTIONARY_DIR}/{dictionary_id.hex()}", f"{DICTIONARY_DIR}/{CURRENT}"]
+
+    def remove_unused_dictionaries(self):
+        """Delete the dictionaries no file uses; return their paths relative to the notes directory
+
+        Only call this once every file was converted to the current format
+        and dictionary. Uncompressed vaults keep none.
+        """
+        if not self.dictionaries_dir.is_dir():
+            return []
+        with self._lock:
+            if not self.compress:
+                self.dictionary_id = NO_DICTIONARY
+            keep = {self.dictionary_id.hex()} if self.compress else set()
+            if self.compress:
+                keep.add(CURRENT)
+            self._dictionaries = {key: value for key, value in self._dictionaries.items() if key.hex() in keep}
+            self._zstd_dictionaries = {
+                key: value for key, value in self._zstd_dictionaries.items() if key.hex() in keep
+            }
+        removed = []
+        for path in self.dictionaries_dir.iterdir():
+            if path.name not in keep:
+                path.unlink(missing_ok=True)
+                removed.append(f"{DICTIONARY_DIR}/{path.name}")
+        return removed
@@ -0,0 +1,314 @@
+"""Bulk import and export of notes as markdown folder trees and archives
+
+A vault is a folder tree of `.md` files. Each file is a note titled after
+its name, and the notes in a folder `X/` are the children of the note
+`X.md` next to it; a folder without such a file becomes an empty note.
+Export writes the same layout, so an exported vault imports back into the
+same tree. Archives are zip files or (optionally compressed) tar files of
+such a tree.
+
+Imports read one note at a time and exports are produced one note at a
+time, so neither ever holds the whole vault in memory. A note file larger
+than the source's max_bytes fails the import before anything is imported,
+by its declared size, and reads stop there in case that size is wrong.
+"""
+
+import io
+import os
+import posixpath
+import re
+import tarfile
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+MARKDOWN_SUFFIX = '.md'
+
+# Largest note file an import reads, unless the source is given another
+MAX_NOTE_BYTES = 16 * 1024 * 1024
+
+# Characters Windows does not allow in file names, and control characters
+UNSAFE_NAME = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+ARCHIVE_TYPES = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+    'tar.gz': 'application/gzip',
+}
+
+
+def archive_format(path):
+    """Return the archive format a file name asks for, or None for a directory"""
+    name = str(path).lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith(('.tar.gz', '.tgz')):
+        return 'tar.gz'
+    if name.endswith('.tar'):
+        return 'tar'
+    return None
+
+
+def _path_parts(path):
+    """Split an archive member path into its parts, or None to skip it
+
+    Hidden files and folders (the app's own `.objects`, `.attachments`, ...)
+    and paths leaving the archive root are skipped.
+    """
+    path = posixpath.normpath(path.replace('\\', '/')).lstrip('/')
+    parts = tuple(part for part in path.split('/') if part not in ('', '.'))
+    if not parts or any(part == '..' or part.startswith('.') or part == '__MACOSX' for part in parts):
+        return None
+    return parts
+
+
+def plan_import(paths):
+    """Map file paths of a vault to notes
+
+    Returns (key, parent_key, title, path) tuples with parents before
+    children; path is None for a folder without a note file. Keys are
+    tuples of path parts.
+    """
+    notes = {}
+    for path in paths:
+        parts = _path_parts(path)
+        if parts is None or not parts[-1].lower().endswith(MARKDOWN_SUFFIX):
+            continue
+        key = parts[:-1] + (parts[-1][:-len(MARKDOWN_SUFFIX)],)
+        notes[key] = path
+        # Every folder on the way is a note too
+        for depth in range(1, len(key)):
+            notes.setdefault(key[:depth], None)
+    return [
+        (key, key[:-1] or None, key[-1], notes[key])
+        for key in sorted(notes, key=lambda key: (len(key), [part.lower() for part in key]))
+    ]
+
+
+def _too_large(path, max_bytes):
+    return ValueError(f"{path} is larger than the {max_bytes} bytes allowed for a note")
+
+
+def _read_text(f, path, max_bytes):
+    """Read at most max_bytes from a binary file object as text"""
+    data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise _too_large(path, max_bytes)
+    return data.decode('utf-8', errors='replace')
+
+
+class DirectorySource:
+    """Notes from a folder tree on disk"""
+
+    def __init__(self, root, max_bytes=MAX_NOTE_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    def files(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+            relative = Path(dirpath).relative_to(self.root).as_posix()
+            for name in filenames:
+                yield name if relative == '.' else f"{relative}/{name}"
+
+    def size(self, path):
+        return (self.root / path).stat().st_size
+
+    def read(self, path):
+        with open(self.root / path, 'rb') as f:
+            return _read_text(f, path, self.max_bytes)
+
+    def modified(self, path):
+        return datetime.fromtimestamp((self.root / path).stat().st_mtime).isoformat()
+
+    def close(self):
+        pass
+
+
+class ZipSource:
+    """Notes from a zip archive"""
+
+    def __init__(self, fileobj, max_bytes=MAX_NOTE_BYTES):
+        self.archive = zipfile.ZipFile(fileobj)
+        self.max_bytes = max_bytes
+
+    def files(self):
+        return [info.filename for info in self.archive.infolist() if not info.is_dir()]
+
+    def size(self, path):
+        return self.archive.getinfo(path).file_size
+
+    def read(self, path):
+        with self.archive.open(path) as f:
+            return _read_text(f, path, self.max_bytes)
+
+    def modified(self, path):
+        return datetime(*self.archive.getinfo(path).date_time).isoformat()
+
+    def close(self):
+        self.archive.close()
+
+
+class TarSource:
+    """Notes from a tar archive, compressed or not"""
+
+    def __init__(self, fileobj, max_bytes=MAX_NOTE_BYTES):
+        self.archive = tarfile.open(fileobj=fileobj, mode='r:*')
+        self.max_bytes = max_bytes
+        self._members = {member.name: member for member in self.archive.getmembers() if member.isfile()}
+
+    def files(self):
+        return list(self._members)
+
+    def size(self, path):
+        return self._members[path].size
+
+    def read(self, path):
+        with self.archive.extractfile(self._members[path]) as f:
+            return _read_text(f, path, self.max_bytes)
+
+    def modified(self, path):
+        return datetime.fromtimestamp(self._members[path].mtime).isoformat()
+
+    def close(self):
+        self.archive.close()
+
+
+def open_archive(fileobj, max_bytes=MAX_NOTE_BYTES):
+    """Return the source for a seekable zip or tar file object
+
+    Raises ValueError for anything else.
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        return ZipSource(fileobj, max_bytes)
+    fileobj.seek(0)
+    try:
+        return TarSource(fileobj, max_bytes)
+    except tarfile.TarError:
+        raise ValueError("Not a zip or tar archive")
+
+
+def read_notes(source):
+    """Yield (key, parent_key, title, content, modified) for every note of a source
+
+    Content is read as the notes are consumed, one at a time. Raises
+    ValueError for a note file larger than the source allows, checked for
+    every file before the first note is yielded.
+    """
+    plan = plan_import(source.files())
+    for key, parent_key, title, path in plan:
+        if path is not None and source.size(path) > source.max_bytes:
+            raise _too_large(path, source.max_bytes)
+    for key, parent_key, title, path in plan:
+        if path is None:
+            yield key, parent_key, title, '', None
+        else:
+            yield key, parent_key, title, source.read(path), source.modified(path)
+
+
+def file_name(title):
+    """Return a portable file name (without suffix) for a note title"""
+    # Leading dots would hide the file, trailing ones are dropped by Windows
+    name = UNSAFE_NAME.sub('_', title).strip().strip('.')
+    return name[:120] or 'Untitled'
+
+
+def export_paths(notes):
+    """Return {note_id: path without suffix} for notes listed parents first
+
+    notes are dicts with id, title and parent_id; a parent missing from the
+    list puts a note at the top level. Siblings whose names collide (case
+    insensitively, as on Windows and macOS) get their id appended.
+    """
+    paths = {}
+    taken = set()
+    for note in notes:
+        parent = paths.get(note.get('parent_id'))
+        name = file_name(note['title'])
+        path = name if parent is None else f"{parent}/{name}"
+        if path.lower() in taken:
+            path = f"{path} ({note['id']})"
+        taken.add(path.lower())
+        paths[note['id']] = path
+    return paths
+
+
+class _Sink:
+    """Write-only file object handing on what an archive writer produces"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _timestamp(modified):
+    try:
+        return datetime.fromisoformat(modified)
+    except (TypeError, ValueError):
+        return datetime.now()
+
+
+def stream_zip(entries):
+    """Yield a zip archive of (path, content, modified) entries chunk by chunk"""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for path, content, modified in entries:
+            when = _timestamp(modified)
+            # Zip timestamps cannot go before 1980
+            info = zipfile.ZipInfo(path, date_time=max(when.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, content.encode('utf-8'))
+            data = sink.take()
+            if data:
+                yield data
+    yield sink.take()
+
+
+def stream_tar(entries, compression='gz'):
+    """Yield a tar archive of (path, content, modified) entries chunk by chunk"""
+    sink = _Sink()
+    with tarfile.open(fileobj=sink, mode=f"w|{compression}") as archive:
+        for path, content, modified in entries:
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            info.mtime = _timestamp(modified).timestamp()
+            archive.addfile(info, io.BytesIO(data))
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    yield sink.take()
+
+
+def stream_archive(entries, format):
+    """Yield an archive in one of ARCHIVE_TYPES"""
+    if format == 'zip':
+        return stream_zip(entries)
+    return stream_tar(entries, 'gz' if format == 'tar.gz' else '')
+
+
+def write_tree(entries, root):
+    """Write (path, content, modified) entries as files under a folder; return the count"""
+    root = Path(root)
+    count = 0
+    for path, content, modified in entries:
+        target = root / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(content)
+        when = _timestamp(modified).timestamp()
+        os.utime(target, (when, when))
+        count += 1
+    return count
@@ -0,0 +1,59 @@
+"""Monotonic change feed of note and tree mutations
+
+Every write records the touched note ids in the `changes` table with a new
+sequence number. Only the latest change per note is kept, so the table
+stays proportional to the number of notes and a client that has seen
+sequence N catches up by reading the rows with seq > N.
+"""
+
+CHANGES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_id INTEGER NOT NULL UNIQUE,
+        op TEXT NOT NULL
+    )
+'''
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+
+def create_change_feed(conn):
+    """Create the changes table, seeding it once from existing notes"""
+    conn.execute(CHANGES_SCHEMA)
+    seeded = conn.execute("SELECT value FROM meta WHERE key = 'changes_seeded'").fetchone()
+    if seeded is None:
+        conn.execute(
+            'INSERT OR REPLACE INTO changes (note_id, op) SELECT id, ? FROM notes ORDER BY id',
+            (UPSERT,)
+        )
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('changes_seeded', '1')")
+
+
+def record(conn, note_ids, op):
+    """Record a change for each note id and return the new sequence number"""
+    conn.executemany(
+        'INSERT OR REPLACE INTO changes (note_id, op) VALUES (?, ?)',
+        [(nid, op) for nid in note_ids]
+    )
+    return current_seq(conn)
+
+
+def current_seq(conn):
+    """Return the latest sequence number, 0 for an empty feed"""
+    row = conn.execute('SELECT MAX(seq) FROM changes').fetchone()
+    return row[0] or 0
+
+
+def since(conn, seq, limit):
+    """Return up to `limit` changes after `seq`, joined with current note metadata"""
+    rows = conn.execute('''
+        SELECT c.seq, c.note_id AS id, c.op, n.title, n.parent_id, n.position, n.created, n.modified,
+               n.version
+        FROM changes c
+        LEFT JOIN notes n ON n.id = c.note_id
+        WHERE c.seq > ?
+        ORDER BY c.seq
+        LIMIT ?
+    ''', (seq, limit)).fetchall()
+    return [dict(row) for row in rows]
@@ -0,0 +1,101 @@
+"""Helpers for running blocking storage work off the asyncio event loop"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+import weakref
+from contextlib import contextmanager
+
+
+class KeyedLocks:
+    """One lock per key (e.g. note id), created on demand
+
+    Locks are held weakly, so a key's lock disappears once no thread is
+    using it and the table never grows beyond the keys in use.
+    """
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+        self._guard = threading.Lock()
+
+    def __call__(self, key):
+        """Return the lock for key"""
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._locks[key] = lock
+            return lock
+
+
+class WriteGate:
+    """Admits any number of concurrent writers, or one exclusive holder
+
+    Used to quiesce all note writes for a moment, e.g. while the notes
+    directory is switched, without blocking readers.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._writers = 0
+        self._exclusive = False
+        # Counts the writes started, so a reader can tell whether one ran meanwhile
+        self._generation = 0
+
+    @contextmanager
+    def writer(self):
+        """Hold the gate shared for the duration of one write"""
+        with self._cond:
+            while self._exclusive:
+                self._cond.wait()
+            self._writers += 1
+            self._generation += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writers -= 1
+                if self._writers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        """Wait for in-flight writers to finish and keep new ones out"""
+        with self._cond:
+            while self._exclusive:
+                self._cond.wait()
+            self._exclusive = True
+            self._generation += 1
+            while self._writers:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+    def quiet_token(self):
+        """Return a token that changes whenever a write starts, or None during one
+
+        Data read while no write ran is consistent if the token read before
+        and after reading it is the same, and not None.
+        """
+        with self._cond:
+            if self._writers or self._exclusive:
+                return None
+            return self._generation
+
+
+async def run_blocking(note_app, func, *args, **kwargs):
+    """Run a blocking NoteApp call on that app's bounded storage thread pool
+
+    The call sees the request's context variables, such as the vault it
+    addresses.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        note_app.executor,
+        functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    )
@@ -0,0 +1,132 @@
+"""Pooled SQLite connection manager for the notes index"""
+
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from app.metrics import SQLITE_QUERY_SECONDS, SQLITE_TRANSACTION_SECONDS
+
+# Pragmas applied to every new connection unless overridden in config.ini
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': '5000',
+    'cache_size': '-16000',
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'OFF',
+}
+
+_PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+_PRAGMA_VALUE = re.compile(r'^-?[A-Za-z0-9_]+$')
+
+
+def _statement_kind(sql):
+    """Return the leading keyword of a statement (SELECT, INSERT, ...)"""
+    head = sql.lstrip()[:10].split(None, 1)
+    return head[0].upper() if head else 'OTHER'
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection that records how long each statement takes to execute"""
+
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            SQLITE_QUERY_SECONDS.observe(time.perf_counter() - start, statement=_statement_kind(sql))
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            SQLITE_QUERY_SECONDS.observe(time.perf_counter() - start, statement=_statement_kind(sql))
+
+
+class Database:
+    """Thread-safe pool of SQLite connections to one database file
+
+    Connections are created on demand and returned to the pool after use,
+    so each keeps its prepared statement cache across requests. Writes are
+    serialized through a single lock since SQLite allows only one writer;
+    with WAL journaling readers are never blocked by a writer.
+    """
+
+    def __init__(self, path, pragmas=None, pool_size=8, cached_statements=256):
+        self.path = path
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        for name, value in self.pragmas.items():
+            if not _PRAGMA_NAME.match(name) or not _PRAGMA_VALUE.match(str(value)):
+                raise ValueError(f"Invalid SQLite pragma: {name} = {value}")
+        self.pool_size = pool_size
+        self.cached_statements = cached_statements
+        self._pool = queue.LifoQueue()
+        # Reentrant, so writing() can hold it across a transaction's commit
+        self._write_lock = threading.RLock()
+        self._closed = False
+
+    def _connect(self):
+        """Open a new connection with the configured pragmas"""
+        conn = sqlite3.connect(
+            str(self.path),
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=TimedConnection
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed or self._pool.qsize() >= self.pool_size:
+                conn.close()
+            else:
+                self._pool.put(conn)
+
+    @contextmanager
+    def writing(self):
+        """Hold the write lock across transactions and what has to follow their commit in order"""
+        with self._write_lock:
+            yield
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection for a write transaction, committed on success"""
+        with self._write_lock, self.connection() as conn:
+            start = time.perf_counter()
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                SQLITE_TRANSACTION_SECONDS.observe(time.perf_counter() - start)
+
+    def close(self):
+        """Close every pooled connection"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
@@ -0,0 +1,132 @@
+"""Materialized paths and sibling positions for the note tree
+
+Every row of `notes` carries its path from the root, `/1/5/12/` for note
+12 under 5 under 1, so the rows of a subtree are one range of the path
+index: moving a subtree rewrites the paths of just its rows with one
+UPDATE and deleting it is one DELETE. `position` orders siblings; the
+positions are spaced POSITION_STEP apart so a note can usually be placed
+between two siblings without renumbering the others.
+
+All functions take an open connection so callers keep them in the same
+transaction as the rest of a write.
+"""
+
+# Gap between consecutive sibling positions
+POSITION_STEP = 1024
+
+# Path of a new row under the parent bound to the first parameter, for the
+# note id bound to the second
+NEW_PATH = "COALESCE((SELECT path FROM notes WHERE id = ?), '/') || ? || '/'"
+
+
+def create_schema(conn):
+    """Add the path and position columns and their indexes to older databases"""
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(notes)')}
+    if 'position' not in columns:
+        conn.execute('ALTER TABLE notes ADD COLUMN position INTEGER NOT NULL DEFAULT 0')
+    if 'path' not in columns:
+        conn.execute("ALTER TABLE notes ADD COLUMN path TEXT NOT NULL DEFAULT ''")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_notes_path ON notes(path)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_notes_parent ON notes(parent_id, position)')
+
+
+def is_built(conn):
+    """Return True once paths and positions have been filled in for this vault"""
+    row = conn.execute("SELECT value FROM meta WHERE key = 'paths_built'").fetchone()
+    return row is not None
+
+
+def build(conn, renumber=True):
+    """Compute every path from parent_id, and renumber positions if renumber
+
+    Notes whose parent is missing, or that sit on a parent_id cycle, get a
+    top-level path.
+    """
+    rows = conn.execute('SELECT id, parent_id FROM notes ORDER BY position, id').fetchall()
+    ids = {row['id'] for row in rows}
+    children = {}
+    for row in rows:
+        parent_id = row['parent_id'] if row['parent_id'] in ids else None
+        children.setdefault(parent_id, []).append(row['id'])
+
+    updates = []
+    stack = [(None, '/')]
+    while stack:
+        parent_id, parent_path = stack.pop()
+        for index, note_id in enumerate(children.pop(parent_id, ())):
+            path = f"{parent_path}{note_id}/"
+            updates.append((path, index * POSITION_STEP, note_id))
+            stack.append((note_id, path))
+    # Whatever is left hangs off a cycle
+    for parent_id, note_ids in children.items():
+        for note_id in note_ids:
+            updates.append((f"/{note_id}/", 0, note_id))
+
+    if renumber:
+        conn.executemany('UPDATE notes SET path = ?, position = ? WHERE id = ?', updates)
+    else:
+        conn.executemany('UPDATE notes SET path = ? WHERE id = ?', [(path, nid) for path, _, nid in updates])
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('paths_built', '1')")
+    return len(updates)
+
+
+def subtree_range(path):
+    """Return (low, high) bounds of the paths in the subtree at path
+
+    Paths hold digits and slashes only, and '0' sorts right after '/'.
+    """
+    return path, path[:-1] + '0'
+
+
+def path_of(conn, note_id):
+    """Return a note's path, '/' for the top level (note_id None)"""
+    if note_id is None:
+        return '/'
+    row = conn.execute('SELECT path FROM notes WHERE id = ?', (note_id,)).fetchone()
+    return row['path'] if row is not None and row['path'] else f"/{note_id}/"
+
+
+def move(conn, note_id, parent_id, position, version):
+    """Put a note under parent_id at position, carrying its subtree along"""
+    old = path_of(conn, note_id)
+    new = f"{path_of(conn, parent_id)}{note_id}/"
+    conn.execute(
+        'UPDATE notes SET parent_id = ?, position = ?, version = ? WHERE id = ?',
+        (parent_id, position, version, note_id)
+    )
+    if new != old:
+        conn.execute(
+            'UPDATE notes SET path = ? || substr(path, ?) WHERE path >= ? AND path < ?',
+            (new, len(old) + 1, *subtree_range(old))
+        )
+
+
+def set_positions(conn, items):
+    """Store (note_id, position) pairs after siblings were renumbered"""
+    conn.executemany(
+        'UPDATE notes SET position = ? WHERE id = ?',
+        [(position, note_id) for note_id, position in items]
+    )
+
+
+def delete_subtree(conn, note_id):
+    """Delete the rows of a note and all of its descendants; return the count"""
+    return conn.execute(
+        'DELETE FROM notes WHERE path >= ? AND path < ?', subtree_range(path_of(conn, note_id))
+    ).rowcount
+
+
+def position_between(before, after):
+    """Return a position strictly between two sibling positions, or None if there is no gap
+
+    before and after are None at the start and end of the siblings.
+    """
+    if before is None and after is None:
+        return 0
+    if after is None:
+        return before + POSITION_STEP
+    if before is None:
+        return after - POSITION_STEP
+    if after - before < 2:
+        return None
+    return (before + after) // 2
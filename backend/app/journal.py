@@ -0,0 +1,252 @@
+"""Append-only write-ahead journal for note content
+
+Content writes and deletes are appended to `journal.log` in the notes
+directory and made durable with one fsync per group of concurrent writers
+(group commit). A background thread periodically compacts the journal: the
+latest content of every journaled note is written atomically to its note
+file (`.md`, or `.mdz` when compressed, see app.bodystore) and the journal
+segment is discarded. On startup any leftover segments are replayed into
+the note files, so a crash at any point loses at most the writes that had
+not yet been acknowledged.
+
+Record layout: 4-byte big-endian payload length, 4-byte CRC32 of the
+payload, then the payload as UTF-8 JSON ({"op", "id", "content"}). A torn
+or corrupt record ends replay of its segment.
+"""
+
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+from app.metrics import FILE_BYTES_WRITTEN
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>II')
+
+WRITE = 'write'
+DELETE = 'delete'
+
+# Marker stored in the pending map for notes deleted but not yet compacted
+DELETED = object()
+
+
+def write_file_atomic(path, text, fsync=False):
+    """Replace path with text (or bytes) without ever leaving a truncated file behind"""
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    binary = isinstance(text, bytes)
+    with open(tmp, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as f:
+        f.write(text)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+        FILE_BYTES_WRITTEN.inc(os.fstat(f.fileno()).st_size, kind='note')
+    os.replace(tmp, path)
+
+
+def fsync_dir(directory):
+    """Make renames and unlinks in a directory durable (no-op where unsupported)"""
+    if os.name == 'nt':
+        return
+    fd = os.open(str(directory), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def encode_record(op, note_id, content=None):
+    """Serialize one journal record"""
+    payload = json.dumps(
+        {'op': op, 'id': note_id, 'content': content},
+        ensure_ascii=False
+    ).encode('utf-8')
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path):
+    """Yield (op, note_id, content) from a journal segment, stopping at a torn tail"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        length, crc = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        record = json.loads(payload.decode('utf-8'))
+        yield record['op'], record['id'], record['content']
+        offset = start + length
+
+
+class NoteJournal:
+    """Group-committed content journal with background compaction into note files"""
+
+    def __init__(self, notes_dir, bodies, compact_interval=5.0, compact_bytes=16 * 1024 * 1024,
+                 on_compact=None):
+        self.notes_dir = Path(notes_dir)
+        # The BodyStore compactions write the note files through
+        self.bodies = bodies
+        self.path = self.notes_dir / 'journal.log'
+        self.old_path = self.notes_dir / 'journal.old.log'
+        self.compact_interval = compact_interval
+        self.compact_bytes = compact_bytes
+        # Called with the ids whose files were rewritten by a compaction
+        self.on_compact = on_compact
+
+        # _lock guards the buffer and pending map; _flush_lock elects the
+        # thread that writes and fsyncs everything buffered so far
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._buffer = []
+        self._pending = {}
+        self._next_seq = 1
+        self._flushed_seq = 0
+        self._size = 0
+
+        self.replay()
+        self._file = open(self.path, 'ab')
+        self._stop = threading.Event()
+        # Set to compact before the interval is up, once the journal is large
+        self._wake = threading.Event()
+        self._compactor = threading.Thread(
+            target=self._compact_loop, name='note-journal-compactor', daemon=True
+        )
+        self._compactor.start()
+
+    def replay(self):
+        """Apply leftover journal segments to the note files, then discard them"""
+        latest = {}
+        for segment in (self.old_path, self.path):
+            if segment.exists():
+                for op, note_id, content in read_records(segment):
+                    latest[note_id] = content if op == WRITE else DELETED
+        if latest:
+            self._apply(latest)
+            logger.info("journal replayed notes=%d", len(latest))
+        for segment in (self.old_path, self.path):
+            if segment.exists():
+                segment.unlink()
+        fsync_dir(self.notes_dir)
+
+    def append(self, records):
+        """Durably journal a list of (op, note_id, content) records
+
+        Returns once the records are fsynced. Concurrent callers share a
+        single write and fsync.
+        """
+        data = b''.join(encode_record(op, nid, content) for op, nid, content in records)
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._buffer.append(data)
+            for op, nid, content in records:
+                self._pending[nid] = content if op == WRITE else DELETED
+
+        with self._flush_lock:
+            if self._flushed_seq < seq:
+                self._flush()
+
+        if self._size >= self.compact_bytes:
+            self._wake.set()
+
+    def _flush(self):
+        """Write and fsync everything buffered; caller holds _flush_lock"""
+        with self._lock:
+            batch = b''.join(self._buffer)
+            self._buffer = []
+            upto = self._next_seq - 1
+        if batch:
+            self._file.write(batch)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._size += len(batch)
+            FILE_BYTES_WRITTEN.inc(len(batch), kind='journal')
+        self._flushed_seq = upto
+
+    def pending(self, note_id):
+        """Return (True, content) for a journaled but uncompacted note, else (False, None)
+
+        content is None when the note's latest journaled change is a delete.
+        """
+        with self._lock:
+            if note_id not in self._pending:
+                return False, None
+            content = self._pending[note_id]
+        return True, (None if content is DELETED else content)
+
+    def compact(self):
+        """Write the latest journaled content into note files and drop the segment"""
+        with self._compact_lock:
+            # Rotate: new appends go to a fresh segment while this one is applied
+            with self._flush_lock:
+                self._flush()
+                if self._size == 0:
+                    return
+                self._file.close()
+                if self.old_path.exists():
+                    # A failed compaction left that segment unapplied: keep its
+                    # records and add this segment's after them
+                    with open(self.path, 'rb') as src, open(self.old_path, 'ab') as dst:
+                        shutil.copyfileobj(src, dst)
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    self.path.unlink()
+                else:
+                    os.replace(self.path, self.old_path)
+                self._file = open(self.path, 'ab')
+                self._size = 0
+                with self._lock:
+                    snapshot = dict(self._pending)
+
+            self._apply(snapshot)
+            # Report the rewritten files while they still count as pending
+            if self.on_compact is not None:
+                self.on_compact(list(snapshot))
+            self.old_path.unlink()
+            fsync_dir(self.notes_dir)
+
+            # Forget entries that were not rewritten again meanwhile
+            with self._lock:
+                for note_id, content in snapshot.items():
+                    if self._pending.get(note_id) is content:
+                        del self._pending[note_id]
+
+    def _apply(self, latest):
+        """Durably write or remove the note file for each note in latest"""
+        for note_id, content in latest.items():
+            if content is DELETED:
+                self.bodies.remove(note_id)
+            else:
+                self.bodies.write(note_id, content, fsync=True)
+
+    def _compact_loop(self):
+        """Compact periodically, or when woken by a large journal, until closed"""
+        while True:
+            self._wake.wait(self.compact_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error("journal compaction failed error=%r", e)
+
+    def close(self):
+        """Stop the compactor, compact everything and close the journal"""
+        self._stop.set()
+        self._wake.set()
+        self._compactor.join()
+        self.compact()
+        self._file.close()
+        if self.path.exists() and self.path.stat().st_size == 0:
+            self.path.unlink()
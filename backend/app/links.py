@@ -0,0 +1,258 @@
+"""Index of the links between notes
+
+Notes link to each other with `[[Title]]` wiki links (optionally
+`[[Title#heading|label]]`) and markdown links to a note file,
+`[text](12.md)`. The `note_links` table in note_index.db holds one row per
+distinct link of a note's current content, with the id of the note it
+points to, so backlinks and link graphs are index lookups instead of a scan
+of every body.
+
+A wiki link points to the note with that title (case-insensitively; the
+lowest id when several share it) and has no target while none exists.
+Wiki link targets are resolved when a link is stored and re-resolved for
+a title whenever a note takes or gives up that title, with one UPDATE over
+the links to that title. All functions take an open connection so callers
+keep index updates in the same transaction as the note row write.
+"""
+
+import re
+import string
+
+LINKS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS note_links (
+        source_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        target_id INTEGER,
+        target_title TEXT COLLATE NOCASE
+    )
+'''
+
+WIKI = 'wiki'
+FILE = 'file'
+
+# Code spans and fenced code blocks, whose brackets are not links
+CODE = re.compile(r'^(`{3,}|~{3,}).*?(?:^\1[ \t]*$|\Z)|`[^`\n]+`', re.MULTILINE | re.DOTALL)
+WIKI_LINK = re.compile(r'\[\[([^\[\]|#\n]+)(?:#[^\[\]|\n]*)?(?:\|[^\[\]\n]*)?\]\]')
+FILE_LINK = re.compile(r'\]\(\s*(?:\./)?(\d+)\.md(?:#[^)\s]*)?\s*\)')
+
+# Most ids bound to one statement, below SQLite's default variable limit
+CHUNK = 500
+
+# SQLite's NOCASE folds ASCII letters only
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Resolves a wiki link row to the note with its title
+RESOLVE = 'SELECT MIN(id) FROM notes WHERE title = {} COLLATE NOCASE'
+
+
+def create_schema(conn):
+    """Create the links table and the title index wiki links resolve through"""
+    conn.execute(LINKS_SCHEMA)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_note_links_source ON note_links(source_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_note_links_target ON note_links(target_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_note_links_title ON note_links(target_title)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_notes_title ON notes(title COLLATE NOCASE)')
+
+
+def is_built(conn):
+    """Return True once the index has been populated for this vault"""
+    row = conn.execute("SELECT value FROM meta WHERE key = 'links_built'").fetchone()
+    return row is not None
+
+
+def parse(content):
+    """Return the set of (kind, target) links in a note body
+
+    target is the linked title for wiki links and the note id for file links.
+    """
+    if '](' not in content and '[[' not in content:
+        return set()
+    text = CODE.sub('', content)
+    found = {}
+    # [[Title]] and [[title]] are the same link; the first spelling is kept
+    for title in WIKI_LINK.findall(text):
+        if title.strip():
+            found.setdefault(_key(WIKI, title.strip()), (WIKI, title.strip()))
+    for note_id in FILE_LINK.findall(text):
+        found.setdefault((FILE, int(note_id)), (FILE, int(note_id)))
+    return set(found.values())
+
+
+def _key(kind, target):
+    """Case-fold wiki titles the way the NOCASE column compares them"""
+    return (kind, target.translate(ASCII_LOWER) if kind == WIKI else target)
+
+
+def _insert(conn, rows):
+    """Store (source_id, kind, target) links, resolving wiki titles"""
+    wiki = [(source_id, target, target) for source_id, kind, target in rows if kind == WIKI]
+    files = [(source_id, target) for source_id, kind, target in rows if kind == FILE]
+    conn.executemany(f'''
+        INSERT INTO note_links (source_id, kind, target_id, target_title)
+        VALUES (?, '{WIKI}', ({RESOLVE.format('?')}), ?)
+    ''', wiki)
+    conn.executemany(
+        f"INSERT INTO note_links (source_id, kind, target_id) VALUES (?, '{FILE}', ?)",
+        files
+    )
+
+
+def build(conn, notes):
+    """Populate the index from (id, content) pairs and mark it built
+
+    The notes rows must be written already so wiki links resolve.
+    """
+    conn.execute('DELETE FROM note_links')
+    rows = []
+    for note_id, content in notes:
+        rows.extend((note_id, kind, target) for kind, target in parse(content))
+        if len(rows) >= CHUNK:
+            _insert(conn, rows)
+            rows = []
+    _insert(conn, rows)
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('links_built', '1')")
+
+
+def update_links(conn, note_id, content):
+    """Bring a note's stored links in line with its content
+
+    Only links that were added or removed are written.
+    """
+    links = {_key(kind, target): (kind, target) for kind, target in parse(content)}
+    stored = {}
+    for row in conn.execute(
+        'SELECT rowid, kind, target_id, target_title FROM note_links WHERE source_id = ?', (note_id,)
+    ):
+        target = row['target_title'] if row['kind'] == WIKI else row['target_id']
+        stored[_key(row['kind'], target)] = row['rowid']
+    conn.executemany(
+        'DELETE FROM note_links WHERE rowid = ?',
+        [(rowid,) for key, rowid in stored.items() if key not in links]
+    )
+    _insert(conn, [(note_id, kind, target) for key, (kind, target) in links.items() if key not in stored])
+
+
+def add_notes(conn, notes):
+    """Index the links of new (id, title, content) notes
+
+    Links to their titles from other notes now resolve to them too.
+    """
+    rows = [(note_id, kind, target) for note_id, _, content in notes for kind, target in parse(content)]
+    _insert(conn, rows)
+    retarget(conn, [title for _, title, _ in notes])
+
+
+def retarget(conn, titles, note_ids=()):
+    """Re-resolve the wiki links to any of titles, or pointing at note_ids
+
+    Called once the notes rows carry their new titles (or are deleted), so
+    links follow a renamed note, find a new note with their title, or fall
+    back to another note sharing it.
+    """
+    resolve = RESOLVE.format('note_links.target_title')
+    conn.executemany(f'''
+        UPDATE note_links SET target_id = ({resolve})
+        WHERE target_title = ? AND kind = '{WIKI}'
+    ''', [(title,) for title in set(titles)])
+    conn.executemany(f'''
+        UPDATE note_links SET target_id = ({resolve})
+        WHERE target_id = ? AND kind = '{WIKI}'
+    ''', [(nid,) for nid in note_ids])
+
+
+def forget(conn, note_ids):
+    """Drop the links of deleted notes and re-resolve the wiki links to them"""
+    conn.executemany('DELETE FROM note_links WHERE source_id = ?', [(nid,) for nid in note_ids])
+    retarget(conn, (), note_ids)
+
+
+def backlinks(conn, note_id):
+    """Return the notes linking to a note, by title"""
+    rows = conn.execute('''
+        SELECT n.id, n.title, COUNT(*) AS links
+        FROM note_links l
+        JOIN notes n ON n.id = l.source_id
+        WHERE l.target_id = ? AND l.source_id != l.target_id
+        GROUP BY n.id
+        ORDER BY n.title COLLATE NOCASE, n.id
+    ''', (note_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def outgoing(conn, note_id):
+    """Return a note's links; id is None for a link to no existing note"""
+    rows = conn.execute('''
+        SELECT l.kind, n.id, COALESCE(n.title, l.target_title, l.target_id || '.md') AS title
+        FROM note_links l
+        LEFT JOIN notes n ON n.id = l.target_id
+        WHERE l.source_id = ?
+        ORDER BY title COLLATE NOCASE, l.kind
+    ''', (note_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), CHUNK):
+        yield ids[i:i + CHUNK]
+
+
+def _edges(conn, note_ids, incoming):
+    """Yield the (source, target) links from, and optionally to, note_ids"""
+    for chunk in _chunks(note_ids):
+        marks = ','.join('?' * len(chunk))
+        yield from conn.execute(f'''
+            SELECT l.source_id, l.target_id FROM note_links l
+            JOIN notes n ON n.id = l.target_id
+            WHERE l.source_id IN ({marks})
+        ''', chunk)
+        if incoming:
+            yield from conn.execute(f'''
+                SELECT source_id, target_id FROM note_links
+                WHERE target_id IN ({marks})
+            ''', chunk)
+
+
+def neighborhood(conn, note_id, depth, max_nodes):
+    """Return the notes within depth links of a note, either direction
+
+    Returns (nodes, edges, truncated): nodes are dicts with id, title and
+    depth, edges the distinct (source, target) links between them. At most
+    max_nodes notes are returned, nearest first; truncated is True if more
+    were within reach.
+    """
+    depths = {note_id: 0}
+    edges = set()
+    frontier = [note_id]
+    truncated = False
+    for level in range(1, depth + 1):
+        reached = []
+        for source, target in _edges(conn, frontier, incoming=True):
+            edges.add((source, target))
+            for nid in (source, target):
+                if nid in depths:
+                    continue
+                if len(depths) >= max_nodes:
+                    truncated = True
+                    continue
+                depths[nid] = level
+                reached.append(nid)
+        frontier = reached
+        if not frontier:
+            break
+    # Links among the outermost ring are not found by the expansion
+    edges.update((source, target) for source, target in _edges(conn, frontier, incoming=False))
+
+    titles = {}
+    for chunk in _chunks(depths):
+        marks = ','.join('?' * len(chunk))
+        titles.update(conn.execute(f'SELECT id, title FROM notes WHERE id IN ({marks})', chunk).fetchall())
+    nodes = [
+        {'id': nid, 'title': titles[nid], 'depth': level}
+        for nid, level in sorted(depths.items(), key=lambda item: (item[1], item[0])) if nid in titles
+    ]
+    edges = sorted(
+        (source, target) for source, target in edges
+        if source != target and source in titles and target in titles
+    )
+    return nodes, edges, truncated
@@ -0,0 +1,22 @@
+"""Logging setup for the backend
+
+Modules log through logging.getLogger(__name__) with messages of the form
+"event key=value ...", so every line is both readable and easy to parse.
+Per-request detail is logged at DEBUG, which the default INFO level drops
+before any formatting or console I/O happens.
+"""
+
+import logging
+
+LOG_FORMAT = 'ts=%(asctime)s level=%(levelname)s logger=%(name)s %(message)s'
+
+
+def configure_logging(level='INFO'):
+    """Set the level of the app's loggers and give them a stderr handler once"""
+    logger = logging.getLogger('app')
+    logger.setLevel(level.upper())
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
+        logger.propagate = False
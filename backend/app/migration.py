@@ -0,0 +1,288 @@
+"""Background move of a vault to a new notes directory
+
+A MigrationJob copies the notes directory while the app keeps serving
+reads and writes: files are copied by a small thread pool in streamed
+chunks, or hard-linked when both directories are on the same filesystem.
+Notes saved meanwhile are reported to the job with mark_dirty(), and other
+files such as attachments with mark_files_dirty(), and copied again
+afterwards. Only the last catch-up holds the app's write gate, so
+writers are paused for as long as it takes to copy the notes changed since
+the previous catch-up, snapshot the SQLite index with the online backup API
+and switch the app over.
+
+Files whose size and mtime already match in the target are skipped, so a
+job interrupted by a crash or shutdown resumes where it stopped; the
+pending target is kept in config.ini until the switch completes.
+"""
+
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from app.bodystore import COMPRESSED, PLAIN
+from app.metrics import FILE_BYTES_WRITTEN, OPERATION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+COPYING = 'copying'
+FINALIZING = 'finalizing'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Rebuilt or recreated in the target rather than copied
+SKIP_FILES = {
+    'note_index.db', 'note_index.db-wal', 'note_index.db-shm',
+    'journal.log', 'journal.old.log', '.snapshot.json',
+}
+
+
+class MigrationCancelled(Exception):
+    """Raised inside a job when the app shuts down mid-migration"""
+
+
+def list_files(root):
+    """Return the paths, relative to root, of every file the vault owns"""
+    files = []
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        with os.scandir(os.path.join(root, rel)) as entries:
+            for entry in entries:
+                path = os.path.join(rel, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                elif entry.name not in SKIP_FILES and not entry.name.endswith('.tmp'):
+                    files.append(path)
+    return files
+
+
+def sync_file(src, dst, link):
+    """Make dst a copy of src; return the bytes copied (0 when already in sync)"""
+    try:
+        st = os.stat(src)
+    except FileNotFoundError:
+        # Deleted since it was listed; the final pass settles it
+        return 0
+    try:
+        dt = os.stat(dst)
+        if dt.st_size == st.st_size and dt.st_mtime_ns == st.st_mtime_ns:
+            return 0
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = dst + '.tmp'
+    if link:
+        try:
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            os.link(src, tmp)
+            os.replace(tmp, dst)
+            return st.st_size
+        except OSError:
+            pass
+    # copyfile streams in chunks (sendfile where available); copy2 keeps
+    # the mtime so a resumed job recognises the file as done
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+    return st.st_size
+
+
+class MigrationJob:
+    """Copies one notes directory to another and switches a NoteApp to it"""
+
+    def __init__(self, note_app, target, workers=4):
+        self.note_app = note_app
+        self.source = Path(note_app.notes_dir)
+        self.target = Path(target)
+        self.workers = max(1, workers)
+        self.state = PENDING
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_copied = 0
+        self.started = None
+        self.finished = None
+        self.error = None
+        self._dirty = set()
+        self._dirty_files = set()
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='notes-migration', daemon=True)
+
+    def start(self):
+        """Run the job on its own thread"""
+        self.started = datetime.now().isoformat()
+        self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self.state in (PENDING, COPYING, FINALIZING)
+
+    def status(self):
+        """Return a snapshot of the job's progress"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'source': str(self.source),
+                'target': str(self.target),
+                'files_total': self.files_total,
+                'files_done': self.files_done,
+                'bytes_copied': self.bytes_copied,
+                'started': self.started,
+                'finished': self.finished,
+                'error': self.error,
+            }
+
+    def cancel(self):
+        """Stop copying and wait for the job thread; the job resumes on next start"""
+        self._cancel.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def run(self):
+        with OPERATION_SECONDS.time(op='migration'):
+            self._run()
+
+    def _run(self):
+        try:
+            self.target.mkdir(parents=True, exist_ok=True)
+            self.note_app.save_migration_target(self.target)
+            self._set_state(COPYING)
+            # Later writes are marked dirty; earlier ones must reach their files first
+            if self.note_app.journal is not None:
+                self.note_app.journal.compact()
+            self._copy_pass()
+            self._sync_dirty()
+            self._set_state(FINALIZING)
+            with self.note_app.write_gate.exclusive():
+                self._finalize()
+            self.note_app.save_migration_target(None)
+            self._set_state(DONE)
+            logger.info("migration done source=%s target=%s files=%d bytes=%d", self.source, self.target, self.files_total, self.bytes_copied)
+        except MigrationCancelled:
+            self._set_state(CANCELLED)
+        except Exception as e:
+            logger.error("migration failed target=%s error=%r", self.target, e)
+            with self._lock:
+                self.error = str(e)
+            self.note_app.save_migration_target(None)
+            self._set_state(FAILED)
+
+    def _set_state(self, state):
+        with self._lock:
+            self.state = state
+            if state in (DONE, FAILED, CANCELLED):
+                self.finished = datetime.now().isoformat()
+
+    def _copy_pass(self):
+        """Copy every file in parallel while the app keeps running"""
+        files = list_files(self.source)
+        with self._lock:
+            self.files_total = len(files)
+            self.files_done = 0
+        link = os.stat(self.source).st_dev == os.stat(self.target).st_dev
+
+        def copy(rel):
+            if self._cancel.is_set():
+                raise MigrationCancelled()
+            copied = sync_file(str(self.source / rel), str(self.target / rel), link)
+            FILE_BYTES_WRITTEN.inc(copied, kind='migration')
+            with self._lock:
+                self.files_done += 1
+                self.bytes_copied += copied
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='notes-migration-copy') as pool:
+            # Consume the iterator so the first error is raised here
+            for _ in pool.map(copy, files):
+                pass
+
+    def mark_dirty(self, note_ids):
+        """Record notes written or deleted since the copy started"""
+        with self._lock:
+            self._dirty.update(note_ids)
+
+    def mark_files_dirty(self, paths):
+        """Record other files (paths relative to the notes directory) written or deleted"""
+        with self._lock:
+            self._dirty_files.update(paths)
+
+    def _sync_dirty(self):
+        """Copy the files and revision objects of notes marked dirty so far"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            dirty_files, self._dirty_files = self._dirty_files, set()
+        for rel in dirty_files:
+            src, dst = self.source / rel, self.target / rel
+            if src.exists():
+                sync_file(str(src), str(dst), link=False)
+            elif dst.exists():
+                dst.unlink()
+        if not dirty:
+            return
+        note_app = self.note_app
+        # Writes marked before this point are in the journal; flush them to files
+        if note_app.journal is not None:
+            note_app.journal.compact()
+
+        for note_id in dirty:
+            if self._cancel.is_set():
+                raise MigrationCancelled()
+            # Plain or compressed, whichever the note has now
+            for suffix in (PLAIN, COMPRESSED):
+                src = self.source / f"{note_id}{suffix}"
+                dst = self.target / f"{note_id}{suffix}"
+                if src.exists():
+                    sync_file(str(src), str(dst), link=False)
+                elif dst.exists():
+                    dst.unlink()
+
+        if note_app.revisions is None:
+            return
+        ids = sorted(dirty)
+        digests = set()
+        with note_app.db.connection() as conn:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT DISTINCT hash FROM revisions WHERE note_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                digests.update(row[0] for row in rows)
+        for digest in digests:
+            # Stop at the first base the target already has
+            for d in note_app.revisions.chain(digest):
+                rel = os.path.join('.objects', d[:2], d[2:])
+                if os.path.exists(self.target / rel):
+                    break
+                sync_file(str(self.source / rel), str(self.target / rel), link=False)
+
+    def _finalize(self):
+        """Copy the last changes, snapshot the index and switch; caller holds the write gate"""
+        self._sync_dirty()
+        self._backup_database(self.target / 'note_index.db')
+        self.note_app.switch_notes_dir(self.target)
+
+    def _backup_database(self, target):
+        """Copy a consistent snapshot of the index (tables, FTS, history) to target"""
+        tmp = target.with_name(target.name + '.tmp')
+        if tmp.exists():
+            tmp.unlink()
+        with self.note_app.db.connection() as src:
+            dst = sqlite3.connect(str(tmp))
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+        for suffix in ('-wal', '-shm'):
+            stale = target.with_name(target.name + suffix)
+            if stale.exists():
+                stale.unlink()
+        os.replace(tmp, target)
@@ -1,27 +1,278 @@
 """Note app models and database logic"""
 
 import json
+import logging
 import os
+import bisect
 import configparser
-import sqlite3
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
 from datetime import datetime
 
+from app import bulk, changes, hierarchy, links, search
+from app.blobstore import BlobStore, references
+from app.bodystore import BodyStore, MAX_SAMPLES, MIN_SAMPLES, NO_DICTIONARY
+from app.cache import ContentCache
+from app.concurrency import KeyedLocks, WriteGate
+from app.db import Database
+from app.journal import NoteJournal, WRITE, DELETE
+from app.log import configure_logging
+from app.metrics import timed
+from app.migration import MigrationJob
+from app.patch import StaleBase, apply_edits
+from app.records import NoteRecord, time_order
+from app.render import RenderStore
+from app.revisions import RevisionStore, content_hash, unified_diff
+from app.snapshot import read_snapshot, write_snapshot
+from app.watcher import NoteWatcher, ExternalEditConflict, title_from_markdown
+
+logger = logging.getLogger(__name__)
+
 # Default settings
 SCRIPT_DIR = Path(__file__).parent.parent.resolve()
 CONFIG_FILE = SCRIPT_DIR / 'config.ini'
 DEFAULT_NOTES_DIR = Path(os.path.expandvars(r'%APPDATA%\YZC_Note'))
 
+# Defaults for the optional tuning sections of config.ini
+DEFAULT_OPTIONS = {
+    'cache': {
+        # Load only metadata at startup and read note content on demand
+        'lazy_content': 'false',
+        'content_cache_entries': '1024',
+        'content_cache_bytes': str(64 * 1024 * 1024),
+        # Keep the encoded full listing and tree until the notes change
+        'response_cache': 'true',
+        'response_min_compress_bytes': '1024',
+    },
+    'storage': {
+        # Threads that run blocking file and SQLite work for the API
+        'io_threads': '8',
+        # Journal content writes (one fsync per group) and compact into .md files
+        'journal': 'false',
+        'journal_compact_seconds': '5',
+        'journal_compact_bytes': str(16 * 1024 * 1024),
+        # Notes written per transaction by bulk imports
+        'import_batch_size': '500',
+        # Largest note file read from an imported archive or folder
+        'import_max_note_bytes': str(16 * 1024 * 1024),
+        # Keep note bodies as compressed {id}.mdz files instead of .md files;
+        # after switching, existing bodies are converted in the background
+        'compress_content': 'false',
+        'compress_level': '6',
+        # Size of the dictionary, trained on the vault's notes, that
+        # compression is primed with
+        'dictionary_bytes': str(32 * 1024),
+    },
+    'history': {
+        # Keep note revisions in a content-addressed store under .objects/
+        'enabled': 'true',
+        'max_revisions_per_note': '100',
+        # Saves closer together than this replace the latest revision
+        'coalesce_seconds': '60',
+        # Deltas allowed before a full snapshot is stored
+        'max_delta_chain': '16',
+        # Minimum time between sweeps of unreferenced revision objects
+        'gc_interval_seconds': '3600',
+    },
+    'attachments': {
+        # Largest file accepted by POST /api/attachments/
+        'max_upload_bytes': str(100 * 1024 * 1024),
+        'compress_level': '6',
+        # Unlinked attachments are kept this long after their last upload
+        'gc_grace_seconds': '86400',
+        # Minimum time between sweeps of unlinked attachments
+        'gc_interval_seconds': '3600',
+    },
+    'watcher': {
+        # Pick up .md files edited, added or removed by other programs
+        # (only with uncompressed content)
+        'enabled': 'false',
+        'poll_seconds': '2',
+    },
+    'logging': {
+        # DEBUG, INFO, WARNING or ERROR
+        'level': 'INFO',
+    },
+    'migration': {
+        # Threads copying files when the notes directory is moved
+        'workers': '4',
+        # Set while a move is in progress so it resumes after a restart
+        'pending_target': '',
+    },
+    'database': {
+        'pool_size': '8',
+        'cached_statements': '256',
+    },
+    'render': {
+        # Rendered HTML kept in memory, and on disk under .render/ in the notes directory
+        'cache_entries': '256',
+        'cache_bytes': str(32 * 1024 * 1024),
+        'disk_bytes': str(256 * 1024 * 1024),
+        # Most recently modified notes rendered in the background at startup
+        'prerender_notes': '100',
+        # Render saved notes again in the background, so opening them is a cache read
+        'prerender_on_save': 'true',
+        # Minimum time between sweeps of .render/ down to disk_bytes
+        'gc_interval_seconds': '3600',
+    },
+    'vaults': {
+        # Serve each folder under this directory as a vault at /api/vaults/{name}/;
+        # empty turns vaults off
+        'directory': '',
+        # Idle vaults are closed, least recently used first, beyond this many
+        # open or once open vaults hold more than the memory budget
+        'max_open': '16',
+        'memory_budget_bytes': str(1024 * 1024 * 1024),
+        # Vaults unused this long are closed even within the limits
+        'idle_seconds': '1800',
+    },
+    # Any key here is applied as "PRAGMA key = value" on every connection
+    'database.pragmas': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': '5000',
+        'cache_size': '-16000',
+        'temp_store': 'MEMORY',
+    },
+}
+
+NOTES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS notes (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        parent_id INTEGER,
+        created TEXT NOT NULL,
+        modified TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 1,
+        position INTEGER NOT NULL DEFAULT 0,
+        path TEXT NOT NULL DEFAULT '',
+        FOREIGN KEY (parent_id) REFERENCES notes(id)
+    )
+'''
+
+# Key/value flags for one-time index builds
+META_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+'''
+
+# Fields a note listing can be projected to
+NOTE_FIELDS = ('id', 'title', 'content', 'parent_id', 'position', 'created', 'modified', 'version')
+
+# Rough in-memory cost of one note's record and index entries (see benchmarks/bench_memory.py)
+NOTE_MEMORY_BYTES = 512
+
+class VersionConflict(Exception):
+    """A conditional write expected a version of the note that is no longer current"""
+    
+    def __init__(self, note_id, current_version):
+        super().__init__(f"Note {note_id} is at version {current_version}")
+        self.note_id = note_id
+        self.current_version = current_version
+
+
 class NoteApp:
-    """Backend logic for the note-taking app"""
+    """Backend logic for the note-taking app
     
-    def __init__(self):
-        self.settings = self.load_settings()
+    notes_directory overrides the one in config.ini. global_settings=False
+    opens a notes directory of its own, such as a vault: the [settings] and
+    [migration] state of config.ini is neither read nor written, only the
+    tuning options apply.
+    """
+    
+    def __init__(self, notes_directory=None, global_settings=True):
+        self.options = self.load_options()
+        configure_logging(self.options.get('logging', 'level'))
+        self.global_settings = global_settings
+        if global_settings:
+            self.settings = self.load_settings()
+        elif notes_directory is None:
+            raise ValueError("A notes directory is required without the global settings")
+        else:
+            self.settings = {}
+        if notes_directory is not None:
+            self.settings['notes_directory'] = str(notes_directory)
+        self.lazy_content = self.options.getboolean('cache', 'lazy_content')
+        self.content_cache = None
+        if self.lazy_content:
+            self.content_cache = ContentCache(
+                max_entries=self.options.getint('cache', 'content_cache_entries'),
+                max_bytes=self.options.getint('cache', 'content_cache_bytes')
+            )
+        # _tree_lock guards the in-memory indexes; _note_lock(id) serializes
+        # writes to one note so different notes can be saved in parallel
+        self._tree_lock = threading.RLock()
+        self._note_lock = KeyedLocks()
+        # Writers pass the gate shared; a notes directory switch holds it alone
+        self.write_gate = WriteGate()
+        # Serializes moves and subtree deletes, so no move can create a cycle
+        # or escape a subtree being deleted; taken before any note lock
+        self._structure_lock = threading.Lock()
+        self.migration = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.options.getint('storage', 'io_threads'),
+            thread_name_prefix='noteapp-io'
+        )
         self.notes_dir = Path(self.settings['notes_directory'])
         self.notes_dir.mkdir(parents=True, exist_ok=True)
         self.db_path = self.notes_dir / 'note_index.db'
+        # Checked before anything opens the index and touches its files
+        snapshot = read_snapshot(self.notes_dir, self.db_path)
+        self.db = self.open_database(self.db_path)
+        self.watcher = None
+        self.bodies = self.open_bodies()
+        self.journal = self.open_journal()
+        self.revisions = self.open_revisions()
+        # Monotonic time of the last sweep of each kind; None runs the first one right away
+        self._last_revision_gc = None
+        self.attachments = self.open_attachments()
+        self._last_attachment_gc = None
+        # Rendered HTML by content hash, and the (version, hash) each note
+        # was last rendered at; the epoch advances whenever notes change
+        self.renders = self.open_renders()
+        self._rendered = {}
+        self._render_epoch = 0
+        self._prerender_pending = OrderedDict()
+        self._prerender_running = False
+        self._prerender_lock = threading.Lock()
+        self._last_render_gc = None
+        self.search_enabled = False
+        self.change_seq = 0
         self.init_database()
-        self.notes = self.load_notes()
+        if snapshot is None:
+            self.notes = self.load_notes()
+        else:
+            self.notes = snapshot
+            logger.info("notes loaded count=%d source=snapshot", len(self.notes))
+        self._build_index()
+        # Eager content mode reads note bodies in the background after startup
+        self.contents_loaded = threading.Event()
+        self._closing = threading.Event()
+        self._content_loader = None
+        if self.lazy_content:
+            self.contents_loaded.set()
+        else:
+            self._content_loader = threading.Thread(
+                target=self._load_contents, name='note-content-loader', daemon=True
+            )
+            self._content_loader.start()
+        # Bodies are converted after compress_content was switched
+        self._converter = None
+        if self._needs_conversion():
+            self._converter = threading.Thread(
+                target=self.convert_contents, name='note-content-converter', daemon=True
+            )
+            self._converter.start()
+        self.watcher = self.open_watcher()
+        self._resume_migration()
+        self._schedule_prerender(self._recently_modified(self.options.getint('render', 'prerender_notes')))
     
     def load_settings(self):
         """Load settings from config.ini, create with defaults if not found"""
@@ -32,22 +283,44 @@ class NoteApp:
                 config.read(CONFIG_FILE, encoding='utf-8')
                 if 'settings' in config and 'notes_directory' in config['settings']:
                     notes_dir = config['settings']['notes_directory']
-                    print(f"Loaded settings from config.ini: {notes_dir}")
+                    logger.info("settings loaded notes_dir=%s", notes_dir)
                     return {'notes_directory': notes_dir}
             except Exception as e:
-                print(f"Error loading settings: {e}")
+                logger.error("settings load failed error=%r", e)
         
         # Create config.ini with default settings if not found or invalid
         default_settings = {'notes_directory': str(DEFAULT_NOTES_DIR)}
         self.save_settings(default_settings)
-        print(f"Created config.ini with default settings: {default_settings['notes_directory']}")
+        logger.info("config created path=%s notes_dir=%s", CONFIG_FILE, default_settings['notes_directory'])
         return default_settings
     
+    def load_options(self):
+        """Load optional tuning sections from config.ini, falling back to defaults"""
+        config = configparser.ConfigParser()
+        config.read_dict(DEFAULT_OPTIONS)
+        
+        if CONFIG_FILE.exists():
+            try:
+                config.read(CONFIG_FILE, encoding='utf-8')
+            except Exception as e:
+                logger.error("options load failed error=%r", e)
+        
+        return config
+    
     def save_settings(self, settings):
         """Save settings to config.ini in script directory"""
+        if not self.global_settings:
+            self.settings = settings
+            return
         SCRIPT_DIR.mkdir(parents=True, exist_ok=True)
         
+        # Keep any other sections (cache tuning etc.) already in the file
         config = configparser.ConfigParser()
+        if CONFIG_FILE.exists():
+            try:
+                config.read(CONFIG_FILE, encoding='utf-8')
+            except Exception as e:
+                logger.error("config read failed error=%r", e)
         config['settings'] = {
             'notes_directory': settings.get('notes_directory', str(DEFAULT_NOTES_DIR))
         }
@@ -56,39 +329,153 @@ class NoteApp:
             config.write(f)
         
         self.settings = settings
-        print(f"Settings saved to config.ini")
+        logger.info("settings saved path=%s", CONFIG_FILE)
+    
+    def open_database(self, db_path):
+        """Open a pooled connection manager configured from config.ini"""
+        return Database(
+            db_path,
+            pragmas=dict(self.options['database.pragmas']),
+            pool_size=self.options.getint('database', 'pool_size'),
+            cached_statements=self.options.getint('database', 'cached_statements')
+        )
+    
+    def open_journal(self):
+        """Open (and replay) the content journal if enabled in config.ini"""
+        if not self.options.getboolean('storage', 'journal'):
+            return None
+        return NoteJournal(
+            self.notes_dir,
+            self.bodies,
+            compact_interval=self.options.getfloat('storage', 'journal_compact_seconds'),
+            compact_bytes=self.options.getint('storage', 'journal_compact_bytes'),
+            on_compact=self._on_files_written
+        )
+    
+    def open_bodies(self):
+        """Open the note body files of the notes directory, compressed if enabled in config.ini"""
+        return BodyStore(
+            self.notes_dir,
+            compress=self.options.getboolean('storage', 'compress_content'),
+            level=self.options.getint('storage', 'compress_level'),
+            dictionary_bytes=self.options.getint('storage', 'dictionary_bytes')
+        )
+    
+    def open_watcher(self):
+        """Start watching the notes directory if enabled in config.ini"""
+        if not self.options.getboolean('watcher', 'enabled'):
+            return None
+        if self.bodies.compress:
+            logger.warning("watcher disabled reason=compressed_content")
+            return None
+        # The first scan already goes through self.watcher, so it is set
+        # before the watcher thread starts
+        self.watcher = NoteWatcher(self, poll_seconds=self.options.getfloat('watcher', 'poll_seconds'))
+        return self.watcher.start()
+    
+    def open_revisions(self):
+        """Open the revision store if history is enabled in config.ini"""
+        if not self.options.getboolean('history', 'enabled'):
+            return None
+        return RevisionStore(
+            self.notes_dir,
+            max_revisions=self.options.getint('history', 'max_revisions_per_note'),
+            coalesce_seconds=self.options.getfloat('history', 'coalesce_seconds'),
+            max_chain=self.options.getint('history', 'max_delta_chain'),
+            references=references
+        )
+    
+    def open_attachments(self):
+        """Open the attachment store of the notes directory"""
+        return BlobStore(
+            self.notes_dir,
+            max_bytes=self.options.getint('attachments', 'max_upload_bytes'),
+            compress_level=self.options.getint('attachments', 'compress_level')
+        )
+    
+    def open_renders(self):
+        """Open the store of rendered notes in the notes directory"""
+        return RenderStore(
+            self.notes_dir,
+            max_entries=self.options.getint('render', 'cache_entries'),
+            max_bytes=self.options.getint('render', 'cache_bytes'),
+            max_disk_bytes=self.options.getint('render', 'disk_bytes')
+        )
     
+    def close(self):
+        """Stop the storage thread pool, flush the journal and close connections
+        
+        Finally writes the startup snapshot, once the index files are final.
+        """
+        self._closing.set()
+        if self._content_loader is not None:
+            self._content_loader.join()
+        if self._converter is not None:
+            self._converter.join()
+        if self.migration is not None:
+            self.migration.cancel()
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.executor.shutdown(wait=True)
+        if self.journal is not None:
+            self.journal.close()
+        if self.watcher is not None:
+            # After the journal's last compaction, which the watcher is told about
+            self.watcher.save_state()
+        self.db.close()
+        try:
+            write_snapshot(self.notes_dir, self.db_path, self.notes)
+        except Exception as e:
+            logger.error("snapshot write failed error=%r", e)
+    
+    @timed('init_database')
     def init_database(self):
         """Initialize SQLite database for notes index"""
         try:
-            conn = sqlite3.connect(str(self.db_path))
-            cursor = conn.cursor()
-            
-            # Create notes table with parent_id for tree structure
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS notes (
-                    id INTEGER PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    parent_id INTEGER,
-                    created TEXT NOT NULL,
-                    modified TEXT NOT NULL,
-                    FOREIGN KEY (parent_id) REFERENCES notes(id)
-                )
-            ''')
-            
-            conn.commit()
-            
-            # Check if database is empty and migrate from old index.json if exists
-            cursor.execute('SELECT COUNT(*) FROM notes')
-            count = cursor.fetchone()[0]
-            
-            if count == 0:
-                self._migrate_from_json(conn)
+            with self.db.transaction() as conn:
+                # Create notes table with parent_id for tree structure
+                conn.execute(NOTES_SCHEMA)
+                columns = {row['name'] for row in conn.execute('PRAGMA table_info(notes)')}
+                if 'version' not in columns:
+                    conn.execute('ALTER TABLE notes ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+                hierarchy.create_schema(conn)
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_notes_modified ON notes(modified)')
+                conn.execute(META_SCHEMA)
+                
+                # Check if database is empty and migrate from old index.json if exists
+                count = conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0]
+                
+                if count == 0:
+                    self._migrate_from_json(conn)
+                
+                if not hierarchy.is_built(conn):
+                    count = hierarchy.build(conn)
+                    logger.info("note paths built count=%d", count)
+                
+                self.search_enabled = search.create_search_index(conn)
+                if self.search_enabled and not search.is_built(conn):
+                    self._build_search_index(conn)
+                
+                links.create_schema(conn)
+                if not links.is_built(conn):
+                    self._build_links(conn)
+                
+                if self.revisions is not None and self.revisions.create_schema(conn):
+                    count = self.revisions.build_refs(conn)
+                    logger.info("revision links indexed revisions=%d", count)
+                
+                if self.attachments.create_schema(conn) and self.attachments.blobs_dir.exists():
+                    self._build_attachment_refs(conn)
+                
+                changes.create_change_feed(conn)
+                self.change_seq = changes.current_seq(conn)
+                
+                row = conn.execute("SELECT value FROM meta WHERE key = 'content_format'").fetchone()
+                self.bodies.mixed = (row['value'] if row is not None else '.md') != self.bodies.suffix
             
-            conn.close()
-            print(f"Database initialized at {self.db_path}")
+            logger.info("database initialized path=%s", self.db_path)
         except Exception as e:
-            print(f"Error initializing database: {e}")
+            logger.error("database init failed path=%s error=%r", self.db_path, e)
     
     def _migrate_from_json(self, conn):
         """Migrate notes from old index.json format to SQLite"""
@@ -112,216 +499,1420 @@ class NoteApp:
                         item.get('modified', '')
                     ))
                 
-                conn.commit()
-                print(f"Migrated {len(notes_index)} notes from index.json to SQLite")
+                logger.info("index.json migrated count=%d", len(notes_index))
             except Exception as e:
-                print(f"Error migrating from index.json: {e}")
+                logger.error("index.json migration failed error=%r", e)
+    
+    def _build_search_index(self, conn):
+        """Populate the full-text index once for an existing vault"""
+        rows = conn.execute('SELECT id, title FROM notes').fetchall()
+        search.build(conn, (
+            (row['id'], row['title'], self._read_content(row['id']))
+            for row in rows
+        ))
+        logger.info("search index built count=%d", len(rows))
     
+    def _build_links(self, conn):
+        """Index the links between notes once for an existing vault"""
+        rows = conn.execute('SELECT id FROM notes').fetchall()
+        links.build(conn, (
+            (row['id'], self._read_content(row['id'])) for row in rows
+        ))
+        logger.info("note links indexed notes=%d", len(rows))
+    
+    def _build_attachment_refs(self, conn):
+        """Index the attachment links of every note once for an existing vault"""
+        rows = conn.execute('SELECT id FROM notes').fetchall()
+        self.attachments.build_refs(conn, (
+            (row['id'], self._read_content(row['id'])) for row in rows
+        ))
+        logger.info("attachment links indexed notes=%d", len(rows))
+    
+    @timed('load_notes')
     def load_notes(self):
-        """Load notes from database and markdown files"""
+        """Load note metadata from the database
+        
+        Content is read from the markdown files on demand (lazy mode) or by
+        a background loader (see _load_contents).
+        """
         notes = []
         
         try:
-            conn = sqlite3.connect(str(self.db_path))
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM notes ORDER BY parent_id, id')
-            rows = cursor.fetchall()
+            with self.db.connection() as conn:
+                rows = conn.execute('SELECT * FROM notes ORDER BY parent_id, position, id').fetchall()
             
-            print(f"Loaded {len(rows)} notes from database")
+            logger.info("notes loaded count=%d source=database", len(rows))
             
             for row in rows:
-                md_file = self.notes_dir / f"{row['id']}.md"
-                content = ''
-                
-                if md_file.exists():
-                    with open(md_file, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                
-                notes.append({
-                    'id': int(row['id']),
-                    'title': row['title'],
-                    'content': content,
-                    'parent_id': row['parent_id'],
-                    'created': row['created'],
-                    'modified': row['modified']
-                })
-            
-            conn.close()
+                notes.append(NoteRecord(
+                    int(row['id']),
+                    row['title'],
+                    row['parent_id'],
+                    row['position'],
+                    row['created'],
+                    row['modified'],
+                    row['version']
+                ))
         except Exception as e:
-            print(f"Error loading notes: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("notes load failed error=%r", e)
         
         return notes
     
-    def save_notes(self):
-        """Save notes to markdown files and database"""
+    @timed('load_contents')
+    def _load_contents(self):
+        """Read every note body into memory after startup (eager content mode)"""
+        with self._tree_lock:
+            note_ids = [note.id for note in self.notes]
+        for note_id in note_ids:
+            if self._closing.is_set():
+                return
+            content = self._read_content(note_id)
+            with self._tree_lock:
+                note = self._notes_by_id.get(note_id)
+                # A save or reload meanwhile already set newer content
+                if note is not None and note.content is None:
+                    note.content = content
+        self.contents_loaded.set()
+        logger.info("note content loaded count=%d", len(note_ids))
+    
+    def _needs_conversion(self):
+        """Return True if note files are to be rewritten in another format or dictionary"""
+        if self.bodies.mixed:
+            return True
+        # Compressed vaults get their first dictionary once there are notes to train it on
+        return (self.bodies.compress and self.bodies.dictionary_id == NO_DICTIONARY
+                and len(self.notes) >= MIN_SAMPLES)
+    
+    @timed('convert_contents')
+    def convert_contents(self):
+        """Rewrite every note file in the configured format, compressed with a fresh dictionary
+        
+        Runs in the background after compress_content was switched, while
+        notes stay readable and writable. A conversion cut short by closing
+        the app carries on at the next start.
+        """
+        with self._tree_lock:
+            note_ids = [note.id for note in self.notes]
+        if self.bodies.compress and self.bodies.dictionary_id == NO_DICTIONARY:
+            step = max(1, len(note_ids) // MAX_SAMPLES)
+            self._mark_migrating_files(self.bodies.train(self._read_content(nid) for nid in note_ids[::step]))
+        converted = failed = 0
+        for note_id in note_ids:
+            if self._closing.is_set():
+                return
+            with self.write_gate.writer(), self._note_lock(note_id):
+                # Journaled notes reach their file in the new format when compacted
+                if note_id not in self._notes_by_id or (
+                        self.journal is not None and self.journal.pending(note_id)[0]):
+                    continue
+                try:
+                    # Looked up each time: the notes directory may have moved meanwhile
+                    if self.bodies.convert(note_id):
+                        converted += 1
+                        self._on_files_written([note_id])
+                        self._mark_migrating([note_id])
+                except Exception as e:
+                    failed += 1
+                    logger.error("note conversion failed id=%s error=%r", note_id, e)
+        if failed:
+            return
+        if self.journal is not None:
+            self.journal.compact()
+        with self.write_gate.writer():
+            with self.db.transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('content_format', ?)", (self.bodies.suffix,)
+                )
+            self.bodies.mixed = False
+            self._mark_migrating_files(self.bodies.remove_unused_dictionaries())
+        logger.info("note content converted format=%s converted=%d notes=%d",
+                    self.bodies.suffix, converted, len(note_ids))
+    
+    @timed('save_note')
+    def save_note(self, note, write_content=True, previous_content=None, publish=False):
+        """Save a single note: one markdown file write and one row upsert
+        
+        write_content=False indexes content that is already in the file.
+        When the database update fails the file gets previous_content back
+        (None removes it, for a new note) and the error is raised.
+        publish=True adds a new note to the in-memory notes once saved.
+        """
         self.notes_dir.mkdir(parents=True, exist_ok=True)
         
+        if write_content:
+            self._write_contents([(note['id'], note['content'])])
+        with self.db.writing():
+            try:
+                with self.db.transaction() as conn:
+                    previous = conn.execute('SELECT title FROM notes WHERE id = ?', (note['id'],)).fetchone()
+                    # Position and path of an existing note only change by a move
+                    conn.execute(f'''
+                        INSERT INTO notes (id, title, parent_id, position, created, modified, version, path)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, {hierarchy.NEW_PATH})
+                        ON CONFLICT(id) DO UPDATE SET
+                            title = excluded.title,
+                            created = excluded.created,
+                            modified = excluded.modified,
+                            version = excluded.version
+                    ''', (
+                        note['id'],
+                        note['title'],
+                        note.get('parent_id'),
+                        note.get('position', 0),
+                        note.get('created'),
+                        note.get('modified'),
+                        note.get('version', 1),
+                        note.get('parent_id'),
+                        note['id']
+                    ))
+                    if self.search_enabled:
+                        search.index_note(conn, note['id'], note['title'], note['content'])
+                    links.update_links(conn, note['id'], note['content'])
+                    if previous is None or previous['title'] != note['title']:
+                        # Wiki links to the old and the new title follow the rename
+                        links.retarget(conn, [note['title']] + ([previous['title']] if previous else []))
+                    pruned = False
+                    if self.revisions is not None:
+                        pruned = self.revisions.record(
+                            conn, note['id'], note['title'], note['content'], note.get('modified')
+                        )
+                    unlinked = self.attachments.update_refs(conn, note['id'], note['content'])
+                    seq = changes.record(conn, [note['id']], changes.UPSERT)
+            except Exception as e:
+                logger.error("note save failed id=%s error=%r", note['id'], e)
+                if write_content:
+                    self._restore_contents([(note['id'], previous_content)])
+                raise
+            if publish:
+                self._publish_note(note)
+            # Responses cached under this seq are built from the notes in memory,
+            # so it only becomes visible once they hold the change
+            self._advance_seq(seq)
+        self._mark_migrating([note['id']])
+        self._forget_renders([note['id']], prerender=self.options.getboolean('render', 'prerender_on_save'))
+        if pruned:
+            self._schedule_revision_gc()
+        if unlinked:
+            self._schedule_attachment_gc()
+    
+    @timed('remove_notes')
+    def _remove_notes(self, note_ids, subtree_id=None, moved=()):
+        """Remove the given notes' rows and markdown files
+        
+        The caller has already dropped the notes from memory and puts them
+        back when the database update fails, whose error is raised.
+        subtree_id names the root when note_ids is a whole subtree, whose
+        rows are then deleted as one range of the path index. moved lists
+        (id, parent_id, position, version) of notes moved in the same
+        transaction, e.g. children taking a removed note's place.
+        """
+        with self.db.writing():
+            try:
+                with self.db.transaction() as conn:
+                    for nid, parent_id, position, version in moved:
+                        hierarchy.move(conn, nid, parent_id, position, version)
+                    if moved:
+                        changes.record(conn, [nid for nid, _, _, _ in moved], changes.UPSERT)
+                    if subtree_id is not None:
+                        hierarchy.delete_subtree(conn, subtree_id)
+                    else:
+                        conn.executemany('DELETE FROM notes WHERE id = ?', [(nid,) for nid in note_ids])
+                    if self.search_enabled:
+                        search.unindex_notes(conn, note_ids)
+                    links.forget(conn, note_ids)
+                    if self.revisions is not None:
+                        self.revisions.forget(conn, note_ids)
+                    unlinked = self.attachments.forget(conn, note_ids)
+                    seq = changes.record(conn, note_ids, changes.DELETE)
+            except Exception as e:
+                logger.error("note delete failed ids=%s error=%r", note_ids, e)
+                raise
+            self._advance_seq(seq)
+        
+        self._remove_contents(note_ids)
+        self._mark_migrating(note_ids)
+        self._forget_renders(note_ids)
+        if self.revisions is not None:
+            self._schedule_revision_gc()
+        if unlinked:
+            self._schedule_attachment_gc()
+    
+    def _read_content(self, note_id):
+        """Read a note's file, returning '' if it does not exist"""
+        if self.journal is not None:
+            # Journaled content is newer than the file until compaction
+            found, content = self.journal.pending(note_id)
+            if found:
+                return content or ''
+        
+        content = self.bodies.read(note_id)
+        return '' if content is None else content
+    
+    def _write_contents(self, items):
+        """Write (note_id, content) pairs to the journal or atomically to note files"""
+        if not items:
+            return
+        if self.journal is not None:
+            self.journal.append([(WRITE, note_id, content) for note_id, content in items])
+            return
+        for note_id, content in items:
+            self.bodies.write(note_id, content)
+        self._on_files_written([note_id for note_id, _ in items])
+    
+    def _restore_contents(self, items):
+        """Put back (note_id, content) pairs after a failed save; None content removes the file"""
         try:
-            conn = sqlite3.connect(str(self.db_path))
-            cursor = conn.cursor()
-            
-            # Clear existing data
-            cursor.execute('DELETE FROM notes')
-            
-            # Save all notes
-            for note in self.notes:
-                # Save markdown file
-                md_file = self.notes_dir / f"{note['id']}.md"
-                with open(md_file, 'w', encoding='utf-8') as f:
-                    f.write(note['content'])
-                
-                # Save to database
-                cursor.execute('''
-                    INSERT INTO notes (id, title, parent_id, created, modified)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    note['id'],
-                    note['title'],
-                    note.get('parent_id'),
-                    note.get('created'),
-                    note.get('modified')
-                ))
-            
-            conn.commit()
-            conn.close()
-            print(f"Notes saved to database and markdown files")
+            self._write_contents([(nid, content) for nid, content in items if content is not None])
+            self._remove_contents([nid for nid, content in items if content is None])
         except Exception as e:
-            print(f"Error saving notes: {e}")
+            logger.error("note content restore failed ids=%s error=%r", [nid for nid, _ in items], e)
+    
+    def _remove_contents(self, note_ids):
+        """Remove notes' files, through the journal when enabled"""
+        if self.content_cache is not None:
+            for nid in note_ids:
+                self.content_cache.discard(nid)
+        if self.journal is not None:
+            self.journal.append([(DELETE, nid, None) for nid in note_ids])
+            return
+        for nid in note_ids:
+            self.bodies.remove(nid)
+        self._on_files_written(note_ids)
+    
+    def _file_is_stale(self, note_id):
+        """Return True if another program changed a note's file since the app last saw it"""
+        if self.watcher is None:
+            return False
+        # Journaled writes still have to reach the file, so the app owns it
+        if self.journal is not None and self.journal.pending(note_id)[0]:
+            return False
+        return self.watcher.is_stale(note_id)
+    
+    def _on_files_written(self, note_ids):
+        """Tell the watcher which note files the app itself changed"""
+        if self.watcher is not None:
+            self.watcher.note_written(note_ids)
+    
+    def _build_index(self):
+        """Build the id and parent->children indexes over self.notes"""
+        self._notes_by_id = {}
+        self._children = {}
+        self._max_id = 0
+        for note in self.notes:
+            self._notes_by_id[note.id] = note
+            self._children.setdefault(note.parent_id, []).append(note.id)
+            self._max_id = max(self._max_id, note.id)
+        for siblings in self._children.values():
+            siblings.sort(key=self._sibling_key)
+    
+    def _index_note(self, note):
+        """Add a note to the id and parent->children indexes"""
+        self._notes_by_id[note.id] = note
+        siblings = self._children.setdefault(note.parent_id, [])
+        bisect.insort(siblings, note.id, key=self._sibling_key)
+        self._max_id = max(self._max_id, note.id)
+    
+    def _sibling_key(self, note_id):
+        """Sort key of a note among its siblings"""
+        return self._notes_by_id[note_id].position, note_id
+    
+    def _append_position(self, parent_id):
+        """Return the position after the last child of parent_id; caller holds _tree_lock"""
+        siblings = self._children.get(parent_id)
+        if not siblings:
+            return 0
+        return self._notes_by_id[siblings[-1]].position + hierarchy.POSITION_STEP
     
+    def _unindex_notes(self, note_ids):
+        """Drop notes from the indexes and from self.notes"""
+        note_ids = set(note_ids)
+        for nid in note_ids:
+            note = self._notes_by_id.pop(nid)
+            self._children.pop(nid, None)
+            siblings = self._children.get(note.parent_id)
+            if siblings is not None and note.parent_id not in note_ids:
+                siblings.remove(nid)
+        self.notes = [n for n in self.notes if n.id not in note_ids]
+    
+    def _reindex_notes(self, notes):
+        """Put back notes dropped by _unindex_notes, given parents first"""
+        for note in notes:
+            self.notes.append(note)
+            self._index_note(note)
+    
+    def _subtree_ids(self, note_id):
+        """Return note_id and all of its descendants, parents before children"""
+        ids = [note_id]
+        i = 0
+        while i < len(ids):
+            ids.extend(self._children.get(ids[i], ()))
+            i += 1
+        return ids
+    
+    def has_note(self, note_id):
+        """Return True if a note with this id exists"""
+        return note_id in self._notes_by_id
+    
+    @timed('get_notes')
     def get_notes(self):
         """Return all notes"""
-        for note in self.notes:
-            if not isinstance(note['id'], int):
-                note['id'] = int(note['id'])
-        return self.notes
+        # Copied under the lock, converted to dicts outside it
+        with self._tree_lock:
+            rows = [(note.row(), note.content) for note in self.notes]
+        
+        # Full listings read straight from disk so they do not flush the cache
+        return [
+            NoteRecord.from_row(row).to_dict(self._read_content(row[0]) if content is None else content)
+            for row, content in rows
+        ]
+    
+    @timed('list_notes')
+    def list_notes(self, limit=100, after_id=None, fields=None, modified_since=None):
+        """Return one page of notes ordered by id, plus the last id for the next page
+        
+        fields restricts each note to the given keys (id is always included), so
+        metadata-only listings never touch note content. modified_since keeps only
+        notes modified after the given ISO timestamp. The second return value is
+        None when there are no more pages.
+        """
+        fields = NOTE_FIELDS if fields is None else ('id',) + tuple(f for f in fields if f != 'id')
+        columns = [f for f in fields if f != 'content']
+        
+        sql = f"SELECT {', '.join(columns)} FROM notes WHERE id > ?"
+        params = [after_id if after_id is not None else -1]
+        if modified_since is not None:
+            sql += ' AND modified > ?'
+            params.append(modified_since)
+        sql += ' ORDER BY id LIMIT ?'
+        # Fetch one extra row to know whether another page follows
+        params.append(limit + 1)
+        
+        with self.db.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        
+        has_more = len(rows) > limit
+        items = []
+        for row in rows[:limit]:
+            item = dict(row)
+            if 'content' in fields:
+                with self._tree_lock:
+                    note = self._notes_by_id.get(item['id'])
+                if note is None or note.content is None:
+                    item['content'] = self._read_content(item['id'])
+                else:
+                    item['content'] = note.content
+            items.append(item)
+        
+        next_after_id = items[-1]['id'] if has_more else None
+        return items, next_after_id
+    
+    @timed('get_note')
+    def get_note(self, note_id):
+        """Return a single note with its content, or None if not found"""
+        with self._tree_lock:
+            note = self._notes_by_id.get(note_id)
+            if note is None:
+                return None
+            note = note.to_dict(note.content)
+        if 'content' not in note:
+            note['content'] = self.get_note_content(note_id)
+        return note
+    
+    def get_note_version(self, note_id):
+        """Return a note's (version, created) without reading its content, or None"""
+        with self._tree_lock:
+            note = self._notes_by_id.get(note_id)
+            if note is None:
+                return None
+            return note.version, note.created
+    
+    def get_note_content(self, note_id):
+        """Return a note's content, going through the LRU cache in lazy mode"""
+        if not self.lazy_content:
+            with self._tree_lock:
+                note = self._notes_by_id.get(note_id)
+                content = None if note is None else note.content
+            if note is None:
+                return ''
+            if content is None:
+                return self._read_content(note_id)
+            return content
+        
+        content = self.content_cache.get(note_id)
+        if content is None:
+            content = self._read_content(note_id)
+            self.content_cache.put(note_id, content)
+        return content
+    
+    def cache_stats(self):
+        """Return content cache counters, or None when content is kept in memory"""
+        if self.content_cache is None:
+            return None
+        return self.content_cache.stats()
+    
+    def memory_usage(self):
+        """Return an estimate of the bytes the notes and their content hold in memory"""
+        with self._tree_lock:
+            notes = list(self.notes)
+        size = len(notes) * NOTE_MEMORY_BYTES
+        size += self.renders.memory.stats()['bytes']
+        if self.content_cache is not None:
+            return size + self.content_cache.stats()['bytes']
+        return size + sum(len(note.content or '') for note in notes)
+    
+    @timed('render_note')
+    def render_note(self, note_id):
+        """Return (content hash, JSON body) of a note rendered to HTML, or None if not found
+        
+        A note still at the version it was last rendered at is served from
+        the render store without reading its content; otherwise the content
+        is hashed and only rendered if no note had that content before.
+        """
+        with self._tree_lock:
+            note = self._notes_by_id.get(note_id)
+            if note is None:
+                return None
+            # Read before the content, so a stored (version, hash) pair
+            # never claims an older version than the content it hashes
+            version = note.version
+            epoch = self._render_epoch
+            known = self._rendered.get(note_id)
+        if known is not None and known[0] == version:
+            body = self.renders.get(known[1])
+            if body is not None:
+                return known[1], body
+        
+        content = self.get_note_content(note_id)
+        digest = content_hash(content)
+        body = self.renders.get(digest)
+        if body is None:
+            body = self.renders.render(digest, content)
+            self._schedule_render_gc()
+        with self._tree_lock:
+            # A note changed meanwhile may have been read half way through
+            if epoch == self._render_epoch and note_id in self._notes_by_id:
+                self._rendered[note_id] = (version, digest)
+        return digest, body
+    
+    def _forget_renders(self, note_ids, prerender=False):
+        """Drop what changed or deleted notes were rendered to; optionally render them again"""
+        with self._tree_lock:
+            self._render_epoch += 1
+            stale = [self._rendered.pop(nid, None) for nid in note_ids]
+        for known in stale:
+            if known is not None:
+                self.renders.discard(known[1])
+        if prerender:
+            self._schedule_prerender(note_ids)
+    
+    def _recently_modified(self, count):
+        """Return the ids of the count most recently modified notes, newest first"""
+        with self._tree_lock:
+            notes = heapq.nlargest(count, self.notes, key=lambda note: time_order(note.modified_at))
+        return [note.id for note in notes]
+    
+    def _schedule_prerender(self, note_ids):
+        """Render notes in the background on the storage pool, one pass at a time"""
+        with self._prerender_lock:
+            self._prerender_pending.update(dict.fromkeys(note_ids))
+            if self._prerender_running or not self._prerender_pending:
+                return
+            self._prerender_running = True
+        self._submit_background(self._prerender)
+    
+    def _prerender(self):
+        """Render the pending notes until none are left or the app closes"""
+        while True:
+            with self._prerender_lock:
+                if not self._prerender_pending or self._closing.is_set():
+                    self._prerender_running = False
+                    return
+                note_id, _ = self._prerender_pending.popitem(last=False)
+            try:
+                self.render_note(note_id)
+            except Exception as e:
+                logger.error("prerender failed id=%s error=%r", note_id, e)
+    
+    def _schedule_render_gc(self):
+        """Sweep the render store in the background, at most once per gc interval"""
+        now = time.monotonic()
+        last = self._last_render_gc
+        if last is not None and now - last < self.options.getfloat('render', 'gc_interval_seconds'):
+            return
+        self._last_render_gc = now
+        self._submit_background(self.gc_renders)
+    
+    def _submit_background(self, func):
+        """Run func on the storage pool unless the app is closing"""
+        if self._closing.is_set():
+            return
+        try:
+            self.executor.submit(func)
+        except RuntimeError:
+            pass  # the pool shut down since the check
+    
+    @timed('gc_renders')
+    def gc_renders(self):
+        """Delete the oldest rendered notes beyond the disk budget"""
+        try:
+            removed = self.renders.gc()
+            if removed:
+                logger.info("rendered notes collected removed=%d", removed)
+            return removed
+        except Exception as e:
+            logger.error("render gc failed error=%r", e)
+            return 0
     
+    @timed('build_tree')
     def get_notes_tree(self):
         """Return notes as a tree structure"""
-        def build_tree(parent_id=None):
-            tree = []
-            for note in self.notes:
-                if note.get('parent_id') == parent_id:
-                    tree.append({
-                        'id': note['id'],
-                        'title': note['title'],
-                        'parent_id': note.get('parent_id'),
-                        'children': build_tree(note['id'])
-                    })
-            return tree
-        
-        tree = build_tree()
-        print(f"Built tree with {len(tree)} root nodes from {len(self.notes)} total notes")
-        print(f"Note IDs: {[n['id'] for n in self.notes]}")
+        with self._tree_lock:
+            tree = self._tree_nodes(None)
+        
+        logger.debug("tree built roots=%d notes=%d", len(tree), len(self.notes))
+        return tree
+    
+    @timed('build_subtree')
+    def get_subtree(self, note_id, depth=None):
+        """Return one note as a tree node with its descendants, or None if not found
+        
+        depth limits the levels below the note (0 for the note alone), so the
+        cost is that of the returned nodes only.
+        """
+        with self._tree_lock:
+            note = self._notes_by_id.get(note_id)
+            if note is None:
+                return None
+            node = self._tree_node(note)
+            if depth is None or depth > 0:
+                node['children'] = self._tree_nodes(note_id, None if depth is None else depth - 1)
+            return node
+    
+    def _tree_node(self, note):
+        return {
+            'id': note.id,
+            'title': note.title,
+            'parent_id': note.parent_id,
+            'position': note.position,
+            'children': []
+        }
+    
+    def _tree_nodes(self, parent_id, depth=None):
+        """Return the children of parent_id as tree nodes down to depth more levels
+        
+        Caller holds _tree_lock.
+        """
+        tree = []
+        # Walk the children index iteratively so deep trees cannot hit the recursion limit
+        stack = [(parent_id, tree, 0)]
+        while stack:
+            parent_id, siblings, level = stack.pop()
+            for child_id in self._children.get(parent_id, ()):
+                node = self._tree_node(self._notes_by_id[child_id])
+                siblings.append(node)
+                if depth is None or level < depth:
+                    stack.append((child_id, node['children'], level + 1))
         return tree
     
+    def get_ancestors(self, note_id, depth=None):
+        """Return a note's ancestors from the top level down, or None if not found
+        
+        depth keeps only that many of the nearest ones.
+        """
+        ancestors = []
+        with self._tree_lock:
+            note = self._notes_by_id.get(note_id)
+            if note is None:
+                return None
+            seen = {note_id}
+            parent = self._notes_by_id.get(note.parent_id)
+            while parent is not None and parent.id not in seen and (depth is None or len(ancestors) < depth):
+                seen.add(parent.id)
+                ancestors.append({'id': parent.id, 'title': parent.title, 'parent_id': parent.parent_id})
+                parent = self._notes_by_id.get(parent.parent_id)
+        ancestors.reverse()
+        return ancestors
+    
+    @timed('search')
+    def search_notes(self, query, limit=20, offset=0):
+        """Full-text search over titles and content, best matches first"""
+        with self.db.connection() as conn:
+            total, results = search.search(conn, query, limit, offset)
+        return {
+            'query': query,
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'results': results
+        }
+    
+    def get_backlinks(self, note_id):
+        """Return the notes that link to a note"""
+        with self.db.connection() as conn:
+            return links.backlinks(conn, note_id)
+    
+    def get_links(self, note_id):
+        """Return the links in a note's content and the notes they point to"""
+        with self.db.connection() as conn:
+            return links.outgoing(conn, note_id)
+    
+    @timed('link_graph')
+    def get_link_graph(self, note_id, depth=1, max_nodes=200):
+        """Return the notes within depth links of a note and the links between them"""
+        with self.db.connection() as conn:
+            nodes, edges, truncated = links.neighborhood(conn, note_id, depth, max_nodes)
+        return {
+            'id': note_id,
+            'depth': depth,
+            'truncated': truncated,
+            'nodes': nodes,
+            'edges': [{'source': source, 'target': target} for source, target in edges]
+        }
+    
+    @timed('get_changes')
+    def get_changes(self, since=0, limit=1000):
+        """Return note and tree changes recorded after sequence number `since`
+        
+        Only the latest change per note is kept, so `since=0` returns every
+        note. seq is the sequence number to pass as `since` next time and
+        has_more is True when the page was cut off at `limit`.
+        """
+        with self.db.connection() as conn:
+            entries = changes.since(conn, since, limit)
+        
+        return {
+            'seq': entries[-1]['seq'] if entries else self.change_seq,
+            'has_more': len(entries) == limit,
+            # The client's sequence is from another database; it must reload
+            'reset': since > self.change_seq,
+            'changes': entries
+        }
+    
+    @timed('add_note')
     def add_note(self, title, content, parent_id=None):
         """Add a new note"""
-        note_id = max([n['id'] for n in self.notes], default=0) + 1
+        with self.write_gate.writer():
+            return self._add_note(title, content, parent_id)
+    
+    def _add_note(self, title, content, parent_id):
+        """Allocate an id and save a new note; caller holds the write gate"""
+        with self._tree_lock:
+            note_id = self._max_id + 1
+            self._max_id = note_id
+            position = self._append_position(parent_id)
         now = datetime.now().isoformat()
         note = {
             'id': note_id,
             'title': title,
             'content': content,
             'parent_id': parent_id,
+            'position': position,
             'created': now,
-            'modified': now
+            'modified': now,
+            'version': 1
         }
-        self.notes.append(note)
-        self.save_notes()
+        # The note only becomes visible once its file and row are written
+        with self._note_lock(note_id):
+            self.save_note(note, publish=True)
         return note
     
-    def update_note(self, note_id, title, content):
-        """Update an existing note"""
-        for note in self.notes:
-            if note['id'] == note_id:
-                note['title'] = title
-                note['content'] = content
-                note['modified'] = datetime.now().isoformat()
-                self.save_notes()
-                return note
-        return None
-    
-    def delete_note(self, note_id):
-        """Delete a note and its children"""
-        def delete_recursive(nid):
-            children = [n['id'] for n in self.notes if n.get('parent_id') == nid]
-            for child_id in children:
-                delete_recursive(child_id)
-            self.notes = [n for n in self.notes if n['id'] != nid]
-            md_file = self.notes_dir / f"{nid}.md"
-            if md_file.exists():
-                md_file.unlink()
-        
-        delete_recursive(note_id)
-        self.save_notes()
+    def _publish_note(self, note):
+        """Add a saved note to the in-memory notes and indexes"""
+        if self.lazy_content:
+            record = NoteRecord.from_dict(note)
+            self.content_cache.put(note['id'], note['content'])
+        else:
+            record = NoteRecord.from_dict(note, note['content'])
+        with self._tree_lock:
+            self.notes.append(record)
+            self._index_note(record)
+    
+    def _advance_seq(self, seq):
+        """Publish a committed change seq, only ever forward
+        
+        Callers hold db.writing() from the transaction on, so seqs are
+        published in commit order and each one after its notes are in memory.
+        """
+        if seq > self.change_seq:
+            self.change_seq = seq
+    
+    @timed('import_notes')
+    def import_notes(self, entries, parent_id=None):
+        """Add notes in bulk; return (count, ids of the top-level imported notes)
+        
+        entries yields (key, parent_key, title, content, modified) tuples with
+        parents before children, as app.bulk.read_notes does; a parent_key
+        of None puts the note under parent_id. Notes are saved in batches of
+        import_batch_size, each with one content write and one transaction.
+        """
+        batch_size = self.options.getint('storage', 'import_batch_size')
+        ids = {}
+        # Next free position under each parent the import adds to
+        positions = {}
+        root_ids = []
+        batch = []
+        count = 0
+        now = datetime.now().isoformat()
+        with self.write_gate.writer():
+            for key, parent_key, title, content, modified in entries:
+                note_parent_id = parent_id if parent_key is None else ids[parent_key]
+                with self._tree_lock:
+                    note_id = self._max_id + 1
+                    self._max_id = note_id
+                    if note_parent_id not in positions:
+                        positions[note_parent_id] = self._append_position(note_parent_id)
+                ids[key] = note_id
+                if parent_key is None:
+                    root_ids.append(note_id)
+                position = positions[note_parent_id]
+                positions[note_parent_id] = position + hierarchy.POSITION_STEP
+                batch.append({
+                    'id': note_id,
+                    'title': title,
+                    'content': content,
+                    'parent_id': note_parent_id,
+                    'position': position,
+                    'created': modified or now,
+                    'modified': modified or now,
+                    'version': 1
+                })
+                if len(batch) >= batch_size:
+                    self._save_new_notes(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._save_new_notes(batch)
+                count += len(batch)
+        
+        logger.info("notes imported count=%d parent_id=%s", count, parent_id)
+        return count, root_ids
+    
+    @timed('save_new_notes')
+    def _save_new_notes(self, notes):
+        """Save a batch of new notes in one transaction and publish them"""
+        note_ids = [note['id'] for note in notes]
+        with ExitStack() as stack:
+            # As in _add_note, the notes only become visible once written
+            for note_id in note_ids:
+                stack.enter_context(self._note_lock(note_id))
+            self._write_contents([(note['id'], note['content']) for note in notes])
+            with self.db.writing():
+                try:
+                    with self.db.transaction() as conn:
+                        # Parents come first, so each row finds its parent's path
+                        conn.executemany(f'''
+                            INSERT INTO notes (id, title, parent_id, position, created, modified, version, path)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, {hierarchy.NEW_PATH})
+                        ''', [
+                            (note['id'], note['title'], note['parent_id'], note['position'],
+                             note['created'], note['modified'], 1, note['parent_id'], note['id'])
+                            for note in notes
+                        ])
+                        if self.search_enabled:
+                            search.index_notes(conn, [(note['id'], note['title'], note['content']) for note in notes])
+                        links.add_notes(conn, [(note['id'], note['title'], note['content']) for note in notes])
+                        if self.revisions is not None:
+                            self.revisions.record_new(conn, [
+                                (note['id'], note['title'], note['content'], note['modified']) for note in notes
+                            ])
+                        self.attachments.build_refs(conn, [(note['id'], note['content']) for note in notes])
+                        seq = changes.record(conn, note_ids, changes.UPSERT)
+                except Exception as e:
+                    logger.error("notes save failed count=%d error=%r", len(notes), e)
+                    self._restore_contents([(nid, None) for nid in note_ids])
+                    raise
+                self._mark_migrating(note_ids)
+                for note in notes:
+                    self._publish_note(note)
+                # As in save_note, the seq follows the notes in memory
+                self._advance_seq(seq)
+    
+    def export_notes(self, note_id=None):
+        """Yield (path, content, modified) for every note, or for one note's subtree
+        
+        Paths follow the folder layout of app.bulk, parents first. Content is
+        read one note at a time, straight from disk in lazy mode so an
+        export does not flush the content cache.
+        """
+        with self._tree_lock:
+            if note_id is None:
+                # Notes whose parent is missing go to the top level too
+                roots = [n.id for n in self.notes if n.parent_id not in self._notes_by_id]
+            else:
+                roots = [note_id] if note_id in self._notes_by_id else []
+            order = []
+            for root in roots:
+                order.extend(self._subtree_ids(root))
+            notes = [
+                {'id': note.id, 'title': note.title, 'parent_id': note.parent_id, 'modified': note.modified}
+                for note in map(self._notes_by_id.get, order)
+            ]
+        
+        paths = bulk.export_paths(notes)
+        for note in notes:
+            current = self._notes_by_id.get(note['id'])
+            if current is None:
+                continue  # deleted since
+            content = current.content
+            if content is None:
+                content = self._read_content(note['id'])
+            yield f"{paths[note['id']]}{bulk.MARKDOWN_SUFFIX}", content, note['modified']
+    
+    @timed('update_note')
+    def update_note(self, note_id, title, content, expected_version=None):
+        """Update an existing note
+        
+        With expected_version, raises VersionConflict unless the note is
+        still at that version.
+        """
+        with self.write_gate.writer(), self._note_lock(note_id):
+            self._check_version(note_id, expected_version)
+            return self._replace_note(note_id, title, content)
+    
+    @timed('patch_note')
+    def patch_note(self, note_id, base_hash, edits, title=None, expected_version=None):
+        """Apply text edits made against the note content whose hash is base_hash
+        
+        edits are (start, end, text) tuples, see app.patch. Raises StaleBase
+        when the note has changed since the base, ValueError for edits that
+        do not fit the base. Returns the updated note, or None if not found.
+        """
+        with self.write_gate.writer(), self._note_lock(note_id):
+            if not self.has_note(note_id):
+                return None
+            self._check_version(note_id, expected_version)
+            current = self.get_note_content(note_id)
+            current_hash = content_hash(current)
+            if current_hash != base_hash:
+                raise StaleBase(note_id, current_hash)
+            if title is None:
+                title = self._notes_by_id[note_id].title
+            return self._replace_note(note_id, title, apply_edits(current, edits))
+    
+    def _check_version(self, note_id, expected_version):
+        """Raise VersionConflict if a note exists at another version than expected"""
+        if expected_version is None:
+            return
+        with self._tree_lock:
+            note = self._notes_by_id.get(note_id)
+            if note is not None and note.version != expected_version:
+                raise VersionConflict(note_id, note.version)
+    
+    def _replace_note(self, note_id, title, content):
+        """Store a note's new title and content; the caller holds the note's lock"""
+        # Never overwrite a file another program changed since it was read
+        if self._file_is_stale(note_id):
+            self.watcher.wake()
+            raise ExternalEditConflict(note_id)
+        
+        if not self.has_note(note_id):
+            return None
+        # Put back into the file and memory if the save fails
+        previous_content = self.get_note_content(note_id)
+        with self._tree_lock:
+            record = self._notes_by_id.get(note_id)
+            if record is None:
+                return None
+            
+            previous = record.title, record.modified_at, record.version
+            record.title = title
+            record.modified = datetime.now().isoformat()
+            record.version += 1
+            if self.lazy_content:
+                self.content_cache.put(note_id, content)
+            else:
+                record.content = content
+            note = record.to_dict(content)
+        
+        try:
+            self.save_note(note, previous_content=previous_content)
+        except Exception:
+            with self._tree_lock:
+                record.title, record.modified_at, record.version = previous
+                if self.lazy_content:
+                    self.content_cache.put(note_id, previous_content)
+                else:
+                    record.content = previous_content
+            raise
+        return note
+    
+    @timed('delete_note')
+    def delete_note(self, note_id, expected_version=None):
+        """Delete a note and its children
+        
+        With expected_version, raises VersionConflict unless the note is
+        still at that version.
+        """
+        with self.write_gate.writer():
+            return self._delete_subtree(note_id, expected_version)
+    
+    def _delete_subtree(self, note_id, expected_version=None):
+        """Delete a note and its children; caller holds the write gate"""
+        with self._structure_lock:
+            with self._tree_lock:
+                if note_id not in self._notes_by_id:
+                    return True
+                subtree = self._subtree_ids(note_id)
+            
+            # Wait for in-flight writes to the subtree so none of them can
+            # re-create a note after it is deleted; sorted to avoid deadlocks
+            locks = [self._note_lock(nid) for nid in sorted(subtree)]
+            for lock in locks:
+                lock.acquire()
+            try:
+                self._check_version(note_id, expected_version)
+                with self._tree_lock:
+                    if note_id not in self._notes_by_id:
+                        return True
+                    # Children added while waiting for the locks go too
+                    deleted = self._subtree_ids(note_id)
+                    records = [self._notes_by_id[nid] for nid in deleted]
+                    self._unindex_notes(deleted)
+                try:
+                    self._remove_notes(deleted, subtree_id=note_id)
+                except Exception:
+                    # The rows are still there, so are the notes
+                    with self._tree_lock:
+                        self._reindex_notes(records)
+                    raise
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
         return True
     
+    @timed('move_note')
+    def move_note(self, note_id, parent_id, index=None, expected_version=None):
+        """Move a note and its subtree under parent_id, at index among the siblings
+        
+        index None puts it last; with parent_id the note's current parent this
+        reorders it among its siblings. Raises ValueError when parent_id is
+        the note itself or one of its descendants and VersionConflict as
+        update_note does. Returns the note's metadata, or None if the note or
+        the parent does not exist.
+        """
+        with self.write_gate.writer(), self._structure_lock, self._note_lock(note_id):
+            self._check_version(note_id, expected_version)
+            return self._place_note(note_id, parent_id, index)
+    
+    @timed('reorder_note')
+    def reorder_note(self, note_id, index, expected_version=None):
+        """Move a note to index among its siblings; see move_note"""
+        with self.write_gate.writer(), self._structure_lock, self._note_lock(note_id):
+            self._check_version(note_id, expected_version)
+            with self._tree_lock:
+                note = self._notes_by_id.get(note_id)
+                if note is None:
+                    return None
+                parent_id = note.parent_id
+            return self._place_note(note_id, parent_id, index)
+    
+    def _place_note(self, note_id, parent_id, index):
+        """Move a note; caller holds the write gate, _structure_lock and the note's lock"""
+        with self._tree_lock:
+            note = self._notes_by_id.get(note_id)
+            if note is None or (parent_id is not None and parent_id not in self._notes_by_id):
+                return None
+            ancestor = parent_id
+            while ancestor is not None:
+                if ancestor == note_id:
+                    raise ValueError("A note cannot be moved under itself or its descendants")
+                ancestor = self._notes_by_id[ancestor].parent_id
+                ancestor = ancestor if ancestor in self._notes_by_id else None
+            
+            # What the move changes in memory, put back if the database update fails
+            previous = note.parent_id, note.position, note.version
+            siblings = [nid for nid in self._children.get(parent_id, ()) if nid != note_id]
+            previous_positions = [(nid, self._notes_by_id[nid].position) for nid in siblings]
+            index = len(siblings) if index is None else min(max(index, 0), len(siblings))
+            position = hierarchy.position_between(
+                self._notes_by_id[siblings[index - 1]].position if index > 0 else None,
+                self._notes_by_id[siblings[index]].position if index < len(siblings) else None
+            )
+            siblings.insert(index, note_id)
+            renumbered = []
+            if position is None:
+                # No gap left between the neighbours: space the siblings out again
+                for i, nid in enumerate(siblings):
+                    if nid != note_id:
+                        self._notes_by_id[nid].position = i * hierarchy.POSITION_STEP
+                        renumbered.append((nid, i * hierarchy.POSITION_STEP))
+                position = index * hierarchy.POSITION_STEP
+            
+            old_siblings = self._children.get(note.parent_id)
+            if old_siblings is not None:
+                old_siblings.remove(note_id)
+            self._children[parent_id] = siblings
+            note.parent_id = parent_id
+            note.position = position
+            note.version += 1
+            moved = note.to_dict()
+        
+        with self.db.writing():
+            try:
+                with self.db.transaction() as conn:
+                    hierarchy.move(conn, note_id, parent_id, position, moved['version'])
+                    hierarchy.set_positions(conn, renumbered)
+                    seq = changes.record(conn, [note_id] + [nid for nid, _ in renumbered], changes.UPSERT)
+            except Exception as e:
+                logger.error("note move failed id=%s parent_id=%s error=%r", note_id, parent_id, e)
+                with self._tree_lock:
+                    self._children[parent_id].remove(note_id)
+                    note.parent_id, note.position, note.version = previous
+                    for nid, old_position in previous_positions:
+                        self._notes_by_id[nid].position = old_position
+                    self._children[parent_id].sort(key=self._sibling_key)
+                    bisect.insort(self._children.setdefault(note.parent_id, []), note_id, key=self._sibling_key)
+                raise
+            self._advance_seq(seq)
+        logger.info("note moved id=%s parent_id=%s position=%d renumbered=%d",
+                    note_id, parent_id, position, len(renumbered))
+        return moved
+    
+    @timed('reload_external')
+    def reload_external(self, note_id, compare=True):
+        """Bring one note in line with its file after another program changed it
+        
+        A new file adds a note, a changed file replaces the note's content
+        and a removed file removes the note (its children move up a level).
+        compare=False saves the file's content even when the app holds the
+        same, for a file that changed while the app was stopped (the app
+        may have read it since). Returns True if the note changed.
+        """
+        md_file = self.notes_dir / f"{note_id}.md"
+        with self.write_gate.writer(), self._note_lock(note_id):
+            # Re-check under the note lock: the change may be the app's own write
+            if not self._file_is_stale(note_id):
+                return False
+            try:
+                with open(md_file, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                modified = datetime.fromtimestamp(md_file.stat().st_mtime).isoformat()
+            except FileNotFoundError:
+                content = None
+            
+            with self._tree_lock:
+                note = self._notes_by_id.get(note_id)
+            # With the journal on, content goes through it again so an older
+            # journaled version cannot overwrite the file at the next compaction
+            rewrite = self.journal is not None
+            changed = True
+            if content is None:
+                if note is None:
+                    changed = False
+                else:
+                    self._forget_external(note)
+            elif note is None:
+                with self._tree_lock:
+                    position = self._append_position(None)
+                note = {
+                    'id': note_id,
+                    'title': title_from_markdown(content) or f"Note {note_id}",
+                    'content': content,
+                    'parent_id': None,
+                    'position': position,
+                    'created': modified,
+                    'modified': modified,
+                    'version': 1
+                }
+                self.save_note(note, write_content=rewrite, previous_content=content, publish=True)
+            elif compare and content == self._known_content(note):
+                changed = False
+            else:
+                record = note
+                previous_content = self._known_content(record)
+                with self._tree_lock:
+                    previous = record.modified_at, record.version
+                    record.modified = modified
+                    record.version += 1
+                    if self.lazy_content:
+                        self.content_cache.put(note_id, content)
+                    else:
+                        record.content = content
+                    note = record.to_dict(content)
+                try:
+                    self.save_note(note, write_content=rewrite, previous_content=content)
+                except Exception:
+                    # The file stays unreconciled, so the watcher tries again
+                    with self._tree_lock:
+                        record.modified_at, record.version = previous
+                        if not self.lazy_content:
+                            record.content = previous_content
+                        elif previous_content is None:
+                            self.content_cache.discard(note_id)
+                        else:
+                            self.content_cache.put(note_id, previous_content)
+                    raise
+            
+            self.watcher.note_written([note_id])
+        return changed
+    
+    def _known_content(self, note):
+        """Return the content the app holds for a note, or None if only the file has it"""
+        if not self.lazy_content:
+            return note.content
+        if self.journal is not None:
+            found, content = self.journal.pending(note.id)
+            if found:
+                return content
+        return self.content_cache.get(note.id)
+    
+    def _forget_external(self, note):
+        """Remove a note whose file was deleted, moving its children to its parent"""
+        note_id = note.id
+        parent_id = note.parent_id
+        moved = []
+        with self._tree_lock:
+            children = [self._notes_by_id[child_id] for child_id in self._children.get(note_id, ())]
+            previous = [(child.position, child.version) for child in children]
+            self._unindex_notes([note_id])
+            # The children go after the parent's own, in their order
+            position = self._append_position(parent_id)
+            for child in children:
+                child.parent_id = parent_id
+                child.position = position
+                child.version += 1
+                self._children.setdefault(parent_id, []).append(child.id)
+                moved.append((child.id, parent_id, position, child.version))
+                position += hierarchy.POSITION_STEP
+        try:
+            self._remove_notes([note_id], moved=moved)
+        except Exception:
+            # The file stays unreconciled, so the watcher tries again
+            with self._tree_lock:
+                self._reindex_notes([note])
+                for child, (child_position, version) in zip(children, previous):
+                    self._children[parent_id].remove(child.id)
+                    child.parent_id, child.position, child.version = note_id, child_position, version
+                    self._index_note(child)
+            raise
+    
+    def list_revisions(self, note_id):
+        """Return a note's revisions, newest first"""
+        with self.db.connection() as conn:
+            return self.revisions.list(conn, note_id)
+    
+    def get_revision(self, note_id, revision_id):
+        """Return one revision of a note with its content, or None"""
+        with self.db.connection() as conn:
+            return self.revisions.get(conn, note_id, revision_id)
+    
+    def diff_revision(self, note_id, revision_id, against_id=None):
+        """Return a unified diff from a revision to another one or to the current note"""
+        old = self.get_revision(note_id, revision_id)
+        if old is None:
+            return None
+        
+        if against_id is None:
+            new = self.get_note(note_id)
+            new_label = 'current'
+        else:
+            new = self.get_revision(note_id, against_id)
+            new_label = f"revision {against_id}"
+        if new is None:
+            return None
+        
+        return {
+            'note_id': note_id,
+            'revision_id': revision_id,
+            'against_id': against_id,
+            'diff': unified_diff(old['content'], new['content'], f"revision {revision_id}", new_label)
+        }
+    
+    def restore_revision(self, note_id, revision_id):
+        """Make a revision the note's current title and content"""
+        revision = self.get_revision(note_id, revision_id)
+        if revision is None:
+            return None
+        return self.update_note(note_id, revision['title'], revision['content'])
+    
+    def _schedule_revision_gc(self):
+        """Sweep revision objects in the background, at most once per gc interval"""
+        now = time.monotonic()
+        last = self._last_revision_gc
+        if last is not None and now - last < self.options.getfloat('history', 'gc_interval_seconds'):
+            return
+        self._last_revision_gc = now
+        self.executor.submit(self.gc_revisions)
+    
+    @timed('gc_revisions')
+    def gc_revisions(self):
+        """Remove revision objects no revision refers to"""
+        store, db = self.revisions, self.db
+        try:
+            # The object walk only reads; saves are held up just for the re-check and deletes
+            with db.connection() as conn:
+                live, unreachable = store.garbage(conn)
+            if not unreachable:
+                return 0
+            with self.write_gate.writer():
+                if self.revisions is not store:
+                    return 0  # the notes directory moved meanwhile
+                with db.transaction() as conn:
+                    removed = store.delete(conn, live, unreachable)
+            if removed:
+                logger.info("revision objects collected removed=%d", removed)
+            return removed
+        except Exception as e:
+            logger.error("revision gc failed error=%r", e)
+            return 0
+    
+    @timed('add_attachment')
+    def add_attachment(self, source, mime):
+        """Store an uploaded file object; return the attachment's metadata
+        
+        Raises AttachmentTooLarge when it exceeds the upload limit.
+        """
+        # Held for the whole upload so the blob cannot land in a directory being switched away
+        with self.write_gate.writer():
+            store = self.attachments
+            tmp, digest, size, stored_size, compressed = store.receive(source, mime)
+            try:
+                with self.db.transaction() as conn:
+                    attachment = store.commit(conn, tmp, digest, size, stored_size, compressed, mime)
+            finally:
+                tmp.unlink(missing_ok=True)
+            self._mark_migrating_files([store.relative_path(digest)])
+        return attachment
+    
+    def get_attachment(self, digest):
+        """Return an attachment's metadata, or None"""
+        with self.db.connection() as conn:
+            return self.attachments.get(conn, digest)
+    
+    def _schedule_attachment_gc(self):
+        """Sweep unlinked attachments in the background, at most once per gc interval"""
+        now = time.monotonic()
+        last = self._last_attachment_gc
+        if last is not None and now - last < self.options.getfloat('attachments', 'gc_interval_seconds'):
+            return
+        self._last_attachment_gc = now
+        self.executor.submit(self.gc_attachments)
+    
+    @timed('gc_attachments')
+    def gc_attachments(self):
+        """Remove attachments that no note or kept revision links to"""
+        grace = self.options.getfloat('attachments', 'gc_grace_seconds')
+        try:
+            with self.db.connection() as conn:
+                candidates = self.attachments.garbage(conn, grace)
+                if candidates and self.revisions is not None:
+                    # Restoring an old revision must not bring back a broken link
+                    linked = self.revisions.linked(conn)
+                    candidates = [digest for digest in candidates if digest not in linked]
+            if not candidates:
+                return 0
+            with self.write_gate.writer(), self.db.transaction() as conn:
+                removed = self.attachments.delete(conn, candidates, grace)
+            self._mark_migrating_files([self.attachments.relative_path(digest) for digest in removed])
+            if removed:
+                logger.info("attachments collected removed=%d", len(removed))
+            return len(removed)
+        except Exception as e:
+            logger.error("attachment gc failed error=%r", e)
+            return 0
+    
     def get_settings(self):
-        """Return current settings"""
-        return self.settings
+        """Return current settings with the progress of any notes directory move"""
+        return {**self.settings, 'migration': self.get_migration()}
     
     def update_settings(self, settings):
-        """Update settings"""
+        """Update settings
+        
+        Moving to another notes directory starts a background migration;
+        notes_directory changes once it completes. Returns None while a
+        previous migration is still running.
+        """
         new_dir = Path(settings.get('notes_directory', str(DEFAULT_NOTES_DIR)))
         new_dir.mkdir(parents=True, exist_ok=True)
         
-        if str(new_dir) != str(self.notes_dir):
-            self._migrate_notes(new_dir)
-            self.notes_dir = new_dir
-            self.db_path = self.notes_dir / 'note_index.db'
-            self.init_database()
-            self.notes = self.load_notes()
+        if new_dir.resolve() != self.notes_dir.resolve():
+            source, target = self.notes_dir.resolve(), new_dir.resolve()
+            if source in target.parents or target in source.parents:
+                raise ValueError("The new notes directory cannot be inside the current one or contain it")
+            if self.start_migration(new_dir) is None:
+                return None
+            return self.get_settings()
         
         settings['notes_directory'] = str(new_dir)
         self.save_settings(settings)
-        return self.settings
+        return self.get_settings()
     
-    def _migrate_notes(self, new_dir):
-        """Migrate notes to new directory"""
-        new_dir.mkdir(parents=True, exist_ok=True)
+    def start_migration(self, new_dir):
+        """Start moving the vault to new_dir in the background, or return None if busy"""
+        with self._tree_lock:
+            if self.migration is not None and self.migration.running:
+                return None
+            self.migration = MigrationJob(
+                self, new_dir, workers=self.options.getint('migration', 'workers')
+            ).start()
+            return self.migration
+    
+    def get_migration(self):
+        """Return the progress of the latest notes directory move, or None"""
+        if self.migration is None:
+            return None
+        return self.migration.status()
+    
+    def _mark_migrating(self, note_ids):
+        """Tell a running notes directory move to copy these notes again"""
+        migration = self.migration
+        if migration is not None and migration.running:
+            migration.mark_dirty(note_ids)
+    
+    def _mark_migrating_files(self, paths):
+        """Tell a running notes directory move to copy (or delete) these other files again"""
+        migration = self.migration
+        if migration is not None and migration.running:
+            migration.mark_files_dirty(paths)
+    
+    def _resume_migration(self):
+        """Restart a notes directory move interrupted by a shutdown or crash"""
+        if not self.global_settings:
+            return
+        target = self.options.get('migration', 'pending_target')
+        if target and Path(target).resolve() != self.notes_dir.resolve():
+            logger.info("migration resuming target=%s", target)
+            self.start_migration(Path(target))
+    
+    def save_migration_target(self, target):
+        """Remember (or with None, forget) the target of an unfinished move in config.ini"""
+        if not self.global_settings:
+            self.options.set('migration', 'pending_target', '' if target is None else str(target))
+            return
+        config = configparser.ConfigParser()
+        if CONFIG_FILE.exists():
+            try:
+                config.read(CONFIG_FILE, encoding='utf-8')
+            except Exception as e:
+                logger.error("config read failed error=%r", e)
+        if not config.has_section('migration'):
+            config.add_section('migration')
+        config['migration']['pending_target'] = '' if target is None else str(target)
         
-        for note in self.notes:
-            old_file = self.notes_dir / f"{note['id']}.md"
-            new_file = new_dir / f"{note['id']}.md"
-            if old_file.exists():
-                with open(old_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                with open(new_file, 'w', encoding='utf-8') as f:
-                    f.write(content)
+        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+            config.write(f)
+        self.options.set('migration', 'pending_target', config['migration']['pending_target'])
+    
+    @timed('switch_notes_dir')
+    def switch_notes_dir(self, new_dir):
+        """Reopen the storage on a migrated copy of the notes directory
         
-        new_db_path = new_dir / 'note_index.db'
-        try:
-            conn = sqlite3.connect(str(new_db_path))
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS notes (
-                    id INTEGER PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    parent_id INTEGER,
-                    created TEXT NOT NULL,
-                    modified TEXT NOT NULL,
-                    FOREIGN KEY (parent_id) REFERENCES notes(id)
-                )
-            ''')
-            
-            for note in self.notes:
-                cursor.execute('''
-                    INSERT INTO notes (id, title, parent_id, created, modified)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    note['id'],
-                    note['title'],
-                    note.get('parent_id'),
-                    note.get('created'),
-                    note.get('modified')
-                ))
-            
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            print(f"Error migrating database: {e}")
+        The caller holds the write gate, so the in-memory notes and content
+        cache already match the copy and are kept as they are.
+        """
+        with self._tree_lock:
+            if self.journal is not None:
+                self.journal.close()
+            self.db.close()
+            self.notes_dir = Path(new_dir)
+            self.db_path = self.notes_dir / 'note_index.db'
+            self.db = self.open_database(self.db_path)
+            self.bodies = self.open_bodies()
+            self.journal = self.open_journal()
+            self.revisions = self.open_revisions()
+            self.attachments = self.open_attachments()
+            self.renders = self.open_renders()
+            self.init_database()
+            if self.watcher is not None:
+                self.watcher.reset()
+            self.save_settings({'notes_directory': str(self.notes_dir)})
@@ -0,0 +1,71 @@
+"""Text edits for patch-based note updates
+
+A patch is a list of (start, end, text) edits against a base version of a
+note body: the base characters start..end are replaced by text. Edits are
+sorted, do not overlap, and all refer to positions in the base, so a
+client can send just the changed region of a long note.
+
+Offsets count UTF-16 code units, as JavaScript string indices do. They
+only differ from Python string indices in text containing characters
+outside the Basic Multilingual Plane (e.g. emoji).
+"""
+
+
+class StaleBase(Exception):
+    """A patch was made against content that is no longer the note's current content"""
+
+    def __init__(self, note_id, current_hash):
+        super().__init__(f"Note {note_id} has changed since the base of this patch")
+        self.note_id = note_id
+        self.current_hash = current_hash
+
+
+def utf16_length(text):
+    """Return the length of text in UTF-16 code units"""
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+
+def utf16_indices(text, offsets):
+    """Map sorted UTF-16 offsets into text to Python string indices"""
+    if utf16_length(text) == len(text):
+        return list(offsets)
+
+    indices = []
+    position = 0  # UTF-16 offset of text[index]
+    index = 0
+    for offset in offsets:
+        while position < offset and index < len(text):
+            position += 2 if ord(text[index]) > 0xFFFF else 1
+            index += 1
+        if position != offset:
+            raise ValueError(f"Offset {offset} splits a character")
+        indices.append(index)
+    return indices
+
+
+def apply_edits(text, edits):
+    """Return text with (start, end, replacement) edits applied
+
+    Raises ValueError when edits are out of order, overlap or fall outside
+    the text.
+    """
+    previous_end = 0
+    for start, end, _ in edits:
+        if start < previous_end or end < start:
+            raise ValueError("Edits must be sorted and must not overlap")
+        previous_end = end
+    if previous_end > utf16_length(text):
+        raise ValueError("Edit reaches past the end of the note")
+
+    bounds = utf16_indices(text, [offset for start, end, _ in edits for offset in (start, end)])
+    parts = []
+    copied = 0
+    for i, (_, _, replacement) in enumerate(edits):
+        start, end = bounds[2 * i], bounds[2 * i + 1]
+        parts.append(text[copied:start])
+        parts.append(replacement)
+        copied = end
+    parts.append(text[copied:])
+    return ''.join(parts)
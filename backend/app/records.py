@@ -0,0 +1,117 @@
+"""Compact in-memory note records
+
+NoteApp keeps the metadata of every note in memory, so the per-note
+overhead decides how memory grows with the vault. A NoteRecord holds a
+note in `__slots__` instead of a dict, and its created/modified times as
+integer microseconds since the epoch instead of ISO strings. The ISO
+strings the API, the database and the snapshot's older versions use are
+produced by to_dict() and the created/modified properties, i.e. only when
+a note leaves the in-memory store.
+
+Timestamps are naive local times, as `datetime.now().isoformat()` writes
+them, and are counted from 1970-01-01 without any time zone conversion so
+every one converts back to exactly the same string. A value that would not
+(another format, an offset, '' from an old index.json) is kept as given.
+"""
+
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_time(value):
+    """Return an ISO timestamp as integer microseconds since the epoch
+
+    Strings that would not convert back unchanged are returned as they are.
+    """
+    # Only the two shapes isoformat() writes: seconds, or six fraction digits
+    if not isinstance(value, str) or len(value) not in (19, 26) or value[10] != 'T' \
+            or value[13] != ':' or value[16] != ':' or (len(value) == 26 and value[19] != '.'):
+        return value
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if moment.tzinfo is not None or (len(value) == 26) != bool(moment.microsecond):
+        return value
+    return (moment - EPOCH) // MICROSECOND
+
+
+def decode_time(value):
+    """Return the ISO string of a timestamp stored by encode_time"""
+    if isinstance(value, int):
+        return (EPOCH + timedelta(microseconds=value)).isoformat()
+    return value
+
+
+def time_order(value):
+    """Sort key of a stored timestamp; values kept as strings sort first"""
+    return value if isinstance(value, int) else -1
+
+
+class NoteRecord:
+    """One note's metadata, and its content while held in memory (else None)"""
+
+    __slots__ = ('id', 'title', 'parent_id', 'position', 'version', 'created_at', 'modified_at', 'content')
+
+    def __init__(self, id, title, parent_id=None, position=0, created=None, modified=None, version=1,
+                 content=None):
+        self.id = id
+        self.title = title
+        self.parent_id = parent_id
+        self.position = position
+        self.version = version
+        self.created_at = encode_time(created)
+        self.modified_at = encode_time(modified)
+        self.content = content
+
+    @classmethod
+    def from_dict(cls, note, content=None):
+        """Return the record of a note dict; its content is only kept if passed"""
+        return cls(note['id'], note['title'], note.get('parent_id'), note.get('position', 0),
+                   note.get('created'), note.get('modified'), note.get('version', 1), content)
+
+    @classmethod
+    def from_row(cls, row):
+        """Return the record of a row() tuple"""
+        record = cls(*row[:4], version=row[4])
+        record.created_at, record.modified_at = row[5], row[6]
+        return record
+
+    def row(self):
+        """Return the metadata as a tuple, timestamps as stored"""
+        return self.id, self.title, self.parent_id, self.position, self.version, self.created_at, self.modified_at
+
+    @property
+    def created(self):
+        return decode_time(self.created_at)
+
+    @created.setter
+    def created(self, value):
+        self.created_at = encode_time(value)
+
+    @property
+    def modified(self):
+        return decode_time(self.modified_at)
+
+    @modified.setter
+    def modified(self, value):
+        self.modified_at = encode_time(value)
+
+    def to_dict(self, content=None):
+        """Return the note as the API returns it, with content if given"""
+        note = {'id': self.id, 'title': self.title}
+        if content is not None:
+            note['content'] = content
+        note.update(
+            parent_id=self.parent_id,
+            position=self.position,
+            created=self.created,
+            modified=self.modified,
+            version=self.version
+        )
+        return note
+
+    def __repr__(self):
+        return f"NoteRecord(id={self.id!r}, title={self.title!r}, version={self.version!r})"
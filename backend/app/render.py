@@ -0,0 +1,664 @@
+"""Server-side rendering of note markdown to HTML
+
+render() turns a note body into HTML and a heading outline. It covers the
+markdown the editor writes: ATX and setext headings, paragraphs, emphasis,
+strikethrough, code spans and fenced or indented code blocks, block
+quotes, nested bullet, ordered and task lists, tables, thematic breaks,
+links (inline, reference, autolinks and bare URLs), images and `[[Title]]`
+wiki links. The output is safe to insert into the page as it is: raw HTML
+in a note is shown as text, and only http(s), mailto and relative URLs
+(plus data: images) survive in links, checked once entities and escapes
+in them are decoded. As a second line of defence, sanitize() passes the
+output through an allowlist of the tags and attributes render() writes.
+
+RenderStore keeps rendered notes as the encoded JSON response body, keyed
+by the SHA-256 of the content, in an LRU in memory and under `.render/` in
+the notes directory, so a note whose content was rendered before is served
+without reading or rendering it again.
+"""
+
+import html
+import os
+import re
+import threading
+import uuid
+from html.parser import HTMLParser
+from pathlib import Path
+
+from app.cache import ContentCache
+from app.metrics import FILE_BYTES_WRITTEN
+from app.responses import dumps
+
+# Part of the store's path: bump when the output of render() changes
+RENDER_VERSION = 2
+RENDER_DIR = '.render'
+
+FENCE = re.compile(r'^(`{3,}|~{3,})[ \t]*([^`\s]*)[^`]*$')
+ATX_HEADING = re.compile(r'^(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$')
+SETEXT_UNDERLINE = re.compile(r'^(=+|-+)[ \t]*$')
+THEMATIC_BREAK = re.compile(r'^(?:(?:\*[ \t]*){3,}|(?:-[ \t]*){3,}|(?:_[ \t]*){3,})$')
+LIST_ITEM = re.compile(r'^([*+-]|(\d{1,9})[.)])(?:([ \t]+)|$)')
+TASK = re.compile(r'^\[([ xX])\](?:[ \t]+|$)')
+TABLE_DELIMITER = re.compile(r'^[ \t]*\|?[ \t]*:?-+:?[ \t]*(?:\|[ \t]*:?-+:?[ \t]*)*\|?[ \t]*$')
+REFERENCE_DEFINITION = re.compile(r'^ {0,3}\[([^\]]+)\]:[ \t]*<?([^\s>]+)>?(?:[ \t]+["\'(](.*)["\')])?[ \t]*$')
+
+ESCAPABLE = r'!"#$%&\'()*+,\-./:;<=>?@\[\\\]^_`{|}~'
+# Scanned first, left to right, so each one hides its text from the rest
+INLINE_LITERALS = re.compile(
+    r'(?P<code>(?P<ticks>`+)(?P<code_text>.+?)(?<!`)(?P=ticks)(?!`))'
+    r'|(?P<escape>\\[' + ESCAPABLE + r'])'
+    r'|(?P<hard_break>(?: {2,}|\\)\n)'
+    r'|(?P<autolink><(?P<autolink_url>(?:https?://|mailto:)[^\s<>]+)>)'
+    r'|(?P<entity>&(?:#\d{1,7}|#[xX][0-9a-fA-F]{1,6}|[A-Za-z][A-Za-z0-9]{1,31});)',
+    re.DOTALL
+)
+WIKI_LINK = re.compile(r'\[\[([^\[\]|#\n]+)(#[^\[\]|\n]*)?(?:\|([^\[\]\n]*))?\]\]')
+LINK = re.compile(
+    r'(!?)\[((?:[^\[\]]|\[[^\[\]]*\])*)\]'
+    r'(?:\(\s*(<[^<>\n]*>|[^\s()]*(?:\([^\s()]*\)[^\s()]*)*)(?:\s+("[^"]*"|\'[^\']*\'|\([^)]*\)))?\s*\)'
+    r'|\[([^\[\]]*)\])?'
+)
+BARE_URL = re.compile(r'(?<![\w"\'=/])https?://[^\s<]*[^\s<.,:;!?"\')\]]')
+PLACEHOLDER = re.compile(r'\x00(\d+)\x00')
+# (pattern, delimiter, opening, closing); the text inside never holds the
+# delimiter run, which keeps matching linear
+EMPHASIS = (
+    (re.compile(r'\*\*\*(?=[^\s*])([^*]+?)(?<=[^\s*])\*\*\*'), '*', '<em><strong>', '</strong></em>'),
+    (re.compile(r'\*\*(?=\S)((?:[^*]|\*(?!\*))+?)(?<=\S)\*\*'), '*', '<strong>', '</strong>'),
+    (re.compile(r'(?<![\w_])__(?=\S)((?:[^_]|_(?!_))+?)(?<=\S)__(?![\w_])'), '_', '<strong>', '</strong>'),
+    (re.compile(r'\*(?=[^\s*])([^*]+?)(?<=[^\s*])\*'), '*', '<em>', '</em>'),
+    (re.compile(r'(?<![\w_])_(?=[^\s_])([^_]+?)(?<=[^\s_])_(?![\w_])'), '_', '<em>', '</em>'),
+    (re.compile(r'~~(?=\S)((?:[^~]|~(?!~))+?)(?<=\S)~~'), '~', '<del>', '</del>'),
+)
+TAG = re.compile(r'<[^>]+>')
+
+# Deeper quotes and lists are shown as text, to bound the recursion
+MAX_NESTING = 32
+
+SAFE_SCHEMES = {'http', 'https', 'mailto'}
+SCHEME = re.compile(r'^([A-Za-z][A-Za-z0-9+.-]*):')
+DATA_IMAGE = re.compile(r'^data:image/(?:png|gif|jpeg|webp);base64,[A-Za-z0-9+/=]*$')
+# Browsers ignore these when they read a URL's scheme
+URL_IGNORED = re.compile(r'[\x00-\x20\x7f]')
+
+
+def escape(text):
+    return html.escape(text, quote=False)
+
+
+def attribute(text):
+    return html.escape(text, quote=True)
+
+
+def unescape(text):
+    """Decode the entities and backslash escapes of markdown source text"""
+    return re.sub(r'\\([' + ESCAPABLE + r'])', r'\1', html.unescape(text))
+
+
+def allowed_url(url, image=False):
+    """Return url if its scheme is allowed, else None
+
+    url is decoded, as the browser will see it. Control characters and
+    spaces are dropped before reading the scheme, as browsers do.
+    """
+    match = SCHEME.match(URL_IGNORED.sub('', url))
+    if match and match.group(1).lower() not in SAFE_SCHEMES:
+        if not (image and DATA_IMAGE.match(url)):
+            return None
+    return url
+
+
+def safe_url(url, image=False):
+    """Return a URL from markdown source fit for an href or src attribute, or None if not allowed"""
+    url = url.strip()
+    if url.startswith('<') and url.endswith('>'):
+        url = url[1:-1]
+    url = allowed_url(unescape(url), image)
+    if url is None:
+        return None
+    return attribute(url.replace(' ', '%20'))
+
+
+# The tags and attributes render() writes; sanitize() drops everything else
+ALLOWED_TAGS = {
+    'a': {'href', 'title', 'class', 'data-title', 'data-heading'},
+    'img': {'src', 'alt', 'title', 'loading'},
+    'h1': {'id'}, 'h2': {'id'}, 'h3': {'id'}, 'h4': {'id'}, 'h5': {'id'}, 'h6': {'id'},
+    'code': {'class'},
+    'ol': {'start'},
+    'li': {'class'},
+    'th': {'style'},
+    'td': {'style'},
+    'input': {'type', 'disabled', 'checked'},
+    **{tag: set() for tag in (
+        'p', 'em', 'strong', 'del', 'pre', 'blockquote', 'ul', 'br', 'hr',
+        'table', 'thead', 'tbody', 'tr',
+    )},
+}
+VOID_TAGS = {'br', 'hr', 'img', 'input'}
+ALLOWED_VALUES = {
+    'style': re.compile(r'^text-align: (?:left|center|right)$'),
+    'class': re.compile(r'^(?:wikilink|task-list-item|language-[^\s"]*)$'),
+    'type': re.compile(r'^checkbox$'),
+    'loading': re.compile(r'^lazy$'),
+    'start': re.compile(r'^\d+$'),
+}
+
+
+class Sanitizer(HTMLParser):
+    """Rewrites HTML keeping only ALLOWED_TAGS, their attributes and allowed URLs"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+
+    def _tag(self, tag, attrs, end):
+        allowed = ALLOWED_TAGS.get(tag)
+        if allowed is None:
+            return
+        parts = [tag]
+        for name, value in attrs:
+            value = value or ''
+            if name not in allowed:
+                continue
+            if name in ('href', 'src'):
+                value = allowed_url(value, image=name == 'src')
+                if value is None:
+                    continue
+            elif name in ALLOWED_VALUES and not ALLOWED_VALUES[name].match(value):
+                continue
+            parts.append(f'{name}="{attribute(value)}"')
+        self.out.append(f"<{' '.join(parts)}{end}>")
+
+    def handle_starttag(self, tag, attrs):
+        self._tag(tag, attrs, ' /' if tag in VOID_TAGS else '')
+
+    def handle_startendtag(self, tag, attrs):
+        self._tag(tag, attrs, ' /')
+
+    def handle_endtag(self, tag):
+        if tag in ALLOWED_TAGS and tag not in VOID_TAGS:
+            self.out.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        self.out.append(escape(data))
+
+
+def sanitize(markup):
+    """Return markup with only the tags, attributes and URLs render() may write"""
+    sanitizer = Sanitizer()
+    sanitizer.feed(markup)
+    sanitizer.close()
+    return ''.join(sanitizer.out)
+
+
+def slugify(text):
+    """Return a GitHub style anchor for a heading's text"""
+    slug = re.sub(r'[^\w\- ]', '', text.lower()).strip().replace(' ', '-')
+    return slug or 'section'
+
+
+def _indent(line):
+    return len(line) - len(line.lstrip(' '))
+
+
+def _split_row(line):
+    """Split a table row into its cells, honouring escaped pipes"""
+    line = line.strip()
+    if line.startswith('|'):
+        line = line[1:]
+    if line.endswith('|') and not line.endswith('\\|'):
+        line = line[:-1]
+    return [cell.strip().replace('\\|', '|') for cell in re.split(r'(?<!\\)\|', line)]
+
+
+class Renderer:
+    """Renders one note; holds its reference links and heading anchors"""
+
+    def __init__(self):
+        self.references = {}
+        self.outline = []
+        self._slugs = {}
+
+    def render(self, text):
+        lines = text.replace('\r\n', '\n').replace('\r', '\n').replace('\x00', '\ufffd').expandtabs(4).split('\n')
+        lines = self._take_references(lines)
+        return '\n'.join(html_ for _, html_ in self._blocks(lines))
+
+    def _take_references(self, lines):
+        """Collect `[label]: url` definitions, outside code fences, and drop their lines"""
+        kept = []
+        fence = None
+        for line in lines:
+            stripped = line.strip()
+            match = FENCE.match(stripped)
+            if fence is None and match:
+                fence = match.group(1)
+            elif fence is not None and stripped.startswith(fence[0] * len(fence)) and not stripped.strip(fence[0]):
+                fence = None
+            elif fence is None:
+                match = REFERENCE_DEFINITION.match(line)
+                if match:
+                    self.references.setdefault(match.group(1).strip().lower(), (match.group(2), match.group(3)))
+                    continue
+            kept.append(line)
+        return kept
+
+    def _heading(self, level, text):
+        inner = self._inline(text.strip())
+        plain = html.unescape(TAG.sub('', inner))
+        slug = slugify(plain)
+        count = self._slugs.get(slug, 0)
+        self._slugs[slug] = count + 1
+        if count:
+            slug = f"{slug}-{count}"
+        self.outline.append({'level': level, 'text': plain, 'id': slug})
+        return f'<h{level} id="{attribute(slug)}">{inner}</h{level}>'
+
+    def _blocks(self, lines, depth=0):
+        """Return (kind, html) for the blocks of lines; kind 'p' for paragraphs"""
+        out = []
+        paragraph = []
+
+        def flush():
+            if paragraph:
+                text = '\n'.join(line.lstrip(' ') for line in paragraph).rstrip()
+                out.append(('p', f'<p>{self._inline(text)}</p>'))
+                paragraph.clear()
+
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            if not line.strip():
+                flush()
+                i += 1
+                continue
+            indent = _indent(line)
+            if indent >= 4:
+                if paragraph:
+                    paragraph.append(line)
+                    i += 1
+                    continue
+                code = []
+                while i < len(lines) and (_indent(lines[i]) >= 4 or not lines[i].strip()):
+                    code.append(lines[i][4:])
+                    i += 1
+                while code and not code[-1].strip():
+                    code.pop()
+                out.append(('pre', f"<pre><code>{escape(chr(10).join(code))}\n</code></pre>"))
+                continue
+
+            body = line[indent:]
+            fence = FENCE.match(body)
+            if fence:
+                flush()
+                marker = fence.group(1)
+                language = fence.group(2)
+                code = []
+                i += 1
+                while i < len(lines):
+                    closing = lines[i].strip()
+                    if closing.startswith(marker) and not closing.strip(marker[0]):
+                        break
+                    code.append(lines[i][min(indent, _indent(lines[i])):])
+                    i += 1
+                i += 1
+                css = f' class="language-{attribute(language)}"' if language else ''
+                text = escape('\n'.join(code))
+                out.append(('pre', f"<pre><code{css}>{text}{chr(10) if code else ''}</code></pre>"))
+                continue
+
+            heading = ATX_HEADING.match(body)
+            if heading:
+                flush()
+                out.append(('h', self._heading(len(heading.group(1)), heading.group(2) or '')))
+                i += 1
+                continue
+
+            underline = SETEXT_UNDERLINE.match(body)
+            if paragraph and underline:
+                text = '\n'.join(part.strip() for part in paragraph)
+                paragraph.clear()
+                out.append(('h', self._heading(1 if underline.group(1)[0] == '=' else 2, text)))
+                i += 1
+                continue
+
+            if THEMATIC_BREAK.match(body):
+                flush()
+                out.append(('hr', '<hr />'))
+                i += 1
+                continue
+
+            if body.startswith('>') and depth < MAX_NESTING:
+                flush()
+                quoted = []
+                while i < len(lines) and lines[i].strip():
+                    part = lines[i].lstrip(' ')
+                    if part.startswith('>'):
+                        part = part[1:]
+                        quoted.append(part[1:] if part.startswith(' ') else part)
+                    elif quoted and not self._starts_block(lines[i]):
+                        quoted.append(lines[i])  # lazy continuation
+                    else:
+                        break
+                    i += 1
+                inner = '\n'.join(html_ for _, html_ in self._blocks(quoted, depth + 1))
+                out.append(('blockquote', f"<blockquote>\n{inner}\n</blockquote>"))
+                continue
+
+            item = LIST_ITEM.match(body)
+            if item and depth < MAX_NESTING and not (paragraph and (item.group(2) not in (None, '1') or not body[item.end():].strip())):
+                flush()
+                i, list_html = self._list(lines, i, depth)
+                out.append(('list', list_html))
+                continue
+
+            if not paragraph and '|' in body and i + 1 < len(lines) and TABLE_DELIMITER.match(lines[i + 1]):
+                header = _split_row(body)
+                aligns = _split_row(lines[i + 1])
+                if len(header) == len(aligns):
+                    i, table_html = self._table(lines, i, header, aligns)
+                    out.append(('table', table_html))
+                    continue
+
+            paragraph.append(line)
+            i += 1
+        flush()
+        return out
+
+    def _starts_block(self, line):
+        body = line.lstrip(' ')
+        return bool(
+            FENCE.match(body) or ATX_HEADING.match(body) or THEMATIC_BREAK.match(body)
+            or body.startswith('>') or LIST_ITEM.match(body)
+        )
+
+    def _list(self, lines, i, depth):
+        """Render the list starting at lines[i]; return (next line index, html)"""
+        first = LIST_ITEM.match(lines[i].lstrip(' '))
+        ordered = first.group(2) is not None
+        delimiter = first.group(1)[-1]
+        items = []
+        loose = False
+        gap = False
+        while i < len(lines):
+            line = lines[i]
+            indent = _indent(line)
+            item = LIST_ITEM.match(line[indent:]) if indent < 4 else None
+            if item is None or (item.group(2) is not None) != ordered or item.group(1)[-1] != delimiter:
+                break
+            # A blank line between items, or between blocks of one, loosens the list
+            loose = loose or gap
+            spacing = len(item.group(3) or ' ')
+            if spacing > 4:
+                spacing = 1  # an indented code block starts after one space
+            width = indent + len(item.group(1)) + spacing
+            content = [line[width:] if len(line) > width else line[indent + len(item.group(1)):].strip()]
+            i += 1
+            blank = False
+            while i < len(lines):
+                line = lines[i]
+                if not line.strip():
+                    blank = True
+                    content.append('')
+                    i += 1
+                    continue
+                if _indent(line) >= width:
+                    content.append(line[width:])
+                elif not blank and not self._starts_block(line):
+                    content.append(line)  # lazy continuation
+                else:
+                    break
+                blank = False
+                i += 1
+            gap = bool(content) and not content[-1]
+            while content and not content[-1]:
+                content.pop()
+            if '' in content and len(self._blocks(content, depth + 1)) > 1:
+                loose = True
+            items.append((item, content))
+
+        parts = []
+        for item, content in items:
+            task = TASK.match(content[0]) if content else None
+            checkbox = ''
+            if task:
+                content = [content[0][task.end():]] + content[1:]
+                checked = ' checked=""' if task.group(1) != ' ' else ''
+                checkbox = f'<input type="checkbox" disabled=""{checked} /> '
+            blocks = self._blocks(content, depth + 1)
+            if loose:
+                if checkbox and blocks and blocks[0][0] == 'p':
+                    blocks[0] = ('p', f"<p>{checkbox}{blocks[0][1][3:]}")
+                    checkbox = ''
+                inner = '\n'.join(html_ for _, html_ in blocks)
+                inner = f"\n{checkbox}{inner}\n" if inner else checkbox
+            else:
+                inner = '\n'.join(html_[3:-4] if kind == 'p' else html_ for kind, html_ in blocks)
+                inner = checkbox + inner
+            css = ' class="task-list-item"' if task else ''
+            parts.append(f"<li{css}>{inner}</li>")
+
+        if ordered:
+            start = int(items[0][0].group(2))
+            start_attr = f' start="{start}"' if start != 1 else ''
+            return i, f"<ol{start_attr}>\n" + '\n'.join(parts) + "\n</ol>"
+        return i, "<ul>\n" + '\n'.join(parts) + "\n</ul>"
+
+    def _table(self, lines, i, header, aligns):
+        """Render the table whose header is lines[i]; return (next line index, html)"""
+        styles = []
+        for cell in aligns:
+            if cell.startswith(':') and cell.endswith(':'):
+                styles.append(' style="text-align: center"')
+            elif cell.endswith(':'):
+                styles.append(' style="text-align: right"')
+            elif cell.startswith(':'):
+                styles.append(' style="text-align: left"')
+            else:
+                styles.append('')
+
+        def row(cells, tag):
+            cells = (cells + [''] * len(styles))[:len(styles)]
+            return '<tr>' + ''.join(
+                f"<{tag}{style}>{self._inline(cell)}</{tag}>" for cell, style in zip(cells, styles)
+            ) + '</tr>'
+
+        parts = ['<table>', '<thead>', row(header, 'th'), '</thead>']
+        i += 2
+        body = []
+        while i < len(lines) and lines[i].strip() and '|' in lines[i] and not self._starts_block(lines[i]):
+            body.append(row(_split_row(lines[i]), 'td'))
+            i += 1
+        if body:
+            parts.extend(['<tbody>', *body, '</tbody>'])
+        parts.append('</table>')
+        return i, '\n'.join(parts)
+
+    def _inline(self, text, stash=None):
+        """Render the inline markdown of one block
+
+        Rendered pieces are stashed as (markup, source) behind placeholders;
+        a link label is rendered with the same stash, and link destinations
+        and titles get their source text back before they are read.
+        """
+        if stash is None:
+            stash = []
+
+        def keep(markup, source=''):
+            stash.append((markup, source))
+            return f"\x00{len(stash) - 1}\x00"
+
+        def source(text):
+            while PLACEHOLDER.search(text):
+                text = PLACEHOLDER.sub(lambda m: stash[int(m.group(1))][1], text)
+            return text
+
+        def literal(match):
+            if match.group('code'):
+                code = match.group('code_text').replace('\n', ' ')
+                if code.startswith(' ') and code.endswith(' ') and code.strip():
+                    code = code[1:-1]
+                return keep(f"<code>{escape(code)}</code>", match.group(0))
+            if match.group('escape'):
+                return keep(escape(match.group('escape')[1]), match.group(0))
+            if match.group('hard_break'):
+                return keep('<br />', match.group(0)[:-1]) + '\n'
+            if match.group('autolink'):
+                url = match.group('autolink_url')
+                return keep(f'<a href="{safe_url(url)}">{escape(url)}</a>', match.group(0))
+            entity = match.group('entity')
+            return keep(entity, entity) if html.unescape(entity) != entity else entity
+
+        def wiki_link(match):
+            title = match.group(1).strip()
+            label = (match.group(3) or '').strip() or title
+            anchor = f' data-heading="{attribute(match.group(2)[1:])}"' if match.group(2) else ''
+            return keep(
+                f'<a href="#" class="wikilink" data-title="{attribute(title)}"{anchor}>{escape(label)}</a>',
+                match.group(0)
+            )
+
+        def link(match):
+            image, label, url, title, reference = match.groups()
+            if url is None:
+                key = source(reference or label).strip().lower()
+                if key not in self.references:
+                    return match.group(0)
+                url, title = self.references[key]
+            else:
+                # Entities and escapes were stashed; read the URL and title as written
+                url = source(url)
+                title = source(title)[1:-1] if title else None
+            href = safe_url(url, image=bool(image))
+            title_attr = f' title="{attribute(unescape(title))}"' if title else ''
+            inner = self._inline(label, stash)
+            if image:
+                alt = attribute(html.unescape(TAG.sub('', inner)))
+                if href is None:
+                    return keep(alt, source(match.group(0)))
+                return keep(f'<img src="{href}" alt="{alt}"{title_attr} loading="lazy" />', source(match.group(0)))
+            if href is None:
+                return keep(inner, source(match.group(0)))
+            return keep(f'<a href="{href}"{title_attr}>{inner}</a>', source(match.group(0)))
+
+        def bare_url(match):
+            url = match.group(0)
+            return keep(f'<a href="{safe_url(url)}">{escape(url)}</a>', url)
+
+        text = INLINE_LITERALS.sub(literal, text)
+        text = WIKI_LINK.sub(wiki_link, text)
+        text = LINK.sub(link, text)
+        text = BARE_URL.sub(bare_url, text)
+        def emphasis(text):
+            # Each match is stashed whole, so later patterns cannot cross
+            # its tags and the output always nests properly
+            for pattern, delimiter, opening, closing in EMPHASIS:
+                if delimiter in text:
+                    text = pattern.sub(
+                        lambda m, opening=opening, closing=closing: keep(opening + emphasis(m.group(1)) + closing),
+                        text
+                    )
+            return text
+
+        text = emphasis(escape(text))
+        while PLACEHOLDER.search(text):
+            text = PLACEHOLDER.sub(lambda m: stash[int(m.group(1))][0], text)
+        return text
+
+
+def render(markdown):
+    """Return (html, outline) for a note body
+
+    outline lists the headings in order as dicts with level, text and the
+    id of the heading element.
+    """
+    renderer = Renderer()
+    body = sanitize(renderer.render(markdown))
+    return body, renderer.outline
+
+
+class RenderStore:
+    """Rendered notes by content hash, in memory and on disk"""
+
+    def __init__(self, notes_dir, max_entries=256, max_bytes=32 * 1024 * 1024, max_disk_bytes=256 * 1024 * 1024):
+        self.root = Path(notes_dir) / RENDER_DIR
+        self.directory = self.root / f"v{RENDER_VERSION}"
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = ContentCache(max_entries=max_entries, max_bytes=max_bytes)
+        self.disk_hits = 0
+        self.renders = 0
+        self._lock = threading.Lock()
+
+    def _path(self, digest):
+        return self.directory / digest[:2] / f"{digest[2:]}.json"
+
+    def get(self, digest):
+        """Return the stored body for a content hash, or None"""
+        body = self.memory.get(digest)
+        if body is not None:
+            return body
+        try:
+            with open(self._path(digest), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self.memory.put(digest, body)
+        return body
+
+    def render(self, digest, content):
+        """Render content, store the body under digest and return it"""
+        body_html, outline = render(content)
+        body = dumps({'hash': digest, 'html': body_html, 'outline': outline})
+        path = self._path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, path)
+        FILE_BYTES_WRITTEN.inc(len(body), kind='render')
+        with self._lock:
+            self.renders += 1
+        self.memory.put(digest, body)
+        return body
+
+    def discard(self, digest):
+        """Drop a body from memory; the disk copy stays until gc()"""
+        self.memory.discard(digest)
+
+    def gc(self):
+        """Delete the oldest bodies beyond the disk budget, and any of older versions; return the count"""
+        removed = 0
+        files = []
+        if not self.root.is_dir():
+            return 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if not path.startswith(str(self.directory) + os.sep):
+                    os.remove(path)
+                    removed += 1
+                else:
+                    files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def stats(self):
+        """Return memory cache counters plus disk hits and renders"""
+        return {**self.memory.stats(), 'disk_hits': self.disk_hits, 'renders': self.renders}
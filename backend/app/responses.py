@@ -0,0 +1,189 @@
+"""Encoded JSON responses cached until the notes change
+
+Every client fetches the full note listing and the tree after edits, but
+they only change when a note does. ResponseCache keeps their encoded JSON
+bytes under a key that changes with every note mutation, so a hit skips
+building the data, response model validation and JSON encoding. gzip and,
+when the `brotli` package is installed, brotli variants are compressed on
+first request and kept with the body. Bodies too large to compress on the
+request path (a full listing of a big vault is tens of MB) are sent plain
+while they are compressed in the background.
+"""
+
+import gzip
+import json
+import threading
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Larger bodies are compressed in the background instead of on a request,
+# with gzip's fastest level: three times quicker than the default for about
+# a third more output
+INLINE_COMPRESS_BYTES = 2 * 1024 * 1024
+BACKGROUND_GZIP_LEVEL = 1
+
+
+def dumps(value):
+    """Encode a value as compact UTF-8 JSON bytes, like JSONResponse does"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def accepted_codings(header):
+    """Return the content codings an Accept-Encoding header allows"""
+    codings = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        params = params.replace(' ', '')
+        if not coding or params in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        codings.add(coding)
+    return codings
+
+
+class CachedBody:
+    """One encoded response body and its compressed variants"""
+
+    def __init__(self, key, body, min_compress_bytes, gzip_level, brotli_quality):
+        self.key = key
+        self.body = body
+        # CRC-32 is several times faster than a cryptographic hash on large
+        # bodies; weak because the compressed variants share the tag
+        self.etag = f'W/"{len(body):x}-{zlib.crc32(body):08x}"'
+        self.min_compress_bytes = min_compress_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.compress_inline = len(body) <= INLINE_COMPRESS_BYTES
+        # Set once a newer body replaced this one
+        self.replaced = False
+        self._variants = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def coding_for(self, accept_encoding):
+        """Return the coding to send to a client, None for the plain body"""
+        if len(self.body) < self.min_compress_bytes:
+            return None
+        codings = accepted_codings(accept_encoding)
+        if brotli is not None and 'br' in codings and self.compress_inline:
+            return 'br'
+        if 'gzip' in codings:
+            return 'gzip'
+        return None
+
+    def variant(self, coding):
+        """Return the body in a coding if it was compressed already, else None"""
+        if coding is None:
+            return self.body
+        return self._variants.get(coding)
+
+    def compress(self, coding):
+        """Return the body in a coding, compressing it once"""
+        with self._lock:
+            data = self._variants.get(coding)
+            if data is None:
+                if coding == 'br':
+                    data = brotli.compress(self.body, quality=self.brotli_quality)
+                else:
+                    level = self.gzip_level if self.compress_inline else BACKGROUND_GZIP_LEVEL
+                    # mtime=0: the output depends on the body alone
+                    data = gzip.compress(self.body, level, mtime=0)
+                self._variants[coding] = data
+            return data
+
+    def compress_later(self, coding, executor):
+        """Compress the body in a coding on executor, unless that is under way"""
+        with self._lock:
+            if coding in self._pending or coding in self._variants:
+                return
+            self._pending.add(coding)
+        executor.submit(self._compress_pending, coding)
+
+    def _compress_pending(self, coding):
+        try:
+            if not self.replaced:
+                self.compress(coding)
+        finally:
+            with self._lock:
+                self._pending.discard(coding)
+
+    def size(self):
+        """Return the bytes held for the body and its variants"""
+        return len(self.body) + sum(len(data) for data in self._variants.values())
+
+
+class ResponseCache:
+    """Latest encoded body of each cached endpoint, keyed by data version"""
+
+    def __init__(self, min_compress_bytes=1024, gzip_level=6, brotli_quality=4):
+        self.min_compress_bytes = min_compress_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._entries = {}
+        self._build_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, name, key):
+        """Return the cached body of name if it was built at key, else None"""
+        entry = self._entries.get(name)
+        if entry is None or entry.key != key:
+            return None
+        self.hits += 1
+        return entry
+
+    def fill(self, name, key, build, current=None):
+        """Return the body of name at key, calling build() for the data on a miss
+
+        Concurrent misses on the same name wait for one build instead of
+        each building the same response. A body built while current()
+        turns out False is returned without being cached.
+        """
+        with self._lock:
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+        with build_lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.key == key:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            body = CachedBody(key, dumps(build()), self.min_compress_bytes,
+                              self.gzip_level, self.brotli_quality)
+            if current is not None and not current():
+                # Never served again, so not worth compressing in the background
+                body.replaced = True
+                return body
+            if entry is not None:
+                entry.replaced = True
+            self._entries[name] = body
+            return body
+
+    def stats(self):
+        """Return cache counters and current usage"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': sum(entry.size() for entry in list(self._entries.values())),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+def from_options(options):
+    """Return the ResponseCache configured by a NoteApp's options, or None if disabled"""
+    if not options.getboolean('cache', 'response_cache'):
+        return None
+    return ResponseCache(min_compress_bytes=options.getint('cache', 'response_min_compress_bytes'))
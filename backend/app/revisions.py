@@ -0,0 +1,344 @@
+"""Content-addressed revision history for notes
+
+Every saved version of a note body is stored once, as a zlib-compressed
+object named by the SHA-256 of its content under `.objects/` in the notes
+directory, so identical bodies are deduplicated. A new revision is usually
+stored as a line delta against the note's previous revision, so storage
+grows with the edited bytes rather than with the note size; after
+`max_chain` deltas a full snapshot is written to bound read cost.
+
+The `revisions` table in note_index.db maps notes to object hashes.
+Autosaves closer together than `coalesce_seconds` replace the latest
+revision instead of adding one (never a note's first), and only `max_revisions` per note are
+kept. Objects no longer reachable from any revision are found by garbage()
+and removed by delete(). `revision_refs` records what each stored body
+links to (attachments), so linked() is an index lookup rather than a read
+of every object.
+"""
+
+import difflib
+import hashlib
+import json
+import os
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+from app.metrics import FILE_BYTES_WRITTEN
+
+REVISIONS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS revisions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_id INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        title TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created TEXT NOT NULL
+    )
+'''
+
+REVISION_REFS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS revision_refs (
+        hash TEXT NOT NULL,
+        ref TEXT NOT NULL,
+        PRIMARY KEY (hash, ref)
+    ) WITHOUT ROWID
+'''
+
+FULL = b'F'
+DELTA = b'D'
+
+
+def content_hash(content):
+    """Return the object name for a note body"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def make_delta(base, content):
+    """Encode content as copy/insert operations over the lines of base
+
+    Each operation is either [start, end] (copy base lines start:end) or a
+    string to insert.
+    """
+    base_lines = base.splitlines(keepends=True)
+    new_lines = content.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, base_lines, new_lines, autojunk=False)
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(new_lines[j1:j2]))
+    return ops
+
+
+def apply_delta(base, ops):
+    """Rebuild content from a base and the operations of make_delta"""
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(base_lines[op[0]:op[1]])
+    return ''.join(parts)
+
+
+class RevisionStore:
+    """Object store and revision index for one notes directory"""
+
+    def __init__(self, notes_dir, max_revisions=100, coalesce_seconds=60, max_chain=16, references=None):
+        self.objects_dir = Path(notes_dir) / '.objects'
+        self.max_revisions = max_revisions
+        self.coalesce_seconds = coalesce_seconds
+        self.max_chain = max_chain
+        # Returns what a note body links to, recorded in revision_refs
+        self.references = references
+
+    def create_schema(self, conn):
+        """Create the revision tables; return True if revision_refs did not exist yet"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'revision_refs'"
+        ).fetchone()
+        conn.execute(REVISIONS_SCHEMA)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_revisions_note ON revisions(note_id, id)')
+        conn.execute(REVISION_REFS_SCHEMA)
+        return exists is None
+
+    def build_refs(self, conn):
+        """Index the links of every stored revision once for an existing vault; return the count"""
+        digests = [row[0] for row in conn.execute('SELECT DISTINCT hash FROM revisions')]
+        for digest in digests:
+            try:
+                content = self.load(digest)
+            except FileNotFoundError:
+                continue
+            self._index_refs(conn, digest, content)
+        return len(digests)
+
+    def _index_refs(self, conn, digest, content):
+        """Record what the body stored under digest links to"""
+        if self.references is None:
+            return
+        conn.executemany('INSERT OR IGNORE INTO revision_refs (hash, ref) VALUES (?, ?)',
+                         [(digest, ref) for ref in self.references(content)])
+
+    def linked(self, conn):
+        """Return everything the kept revisions link to"""
+        return {row[0] for row in conn.execute(
+            'SELECT DISTINCT ref FROM revision_refs WHERE hash IN (SELECT hash FROM revisions)'
+        )}
+
+    def _object_path(self, digest):
+        return self.objects_dir / digest[:2] / digest[2:]
+
+    def _read_object(self, digest):
+        """Return (kind, depth, base_digest, body) of a stored object"""
+        with open(self._object_path(digest), 'rb') as f:
+            data = zlib.decompress(f.read())
+        header, _, body = data.partition(b'\n')
+        kind = header[:1]
+        if kind == FULL:
+            return FULL, 0, None, body
+        base, depth = header[1:].decode('ascii').split(' ')
+        return DELTA, int(depth), base, body
+
+    def _write_object(self, digest, header, body):
+        """Store an object unless an object with this digest already exists"""
+        path = self._object_path(digest)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp')
+        data = zlib.compress(header + b'\n' + body, 6)
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        FILE_BYTES_WRITTEN.inc(len(data), kind='object')
+        os.replace(tmp, path)
+
+    def chain(self, digest):
+        """Yield digest and then the digest of every delta base it is built on"""
+        while digest is not None:
+            yield digest
+            _, _, digest, _ = self._read_object(digest)
+
+    def load(self, digest):
+        """Return the content stored under digest, following delta chains"""
+        chain = []
+        while True:
+            kind, _, base, body = self._read_object(digest)
+            if kind == FULL:
+                content = body.decode('utf-8')
+                break
+            chain.append(json.loads(body.decode('utf-8')))
+            digest = base
+        for ops in reversed(chain):
+            content = apply_delta(content, ops)
+        return content
+
+    def store(self, content, base_digest=None, base_content=None):
+        """Store content, as a delta against base when worthwhile; return its digest"""
+        digest = content_hash(content)
+        if self._object_path(digest).exists():
+            return digest
+
+        if base_digest is not None and base_content is not None:
+            _, depth, _, _ = self._read_object(base_digest)
+            if depth < self.max_chain:
+                ops = json.dumps(make_delta(base_content, content), ensure_ascii=False).encode('utf-8')
+                # Fall back to a full copy when the delta saves nothing
+                if len(ops) < len(content.encode('utf-8')):
+                    header = DELTA + f"{base_digest} {depth + 1}".encode('ascii')
+                    self._write_object(digest, header, ops)
+                    return digest
+
+        self._write_object(digest, FULL, content.encode('utf-8'))
+        return digest
+
+    def record(self, conn, note_id, title, content, when=None):
+        """Record a new revision of a note inside the caller's transaction
+
+        Returns True when older revisions were pruned, i.e. gc() may have
+        objects to reclaim.
+        """
+        when = when or datetime.now().isoformat()
+        latest = conn.execute(
+            'SELECT id, hash, created FROM revisions WHERE note_id = ? ORDER BY id DESC LIMIT 2',
+            (note_id,)
+        ).fetchall()
+
+        digest = content_hash(content)
+        if latest and latest[0]['hash'] == digest:
+            conn.execute('UPDATE revisions SET title = ? WHERE id = ?', (title, latest[0]['id']))
+            return False
+
+        # Autosaves in quick succession replace the latest revision, which
+        # carries the time of the last of them; the first one is always kept
+        coalesce = False
+        if len(latest) > 1:
+            age = datetime.fromisoformat(when) - datetime.fromisoformat(latest[0]['created'])
+            coalesce = age.total_seconds() < self.coalesce_seconds
+
+        # Delta against the newest revision that is kept
+        if coalesce:
+            base = latest[1]
+        else:
+            base = latest[0] if latest else None
+        base_digest = base['hash'] if base else None
+        base_content = self.load(base_digest) if base_digest else None
+        self.store(content, base_digest, base_content)
+        self._index_refs(conn, digest, content)
+
+        size = len(content.encode('utf-8'))
+        if coalesce:
+            conn.execute(
+                'UPDATE revisions SET hash = ?, title = ?, size = ?, created = ? WHERE id = ?',
+                (digest, title, size, when, latest[0]['id'])
+            )
+            return True
+
+        conn.execute(
+            'INSERT INTO revisions (note_id, hash, title, size, created) VALUES (?, ?, ?, ?, ?)',
+            (note_id, digest, title, size, when)
+        )
+        pruned = conn.execute('''
+            DELETE FROM revisions WHERE note_id = ? AND id NOT IN (
+                SELECT id FROM revisions WHERE note_id = ? ORDER BY id DESC LIMIT ?
+            )
+        ''', (note_id, note_id, self.max_revisions))
+        return pruned.rowcount > 0
+
+    def record_new(self, conn, notes):
+        """Record the first revision of new notes from (note_id, title, content, when) tuples"""
+        rows = []
+        for note_id, title, content, when in notes:
+            digest = self.store(content)
+            self._index_refs(conn, digest, content)
+            rows.append((note_id, digest, title, len(content.encode('utf-8')), when))
+        conn.executemany(
+            'INSERT INTO revisions (note_id, hash, title, size, created) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+
+    def list(self, conn, note_id):
+        """Return a note's revisions, newest first"""
+        rows = conn.execute(
+            'SELECT id, note_id, hash, title, size, created FROM revisions '
+            'WHERE note_id = ? ORDER BY id DESC',
+            (note_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, conn, note_id, revision_id):
+        """Return one revision with its content, or None"""
+        row = conn.execute(
+            'SELECT id, note_id, hash, title, size, created FROM revisions '
+            'WHERE note_id = ? AND id = ?',
+            (note_id, revision_id)
+        ).fetchone()
+        if row is None:
+            return None
+        revision = dict(row)
+        revision['content'] = self.load(revision['hash'])
+        return revision
+
+    def forget(self, conn, note_ids):
+        """Drop the revision rows of deleted notes (objects go at the next gc)"""
+        conn.executemany('DELETE FROM revisions WHERE note_id = ?', [(nid,) for nid in note_ids])
+
+    def _reachable(self, roots, live):
+        """Add roots and every delta base they are built on to live; return it"""
+        stack = [digest for digest in roots if digest not in live]
+        live.update(stack)
+        while stack:
+            digest = stack.pop()
+            try:
+                kind, _, base, _ = self._read_object(digest)
+            except FileNotFoundError:
+                continue
+            if kind == DELTA and base not in live:
+                live.add(base)
+                stack.append(base)
+        return live
+
+    def garbage(self, conn):
+        """Return (live, unreachable): the digests revisions reach and the objects they do not
+
+        Only reads, so it can run without holding up saves; pass both to
+        delete() inside a write transaction.
+        """
+        live = self._reachable({row[0] for row in conn.execute('SELECT DISTINCT hash FROM revisions')}, set())
+        unreachable = []
+        if self.objects_dir.exists():
+            for bucket in self.objects_dir.iterdir():
+                for path in bucket.iterdir():
+                    # .tmp files are objects being written
+                    if path.suffix != '.tmp' and bucket.name + path.name not in live:
+                        unreachable.append(bucket.name + path.name)
+        return live, unreachable
+
+    def delete(self, conn, live, digests):
+        """Delete the objects of garbage() that are still unreachable; return how many
+
+        Revisions recorded since garbage() are followed first, as they may
+        reuse an object or build a delta on one.
+        """
+        known = {row[0] for row in conn.execute('SELECT DISTINCT hash FROM revisions')}
+        live = self._reachable(known, live)
+        removed = 0
+        for digest in digests:
+            if digest not in live:
+                self._object_path(digest).unlink(missing_ok=True)
+                removed += 1
+        conn.execute('DELETE FROM revision_refs WHERE hash NOT IN (SELECT hash FROM revisions)')
+        return removed
+
+
+def unified_diff(old, new, old_label, new_label):
+    """Return a unified diff between two note bodies"""
+    return ''.join(difflib.unified_diff(
+        old.splitlines(keepends=True),
+        new.splitlines(keepends=True),
+        fromfile=old_label,
+        tofile=new_label
+    ))
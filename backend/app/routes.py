@@ -1,13 +1,37 @@
 """FastAPI routes for notes"""
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import re
+from datetime import datetime
+
+from fastapi import APIRouter, File, Form, Header, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import Optional, List
 
+from app import bulk, responses
+from app.concurrency import run_blocking
+from app.models import NOTE_FIELDS, VersionConflict
+from app.patch import StaleBase
+from app.render import RENDER_VERSION
+from app.responses import dumps
+from app.revisions import content_hash
+from app.vaults import VaultLocal
+from app.watcher import ExternalEditConflict
+
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
-# Global note app instance (will be injected from main.py)
-note_app = None
+# Global note app instance (will be injected from main.py); under
+# /api/vaults/{vault} it is that vault's, see app.vaults
+note_app = VaultLocal('note_app')
+# Encoded full listing and tree, see app.responses
+response_cache = VaultLocal('response_cache')
 
 class NoteCreate(BaseModel):
     title: str
@@ -18,85 +42,720 @@ class NoteUpdate(BaseModel):
     title: str
     content: str
 
+class TextEdit(BaseModel):
+    start: int = Field(ge=0)
+    end: int = Field(ge=0)
+    text: str = ""
+
+class NotePatch(BaseModel):
+    base_hash: str
+    title: Optional[str] = None
+    edits: List[TextEdit] = []
+
+class NoteMove(BaseModel):
+    parent_id: Optional[int] = None
+    index: Optional[int] = Field(None, ge=0)
+
+class NoteReorder(BaseModel):
+    index: int = Field(ge=0)
+
+class NotePatchResponse(BaseModel):
+    id: int
+    title: str
+    parent_id: Optional[int]
+    created: str
+    modified: str
+    version: int
+    hash: str
+
 class NoteResponse(BaseModel):
     id: int
     title: str
     content: str
     parent_id: Optional[int]
+    position: int = 0
+    created: str
+    modified: str
+    version: int
+
+class NoteMetaResponse(BaseModel):
+    id: int
+    title: str
+    parent_id: Optional[int]
+    position: int
     created: str
     modified: str
+    version: int
 
 class TreeNodeResponse(BaseModel):
     id: int
     title: str
     parent_id: Optional[int]
+    position: int = 0
     children: List['TreeNodeResponse'] = []
 
 TreeNodeResponse.update_forward_refs()
 
+class AncestorResponse(BaseModel):
+    id: int
+    title: str
+    parent_id: Optional[int]
+
+class SearchResult(BaseModel):
+    id: int
+    title: str
+    snippet: str
+    score: float
+
+class SearchResponse(BaseModel):
+    query: str
+    total: int
+    offset: int
+    limit: int
+    results: List[SearchResult]
+
+class ChangeEntry(BaseModel):
+    seq: int
+    id: int
+    op: str
+    title: Optional[str] = None
+    parent_id: Optional[int] = None
+    position: Optional[int] = None
+    created: Optional[str] = None
+    modified: Optional[str] = None
+    version: Optional[int] = None
+
+class ChangeFeedResponse(BaseModel):
+    seq: int
+    has_more: bool
+    reset: bool
+    changes: List[ChangeEntry]
+
+class LinkedNote(BaseModel):
+    id: int
+    title: str
+    links: int
+
+class NoteLink(BaseModel):
+    kind: str
+    id: Optional[int]
+    title: str
+
+class GraphNode(BaseModel):
+    id: int
+    title: str
+    depth: int
+
+class GraphEdge(BaseModel):
+    source: int
+    target: int
+
+class LinkGraphResponse(BaseModel):
+    id: int
+    depth: int
+    truncated: bool
+    nodes: List[GraphNode]
+    edges: List[GraphEdge]
+
+class OutlineEntry(BaseModel):
+    level: int
+    text: str
+    id: str
+
+class RenderedNote(BaseModel):
+    hash: str
+    html: str
+    outline: List[OutlineEntry]
+
+class ImportResponse(BaseModel):
+    imported: int
+    root_ids: List[int]
+
+class RevisionResponse(BaseModel):
+    id: int
+    note_id: int
+    hash: str
+    title: str
+    size: int
+    created: str
+
+class RevisionContentResponse(RevisionResponse):
+    content: str
+
+class RevisionDiffResponse(BaseModel):
+    note_id: int
+    revision_id: int
+    against_id: Optional[int]
+    diff: str
+
+# How often the change stream checks for new changes, and sends keep-alives
+STREAM_POLL_SECONDS = 0.5
+STREAM_KEEPALIVE_SECONDS = 15
+
 def set_note_app(app):
     """Set the global note app instance"""
-    global note_app
-    note_app = app
+    note_app.default = app
+    response_cache.default = responses.from_options(app.options)
+
+async def cached_json(request, name, build):
+    """Serve the JSON of build() from the response cache
+    
+    Entries are keyed by the change sequence, which every note mutation
+    advances, and by the database, which a notes directory switch replaces.
+    The key is taken before building, so a body never claims to be newer
+    than the data it was built from; X-Change-Seq tells which sequence
+    that is. A body built while a write was under way may hold part of
+    it, or a change that is undone, so it is served but not cached.
+    """
+    quiet = note_app.write_gate.quiet_token()
+    seq = note_app.change_seq
+    headers = {'X-Change-Seq': str(seq)}
+    if not response_cache:
+        body = dumps(await run_blocking(note_app, build))
+        return Response(content=body, media_type='application/json', headers=headers)
+    
+    key = (note_app.db, seq)
+    entry = response_cache.lookup(name, key)
+    if entry is None:
+        def current():
+            return (quiet is not None and note_app.write_gate.quiet_token() == quiet
+                    and note_app.change_seq == seq)
+        
+        entry = await run_blocking(note_app, response_cache.fill, name, key, build, current)
+    
+    headers['ETag'] = entry.etag
+    headers['Vary'] = 'Accept-Encoding'
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    
+    coding = entry.coding_for(request.headers.get('accept-encoding', ''))
+    body = entry.variant(coding)
+    if body is None and entry.compress_inline:
+        body = await run_blocking(note_app, entry.compress, coding)
+    elif body is None:
+        # Too large to compress while the client waits; this one goes out plain
+        entry.compress_later(coding, note_app.executor)
+        coding, body = None, entry.body
+    if coding is not None:
+        headers['Content-Encoding'] = coding
+    return Response(content=body, media_type='application/json', headers=headers)
+
+def encode_cursor(note_id):
+    """Encode the last note id of a page as an opaque cursor"""
+    return base64.urlsafe_b64encode(str(note_id).encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a cursor back to a note id"""
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields):
+    """Parse a comma-separated fields= projection"""
+    selected = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in selected if f not in NOTE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+def parse_modified_since(value):
+    """Normalize an ISO timestamp to the local-time format notes are stored in"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="modified_since must be an ISO 8601 timestamp")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+ETAG = re.compile(r'^"(\d+)-(.+)"$')
+
+def note_etag(note):
+    """Return the ETag of a note: its version plus its creation time, which
+    tells apart notes that got the same id after a delete"""
+    return f'"{note["version"]}-{note["created"]}"'
+
+def etag_matches(header, etag):
+    """Return True if an If-None-Match header lists etag"""
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+def required_version(note_id, if_match):
+    """Return the note version an If-Match header asks for, or None for no condition
+    
+    Raises 412 when no listed ETag belongs to the current note. The version
+    itself is compared by NoteApp, atomically with the write.
+    """
+    if if_match is None or if_match.strip() == '*':
+        return None
+    current = note_app.get_note_version(note_id)
+    if current is None:
+        return None
+    version, created = current
+    for tag in if_match.split(','):
+        match = ETAG.match(tag.strip())
+        if match and match.group(2) == created:
+            return int(match.group(1))
+    raise precondition_failed(note_id)
+
+def precondition_failed(note_id):
+    """Return a 412 error carrying the note's current ETag"""
+    headers = {}
+    current = note_app.get_note_version(note_id)
+    if current is not None:
+        headers['ETag'] = note_etag({'version': current[0], 'created': current[1]})
+    return HTTPException(
+        status_code=412,
+        detail=f"Note {note_id} has been changed by another client",
+        headers=headers
+    )
 
 @router.get("/", response_model=List[NoteResponse])
-async def get_notes():
-    """Get all notes"""
+async def get_notes(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    modified_since: Optional[str] = None
+):
+    """Get all notes, or one page of them
+    
+    Without query parameters every note is returned. With any of limit,
+    cursor, fields or modified_since the notes are paginated by id: the
+    X-Next-Cursor response header holds the cursor for the next page and is
+    absent on the last page. fields is a comma-separated projection such as
+    "id,title,parent_id,modified" for metadata-only listings. The full
+    listing is served from the response cache.
+    """
     if not note_app:
         raise HTTPException(status_code=500, detail="Note app not initialized")
-    return note_app.get_notes()
+    
+    if limit is None and cursor is None and fields is None and modified_since is None:
+        return await cached_json(request, 'notes', note_app.get_notes)
+    
+    items, next_after_id = await run_blocking(
+        note_app,
+        note_app.list_notes,
+        limit=limit or 100,
+        after_id=decode_cursor(cursor) if cursor else None,
+        fields=parse_fields(fields) if fields else None,
+        modified_since=parse_modified_since(modified_since) if modified_since else None
+    )
+    
+    # Rows come straight from the store, so skip per-item model validation
+    headers = {}
+    if next_after_id is not None:
+        headers['X-Next-Cursor'] = encode_cursor(next_after_id)
+    return JSONResponse(content=items, headers=headers)
 
 @router.get("/tree", response_model=List[TreeNodeResponse])
-async def get_notes_tree():
-    """Get notes as tree structure"""
+async def get_notes_tree(request: Request):
+    """Get notes as tree structure
+    
+    The X-Change-Seq header holds the change sequence the tree reflects, to
+    be passed as `since` to /changes afterwards.
+    """
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    return await cached_json(request, 'tree', note_app.get_notes_tree)
+
+@router.get("/changes", response_model=ChangeFeedResponse)
+async def get_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000)
+):
+    """Get note and tree changes after a change sequence number"""
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    return await run_blocking(note_app, note_app.get_changes, since, limit)
+
+@router.get("/changes/stream")
+async def stream_changes(
+    request: Request,
+    since: int = Query(0, ge=0),
+    last_event_id: Optional[int] = Header(None)
+):
+    """Stream changes as server-sent events
+    
+    Each event carries a change feed page as JSON and uses its seq as the
+    event id, so a reconnecting EventSource resumes via Last-Event-ID.
+    """
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    
+    async def events(seq):
+        idle = 0.0
+        while not await request.is_disconnected():
+            if note_app.change_seq != seq:
+                feed = await run_blocking(note_app, note_app.get_changes, seq)
+                seq = feed['seq']
+                idle = 0.0
+                yield f"id: {seq}\nevent: changes\ndata: {json.dumps(feed)}\n\n"
+                if feed['has_more']:
+                    continue
+            elif idle >= STREAM_KEEPALIVE_SECONDS:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(STREAM_POLL_SECONDS)
+            idle += STREAM_POLL_SECONDS
+    
+    start = last_event_id if last_event_id is not None else since
+    return StreamingResponse(
+        events(start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+@router.get("/search", response_model=SearchResponse)
+async def search_notes(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    """Full-text search over note titles and content"""
     if not note_app:
         raise HTTPException(status_code=500, detail="Note app not initialized")
-    return note_app.get_notes_tree()
+    if not note_app.search_enabled:
+        raise HTTPException(status_code=503, detail="Full-text search is not available")
+    
+    return await run_blocking(note_app, note_app.search_notes, q, limit, offset)
+
+def import_archive(fileobj, parent_id):
+    """Import the notes of a zip or tar file object"""
+    source = bulk.open_archive(fileobj, note_app.options.getint('storage', 'import_max_note_bytes'))
+    try:
+        return note_app.import_notes(bulk.read_notes(source), parent_id)
+    finally:
+        source.close()
+
+@router.post("/import", response_model=ImportResponse)
+async def import_notes(file: UploadFile = File(...), parent_id: Optional[int] = Form(None)):
+    """Import a zip or tar archive of markdown files
+    
+    Folders become parent notes (see app.bulk). The imported notes go to
+    the top level, or under parent_id.
+    """
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    if parent_id is not None and not note_app.has_note(parent_id):
+        raise HTTPException(status_code=404, detail="Parent note not found")
+    
+    try:
+        # The multipart parser spools large uploads to disk, which is seekable
+        imported, root_ids = await run_blocking(note_app, import_archive, file.file, parent_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await file.close()
+    
+    return {'imported': imported, 'root_ids': root_ids}
+
+@router.get("/export")
+async def export_notes(format: str = 'zip', note_id: Optional[int] = None):
+    """Download every note, or one note's subtree, as a zip or tar archive
+    
+    format is zip, tar or tar.gz. The archive is streamed as it is
+    written, one note at a time.
+    """
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    if format not in bulk.ARCHIVE_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+    if note_id is not None and not note_app.has_note(note_id):
+        raise HTTPException(status_code=404, detail="Note not found")
+    
+    filename = f"notes-{datetime.now():%Y%m%d-%H%M%S}.{format}"
+    # A sync generator is iterated in a worker thread, off the event loop
+    return StreamingResponse(
+        bulk.stream_archive(note_app.export_notes(note_id), format),
+        media_type=bulk.ARCHIVE_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
 
 @router.get("/{note_id}", response_model=NoteResponse)
-async def get_note(note_id: int):
-    """Get a specific note"""
+async def get_note(note_id: int, response: Response, if_none_match: Optional[str] = Header(None)):
+    """Get a specific note
+    
+    The ETag identifies the note's version; with a matching If-None-Match
+    the answer is 304 Not Modified and the content is not read at all.
+    """
     if not note_app:
         raise HTTPException(status_code=500, detail="Note app not initialized")
     
-    note = next((n for n in note_app.notes if n['id'] == note_id), None)
+    current = note_app.get_note_version(note_id)
+    if current is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    etag = note_etag({'version': current[0], 'created': current[1]})
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+    
+    note = await run_blocking(note_app, note_app.get_note, note_id)
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
     
+    # no-cache: browsers may keep the note but must revalidate it with the ETag
+    response.headers['ETag'] = note_etag(note)
+    response.headers['Cache-Control'] = 'no-cache'
     return note
 
+@router.get("/{note_id}/html", response_model=RenderedNote)
+async def get_note_html(note_id: int, if_none_match: Optional[str] = Header(None)):
+    """Get a note rendered to sanitized HTML, with its heading outline
+    
+    Rendered notes are stored by content hash (see app.render), so this is
+    usually a cache read. The ETag is the content hash; a matching
+    If-None-Match gets 304 Not Modified.
+    """
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    
+    rendered = await run_blocking(note_app, note_app.render_note, note_id)
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    digest, body = rendered
+    headers = {'ETag': f'"{digest}-r{RENDER_VERSION}"', 'Cache-Control': 'no-cache'}
+    if if_none_match and etag_matches(if_none_match, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
 @router.post("/", response_model=NoteResponse)
-async def create_note(note: NoteCreate):
+async def create_note(note: NoteCreate, response: Response):
     """Create a new note"""
     if not note_app:
         raise HTTPException(status_code=500, detail="Note app not initialized")
     
-    new_note = note_app.add_note(note.title, note.content, note.parent_id)
+    new_note = await run_blocking(note_app, note_app.add_note, note.title, note.content, note.parent_id)
+    response.headers['ETag'] = note_etag(new_note)
     return new_note
 
 @router.put("/{note_id}", response_model=NoteResponse)
-async def update_note(note_id: int, note: NoteUpdate):
-    """Update a note"""
-    print(f"[Backend] update_note called: note_id={note_id}, title='{note.title}'")
+async def update_note(note_id: int, note: NoteUpdate, response: Response,
+                      if_match: Optional[str] = Header(None)):
+    """Update a note
+    
+    With If-Match, the update only happens if the note is still at that
+    ETag; otherwise the answer is 412 with the current ETag.
+    """
+    logger.debug("update_note called id=%s title=%r", note_id, note.title)
     
     if not note_app:
         raise HTTPException(status_code=500, detail="Note app not initialized")
     
-    updated_note = note_app.update_note(note_id, note.title, note.content)
+    expected_version = required_version(note_id, if_match)
+    try:
+        updated_note = await run_blocking(
+            note_app, note_app.update_note, note_id, note.title, note.content, expected_version
+        )
+    except VersionConflict:
+        raise precondition_failed(note_id)
+    except ExternalEditConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if not updated_note:
         raise HTTPException(status_code=404, detail="Note not found")
     
-    print(f"[Backend] Note {note_id} updated successfully")
+    logger.debug("note updated id=%s version=%s", note_id, updated_note['version'])
+    response.headers['ETag'] = note_etag(updated_note)
     return updated_note
 
+@router.patch("/{note_id}", response_model=NotePatchResponse)
+async def patch_note(note_id: int, patch: NotePatch, response: Response,
+                     if_match: Optional[str] = Header(None)):
+    """Apply text edits to a note
+    
+    Edits replace base[start:end] with text, where base is the content whose
+    SHA-256 is base_hash and offsets count UTF-16 code units. Returns the new
+    content hash but not the content. Fails with 409 and the current hash in
+    X-Content-Hash when the note has changed since the base. If-Match works
+    as for PUT.
+    """
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    
+    expected_version = required_version(note_id, if_match)
+    edits = [(edit.start, edit.end, edit.text) for edit in patch.edits]
+    try:
+        updated_note = await run_blocking(
+            note_app, note_app.patch_note, note_id, patch.base_hash, edits, patch.title, expected_version
+        )
+    except VersionConflict:
+        raise precondition_failed(note_id)
+    except StaleBase as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={'X-Content-Hash': e.current_hash})
+    except ExternalEditConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not updated_note:
+        raise HTTPException(status_code=404, detail="Note not found")
+    
+    response.headers['ETag'] = note_etag(updated_note)
+    return {**updated_note, 'hash': content_hash(updated_note['content'])}
+
 @router.delete("/{note_id}")
-async def delete_note(note_id: int):
-    """Delete a note"""
+async def delete_note(note_id: int, if_match: Optional[str] = Header(None)):
+    """Delete a note (and its children), conditionally with If-Match"""
     if not note_app:
         raise HTTPException(status_code=500, detail="Note app not initialized")
     
-    if not any(n['id'] == note_id for n in note_app.notes):
+    if not note_app.has_note(note_id):
         raise HTTPException(status_code=404, detail="Note not found")
     
-    note_app.delete_note(note_id)
+    expected_version = required_version(note_id, if_match)
+    try:
+        await run_blocking(note_app, note_app.delete_note, note_id, expected_version)
+    except VersionConflict:
+        raise precondition_failed(note_id)
     return {"message": "Note deleted successfully"}
+
+async def place_note(note_id, if_match, method, *args):
+    """Run a NoteApp move method, mapping its failures to HTTP errors"""
+    expected_version = required_version(note_id, if_match)
+    try:
+        moved = await run_blocking(note_app, method, note_id, *args, expected_version)
+    except VersionConflict:
+        raise precondition_failed(note_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not moved:
+        raise HTTPException(status_code=404, detail="Note not found")
+    return moved
+
+@router.post("/{note_id}/move", response_model=NoteMetaResponse)
+async def move_note(note_id: int, target: NoteMove, response: Response,
+                    if_match: Optional[str] = Header(None)):
+    """Move a note and its subtree under parent_id (null for the top level)
+    
+    index is the place among the new siblings, last when omitted. Only the
+    moved subtree's rows are rewritten. Fails with 400 for a move under the
+    note's own subtree and 404 for a missing note or parent.
+    """
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    moved = await place_note(note_id, if_match, note_app.move_note, target.parent_id, target.index)
+    response.headers['ETag'] = note_etag(moved)
+    return moved
+
+@router.post("/{note_id}/reorder", response_model=NoteMetaResponse)
+async def reorder_note(note_id: int, target: NoteReorder, response: Response,
+                       if_match: Optional[str] = Header(None)):
+    """Move a note to another place among its siblings"""
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    moved = await place_note(note_id, if_match, note_app.reorder_note, target.index)
+    response.headers['ETag'] = note_etag(moved)
+    return moved
+
+@router.get("/{note_id}/subtree", response_model=TreeNodeResponse)
+async def get_subtree(note_id: int, depth: Optional[int] = Query(None, ge=0)):
+    """Get a note with its descendants, down to depth levels below it when given"""
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    
+    subtree = await run_blocking(note_app, note_app.get_subtree, note_id, depth)
+    if subtree is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    return subtree
+
+@router.get("/{note_id}/ancestors", response_model=List[AncestorResponse])
+async def get_ancestors(note_id: int, depth: Optional[int] = Query(None, ge=1)):
+    """Get the path from the top level down to a note's parent
+    
+    depth keeps only that many of the nearest ancestors.
+    """
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    
+    ancestors = note_app.get_ancestors(note_id, depth)
+    if ancestors is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    return ancestors
+
+@router.get("/{note_id}/backlinks", response_model=List[LinkedNote])
+async def get_backlinks(note_id: int):
+    """List the notes linking to a note, with how many links each has to it"""
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    if not note_app.has_note(note_id):
+        raise HTTPException(status_code=404, detail="Note not found")
+    
+    return await run_blocking(note_app, note_app.get_backlinks, note_id)
+
+@router.get("/{note_id}/links", response_model=List[NoteLink])
+async def get_links(note_id: int):
+    """List a note's outgoing links; id is null for links to no existing note"""
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    if not note_app.has_note(note_id):
+        raise HTTPException(status_code=404, detail="Note not found")
+    
+    return await run_blocking(note_app, note_app.get_links, note_id)
+
+@router.get("/{note_id}/graph", response_model=LinkGraphResponse)
+async def get_link_graph(
+    note_id: int,
+    depth: int = Query(1, ge=1, le=5),
+    limit: int = Query(200, ge=1, le=2000)
+):
+    """Get the notes within depth links of a note, following links either way
+    
+    At most limit notes are returned, nearest first; truncated is true when
+    more were in reach.
+    """
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    if not note_app.has_note(note_id):
+        raise HTTPException(status_code=404, detail="Note not found")
+    
+    return await run_blocking(note_app, note_app.get_link_graph, note_id, depth, limit)
+
+def require_history():
+    """Fail with 404 when revision history is disabled"""
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    if note_app.revisions is None:
+        raise HTTPException(status_code=404, detail="Revision history is disabled")
+
+@router.get("/{note_id}/revisions", response_model=List[RevisionResponse])
+async def list_revisions(note_id: int):
+    """List a note's revisions, newest first"""
+    require_history()
+    if not note_app.has_note(note_id):
+        raise HTTPException(status_code=404, detail="Note not found")
+    
+    return await run_blocking(note_app, note_app.list_revisions, note_id)
+
+@router.get("/{note_id}/revisions/{revision_id}", response_model=RevisionContentResponse)
+async def get_revision(note_id: int, revision_id: int):
+    """Get one revision of a note with its content"""
+    require_history()
+    revision = await run_blocking(note_app, note_app.get_revision, note_id, revision_id)
+    if not revision:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    
+    return revision
+
+@router.get("/{note_id}/revisions/{revision_id}/diff", response_model=RevisionDiffResponse)
+async def diff_revision(note_id: int, revision_id: int, against: Optional[int] = None):
+    """Unified diff from a revision to another revision (against=) or to the current note"""
+    require_history()
+    diff = await run_blocking(note_app, note_app.diff_revision, note_id, revision_id, against)
+    if not diff:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    
+    return diff
+
+@router.post("/{note_id}/revisions/{revision_id}/restore", response_model=NoteResponse)
+async def restore_revision(note_id: int, revision_id: int, response: Response):
+    """Restore a note's title and content from a revision"""
+    require_history()
+    try:
+        restored = await run_blocking(note_app, note_app.restore_revision, note_id, revision_id)
+    except ExternalEditConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not restored:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    
+    response.headers['ETag'] = note_etag(restored)
+    return restored
@@ -0,0 +1,134 @@
+"""Full-text search over notes using an SQLite FTS5 index
+
+The index lives next to the `notes` table in note_index.db and is keyed by
+note id (the FTS rowid). All functions take an open connection so callers
+can keep index updates in the same transaction as the note row write.
+"""
+
+import html
+import sqlite3
+
+FTS_SCHEMA = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+        title,
+        content,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+'''
+
+# Title matches weigh more than body matches when ranking
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+
+# FTS5 marks matches with these; they become <mark> tags once the note text
+# around them is escaped. A stray one in a note only adds an empty tag.
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+
+def create_search_index(conn):
+    """Create the FTS table, returning False if SQLite lacks FTS5"""
+    try:
+        conn.execute(FTS_SCHEMA)
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def is_built(conn):
+    """Return True once the index has been populated for this vault"""
+    row = conn.execute("SELECT value FROM meta WHERE key = 'fts_built'").fetchone()
+    return row is not None
+
+
+def build(conn, notes):
+    """Populate the index from (id, title, content) tuples and mark it built"""
+    conn.execute('DELETE FROM notes_fts')
+    conn.executemany(
+        'INSERT INTO notes_fts (rowid, title, content) VALUES (?, ?, ?)',
+        notes
+    )
+    conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('optimize')")
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fts_built', '1')")
+
+
+def index_note(conn, note_id, title, content):
+    """Add or replace a single note in the index"""
+    conn.execute('DELETE FROM notes_fts WHERE rowid = ?', (note_id,))
+    conn.execute(
+        'INSERT INTO notes_fts (rowid, title, content) VALUES (?, ?, ?)',
+        (note_id, title, content)
+    )
+
+
+def index_notes(conn, notes):
+    """Add or replace a list of (id, title, content) tuples in the index"""
+    conn.executemany('DELETE FROM notes_fts WHERE rowid = ?', [(note[0],) for note in notes])
+    conn.executemany(
+        'INSERT INTO notes_fts (rowid, title, content) VALUES (?, ?, ?)',
+        notes
+    )
+
+
+def unindex_notes(conn, note_ids):
+    """Remove notes from the index"""
+    conn.executemany(
+        'DELETE FROM notes_fts WHERE rowid = ?',
+        [(nid,) for nid in note_ids]
+    )
+
+
+def build_query(text):
+    """Turn free text into an FTS5 query
+
+    Every word must match; the last word also matches as a prefix so that
+    results update while the user is typing. Words are quoted so that FTS5
+    operators in user input are treated as plain text.
+    """
+    words = text.split()
+    if not words:
+        return None
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlighted(text):
+    """Escape FTS5 output for HTML and turn its match markers into <mark> tags"""
+    if text is None:
+        return None
+    return html.escape(text).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def search(conn, text, limit=20, offset=0):
+    """Return (total, results) for a ranked search with highlighted snippets
+
+    Titles and snippets are HTML: the note text is escaped and matches are
+    wrapped in <mark>.
+    """
+    query = build_query(text)
+    if query is None:
+        return 0, []
+
+    total = conn.execute(
+        'SELECT COUNT(*) FROM notes_fts WHERE notes_fts MATCH ?', (query,)
+    ).fetchone()[0]
+
+    rows = conn.execute(f'''
+        SELECT rowid AS id,
+               highlight(notes_fts, 0, '{MATCH_START}', '{MATCH_END}') AS title,
+               snippet(notes_fts, 1, '{MATCH_START}', '{MATCH_END}', '...', 16) AS snippet,
+               -bm25(notes_fts, {TITLE_WEIGHT}, {CONTENT_WEIGHT}) AS score
+        FROM notes_fts
+        WHERE notes_fts MATCH ?
+        ORDER BY score DESC
+        LIMIT ? OFFSET ?
+    ''', (query, limit, offset)).fetchall()
+
+    results = []
+    for row in rows:
+        result = dict(row)
+        result['title'] = highlighted(result['title'])
+        result['snippet'] = highlighted(result['snippet'])
+        results.append(result)
+    return total, results
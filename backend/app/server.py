@@ -0,0 +1,157 @@
+"""FastAPI application factory for YZC Notes"""
+
+import asyncio
+import logging
+
+from fastapi import Depends, FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from fastapi.staticfiles import StaticFiles
+from pathlib import Path
+
+from app import attachments, routes, settings, vaults
+from app.metrics import REGISTRY, Counter, Gauge, MetricsMiddleware, monitor_event_loop
+
+logger = logging.getLogger(__name__)
+
+BUILD_DIR = Path(__file__).parent.parent.parent / "frontend" / "build"
+
+def note_app_metrics(note_app):
+    """Return a collector reading the NoteApp's own counters at scrape time"""
+    def collect():
+        notes = Gauge('noteapp_notes', 'Notes in the vault')
+        notes.set(len(note_app.notes))
+        change_seq = Gauge('noteapp_change_seq', 'Sequence number of the latest note change')
+        change_seq.set(note_app.change_seq)
+        metrics = [notes, change_seq]
+
+        stats = note_app.cache_stats()
+        if stats is not None:
+            for key in ('hits', 'misses', 'evictions'):
+                counter = Counter(f'noteapp_content_cache_{key}_total', f'Content cache {key}')
+                counter.inc(stats[key])
+                metrics.append(counter)
+            for key in ('entries', 'bytes'):
+                gauge = Gauge(f'noteapp_content_cache_{key}', f'Content cache {key} in use')
+                gauge.set(stats[key])
+                metrics.append(gauge)
+        return metrics
+    return collect
+
+def response_cache_metrics():
+    """Collect the response cache counters of app.routes at scrape time"""
+    if not routes.response_cache:
+        return []
+    stats = routes.response_cache.stats()
+    metrics = []
+    for key in ('hits', 'misses'):
+        counter = Counter(f'noteapp_response_cache_{key}_total', f'Response cache {key}')
+        counter.inc(stats[key])
+        metrics.append(counter)
+    size = Gauge('noteapp_response_cache_bytes', 'Encoded and compressed response bytes cached')
+    size.set(stats['bytes'])
+    metrics.append(size)
+    return metrics
+
+def vault_metrics():
+    """Collect the vault registry's open vaults and counters at scrape time"""
+    if vaults.registry is None:
+        return []
+    stats = vaults.registry.stats()
+    opened = Gauge('noteapp_vaults_open', 'Vaults with an open NoteApp')
+    opened.set(len(stats['open']))
+    memory = Gauge('noteapp_vault_memory_bytes', 'Estimated memory held by an open vault', ('vault',))
+    for name, vault in stats['open'].items():
+        memory.set(vault['memory_bytes'], vault=name)
+    metrics = [opened, memory]
+    for key in ('opens', 'evictions'):
+        counter = Counter(f'noteapp_vault_{key}_total', f'Vault {key}')
+        counter.inc(stats[key])
+        metrics.append(counter)
+    return metrics
+
+def create_app(note_app):
+    """Create the FastAPI app serving the given NoteApp"""
+    app = FastAPI(
+        title="YZC Notes API",
+        description="Note taking application with tree structure support",
+        version="1.0.0"
+    )
+    
+    # Add CORS middleware to allow React frontend communication
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # In production, specify your React app URL
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "X-Change-Seq", "X-Content-Hash", "ETag"],
+    )
+    app.add_middleware(MetricsMiddleware)
+    
+    # Set the note app instance in route modules
+    routes.set_note_app(note_app)
+    settings.set_note_app(note_app)
+    attachments.set_note_app(note_app)
+    vaults.set_registry(vaults.VaultRegistry.from_options(note_app.options, default_app=note_app))
+    REGISTRY.register_collector('noteapp', note_app_metrics(note_app))
+    REGISTRY.register_collector('responses', response_cache_metrics)
+    REGISTRY.register_collector('vaults', vault_metrics)
+    
+    # Include routers
+    app.include_router(routes.router, prefix="/api/notes", tags=["notes"])
+    app.include_router(settings.router, prefix="/api/settings", tags=["settings"])
+    app.include_router(attachments.router, prefix="/api/attachments", tags=["attachments"])
+    # The same notes and attachments routes for each vault of [vaults] directory
+    app.include_router(vaults.router, prefix="/api/vaults", tags=["vaults"])
+    vault_scope = [Depends(vaults.use_vault)]
+    app.include_router(routes.router, prefix="/api/vaults/{vault}/notes", tags=["vaults"],
+                       dependencies=vault_scope)
+    app.include_router(attachments.router, prefix="/api/vaults/{vault}/attachments", tags=["vaults"],
+                       dependencies=vault_scope)
+    
+    @app.on_event("startup")
+    async def startup_event():
+        """Initialize app on startup"""
+        logger.info("api started notes_dir=%s database=%s", note_app.notes_dir, note_app.db_path)
+        app.state.loop_monitor = asyncio.create_task(monitor_event_loop())
+        app.state.vault_sweeper = None
+        if vaults.registry is not None:
+            logger.info("vaults enabled directory=%s", vaults.registry.root)
+            app.state.vault_sweeper = asyncio.create_task(vaults.sweep_idle_vaults())
+    
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        """Release the storage thread pool and database connections on shutdown"""
+        app.state.loop_monitor.cancel()
+        if app.state.vault_sweeper is not None:
+            app.state.vault_sweeper.cancel()
+            vaults.registry.close()
+        note_app.close()
+    
+    @app.get("/api/health")
+    async def health_check():
+        """Health check endpoint"""
+        return {
+            "status": "healthy",
+            "notes_count": len(note_app.notes),
+            "notes_dir": str(note_app.notes_dir),
+            "content_loaded": note_app.contents_loaded.is_set(),
+            "content_cache": note_app.cache_stats(),
+            "render_cache": note_app.renders.stats(),
+            "response_cache": routes.response_cache.stats() if routes.response_cache else None,
+            "vaults": vaults.registry.stats() if vaults.registry is not None else None
+        }
+    
+    @app.get("/api/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        """Request, operation, SQLite and cache metrics in the Prometheus text format"""
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+    
+    # Serve static files from the React build directory
+    if BUILD_DIR.exists():
+        app.mount("/", StaticFiles(directory=str(BUILD_DIR), html=True), name="static")
+    else:
+        logger.warning("frontend build missing path=%s hint=%s", BUILD_DIR, "run 'npm run build' in frontend")
+    
+    return app
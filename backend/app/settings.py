@@ -1,8 +1,12 @@
 """FastAPI routes for settings"""
 
+from typing import Optional
+
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
+from app.concurrency import run_blocking
+
 router = APIRouter()
 
 # Global note app instance
@@ -11,8 +15,20 @@ note_app = None
 class SettingsUpdate(BaseModel):
     notes_directory: str
 
+class MigrationStatus(BaseModel):
+    state: str
+    source: str
+    target: str
+    files_total: int
+    files_done: int
+    bytes_copied: int
+    started: Optional[str]
+    finished: Optional[str]
+    error: Optional[str]
+
 class SettingsResponse(BaseModel):
     notes_directory: str
+    migration: Optional[MigrationStatus] = None
 
 def set_note_app(app):
     """Set the global note app instance"""
@@ -27,11 +43,27 @@ async def get_settings():
     
     return note_app.get_settings()
 
+@router.get("/migration", response_model=MigrationStatus)
+async def get_migration():
+    """Get the progress of the latest notes directory move"""
+    if not note_app:
+        raise HTTPException(status_code=500, detail="Note app not initialized")
+    
+    status = note_app.get_migration()
+    if status is None:
+        raise HTTPException(status_code=404, detail="No migration has been started")
+    return status
+
 @router.put("/", response_model=SettingsResponse)
 async def update_settings(settings: SettingsUpdate):
-    """Update settings"""
+    """Update settings; a new notes directory is migrated in the background"""
     if not note_app:
         raise HTTPException(status_code=500, detail="Note app not initialized")
     
-    updated_settings = note_app.update_settings(settings.dict())
+    try:
+        updated_settings = await run_blocking(note_app, note_app.update_settings, settings.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if updated_settings is None:
+        raise HTTPException(status_code=409, detail="A notes directory migration is already running")
     return updated_settings
@@ -0,0 +1,67 @@
+"""Startup snapshot of note metadata
+
+On a clean shutdown NoteApp writes the metadata of every note to
+`.snapshot.json` in the notes directory, stamped with the size and mtime
+of note_index.db and its WAL file. The next start loads the notes with a
+single file read instead of querying the database, as long as the stamp
+still matches, i.e. nothing wrote to the index in between (a crash leaves
+the WAL behind and invalidates the stamp). Note content is not part of the
+snapshot; it is read from the note files after startup. Rows hold the
+fields of NoteRecord.row(), timestamps as integers.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+
+from app.journal import write_file_atomic
+from app.records import NoteRecord
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = '.snapshot.json'
+SNAPSHOT_VERSION = 4
+
+
+def index_stamp(db_path):
+    """Return [size, mtime_ns] (or None when missing) of the database and its WAL"""
+    stamp = []
+    for suffix in ('', '-wal'):
+        try:
+            st = os.stat(f"{db_path}{suffix}")
+        except FileNotFoundError:
+            stamp.append(None)
+        else:
+            stamp.append([st.st_size, st.st_mtime_ns])
+    return stamp
+
+
+def read_snapshot(notes_dir, db_path):
+    """Return the notes of a snapshot that matches the index, or None"""
+    path = Path(notes_dir) / SNAPSHOT_FILE
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.warning("snapshot ignored reason=unreadable error=%r", e)
+        return None
+
+    if data.get('version') != SNAPSHOT_VERSION or data.get('stamp') != index_stamp(db_path):
+        return None
+    return [NoteRecord.from_row(row) for row in data['notes']]
+
+
+def write_snapshot(notes_dir, db_path, notes):
+    """Write the metadata of notes, stamped with the current state of the index"""
+    data = {
+        'version': SNAPSHOT_VERSION,
+        'stamp': index_stamp(db_path),
+        'notes': [note.row() for note in notes],
+    }
+    write_file_atomic(
+        Path(notes_dir) / SNAPSHOT_FILE,
+        json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    )
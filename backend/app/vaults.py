@@ -0,0 +1,325 @@
+"""Serving many vaults from one process
+
+Every folder under the `[vaults] directory` option is a vault, served at
+`/api/vaults/{name}/notes` and `/api/vaults/{name}/attachments` by the same
+routes as the default vault at `/api/notes`. Each vault is a NoteApp of its
+own, with its own locks, database connections, storage thread pool and
+response cache, so a slow or busy vault does not hold up the others.
+
+VaultRegistry opens a vault on its first request and closes idle ones,
+least recently used first, when more than `max_open` are open or together
+they hold more than `memory_budget_bytes`. A vault serving a request is
+never closed. The routes modules keep referring to a module-level
+`note_app`; it is a VaultLocal that resolves to the vault of the current
+request, or to the default NoteApp outside the vault routes.
+"""
+
+import asyncio
+import contextvars
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+from app import responses
+from app.models import NoteApp
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Global vault registry, None while vaults are turned off
+registry = None
+
+# Vault names are folder names: no dots, so `.objects` and friends never match
+VAULT_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+
+# How often idle vaults are looked for
+SWEEP_SECONDS = 60
+
+# The vault the current request addresses, None outside the vault routes
+current_vault = contextvars.ContextVar('current_vault', default=None)
+
+
+class VaultLocal:
+    """Stands in for an attribute of the current request's vault
+
+    Attribute access goes to that vault's attribute, or to default outside
+    the vault routes.
+    """
+
+    def __init__(self, attr, default=None):
+        self._attr = attr
+        self.default = default
+
+    def get(self):
+        vault = current_vault.get()
+        return self.default if vault is None else getattr(vault, self._attr)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __bool__(self):
+        return self.get() is not None
+
+
+class Vault:
+    """An open vault: its NoteApp, response cache and requests in flight"""
+
+    def __init__(self, name, note_app):
+        self.name = name
+        self.note_app = note_app
+        self.response_cache = responses.from_options(note_app.options)
+        self.requests = 0
+        self.last_used = time.monotonic()
+
+    def memory_usage(self):
+        size = self.note_app.memory_usage()
+        if self.response_cache is not None:
+            size += self.response_cache.stats()['bytes']
+        return size
+
+
+class VaultRegistry:
+    """Opens vaults on demand and closes idle ones beyond the limits"""
+
+    def __init__(self, root, max_open=16, memory_budget=1024 * 1024 * 1024, idle_seconds=1800,
+                 default_app=None):
+        self.root = Path(root)
+        self.max_open = max_open
+        self.memory_budget = memory_budget
+        self.idle_seconds = idle_seconds
+        # Never opened twice: its folder may sit under root
+        self.default_app = default_app
+        # Least recently used first
+        self._open = {}
+        self._lock = threading.Lock()
+        # Held while a vault is opened or closed, so a folder never has two NoteApps
+        self._name_locks = {}
+        self.opens = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_options(cls, options, default_app=None):
+        """Return the registry configured by options, or None if vaults are off"""
+        directory = options.get('vaults', 'directory')
+        if not directory:
+            return None
+        return cls(
+            directory,
+            max_open=options.getint('vaults', 'max_open'),
+            memory_budget=options.getint('vaults', 'memory_budget_bytes'),
+            idle_seconds=options.getint('vaults', 'idle_seconds'),
+            default_app=default_app
+        )
+
+    def path(self, name):
+        """Return the folder of a vault, or None if name is not an existing vault"""
+        if not VAULT_NAME.match(name):
+            return None
+        path = self.root / name
+        if not path.is_dir():
+            return None
+        if self.default_app is not None and path.resolve() == Path(self.default_app.notes_dir).resolve():
+            return None
+        return path
+
+    def names(self):
+        """Return the names of all vaults, open or not"""
+        if not self.root.is_dir():
+            return []
+        return sorted(path.name for path in self.root.iterdir() if self.path(path.name) is not None)
+
+    def create(self, name):
+        """Create an empty vault; raises ValueError for a bad name, FileExistsError if taken"""
+        if not VAULT_NAME.match(name):
+            raise ValueError(f"Invalid vault name: {name!r}")
+        (self.root / name).mkdir(parents=True)
+        logger.info("vault created name=%s", name)
+
+    def lookup(self, name):
+        """Return an open vault for a request without blocking, or None
+
+        The vault counts as in use until release().
+        """
+        with self._lock:
+            vault = self._open.pop(name, None)
+            if vault is None:
+                return None
+            self._open[name] = vault
+            vault.requests += 1
+            vault.last_used = time.monotonic()
+            return vault
+
+    def acquire(self, name):
+        """Return a vault for a request, opening it if needed; None if there is no such vault
+
+        The vault counts as in use until release().
+        """
+        vault = self.lookup(name)
+        if vault is not None:
+            return vault
+        path = self.path(name)
+        if path is None:
+            return None
+        with self._name_lock(name):
+            # Opened by another request while this one waited
+            vault = self.lookup(name)
+            if vault is not None:
+                return vault
+            start = time.perf_counter()
+            vault = Vault(name, NoteApp(notes_directory=path, global_settings=False))
+            vault.requests = 1
+            with self._lock:
+                self._open[name] = vault
+                self.opens += 1
+            logger.info("vault opened name=%s notes=%d duration_ms=%.1f",
+                        name, len(vault.note_app.notes), (time.perf_counter() - start) * 1000)
+        self.evict()
+        return vault
+
+    def release(self, vault):
+        """Mark one request on a vault as finished"""
+        with self._lock:
+            vault.requests -= 1
+            vault.last_used = time.monotonic()
+
+    def _name_lock(self, name):
+        with self._lock:
+            return self._name_locks.setdefault(name, threading.Lock())
+
+    def _idle(self):
+        """Return the open vaults no request is using, least recently used first"""
+        with self._lock:
+            return [vault for vault in self._open.values() if vault.requests == 0]
+
+    def evict(self):
+        """Close idle vaults until the open ones are within the limits; return their names"""
+        now = time.monotonic()
+        with self._lock:
+            vaults = list(self._open.values())
+        usage = {vault.name: vault.memory_usage() for vault in vaults}
+        total = sum(usage.values())
+        count = len(usage)
+        closed = []
+        for vault in self._idle():
+            stale = now - vault.last_used > self.idle_seconds
+            if not stale and count <= self.max_open and total <= self.memory_budget:
+                continue
+            if self._close(vault):
+                closed.append(vault.name)
+                count -= 1
+                total -= usage.get(vault.name, 0)
+        return closed
+
+    def _close(self, vault):
+        """Close a vault unless a request took it meanwhile; return True if closed"""
+        name_lock = self._name_lock(vault.name)
+        if not name_lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                if vault.requests or self._open.get(vault.name) is not vault:
+                    return False
+                del self._open[vault.name]
+                self.evictions += 1
+            vault.note_app.close()
+            logger.info("vault closed name=%s", vault.name)
+            return True
+        finally:
+            name_lock.release()
+
+    def open_names(self):
+        """Return the names of the open vaults"""
+        with self._lock:
+            return set(self._open)
+
+    def stats(self):
+        """Return the open vaults and registry counters"""
+        with self._lock:
+            vaults = list(self._open.values())
+        return {
+            'open': {vault.name: {'notes': len(vault.note_app.notes), 'requests': vault.requests,
+                                  'memory_bytes': vault.memory_usage()} for vault in vaults},
+            'opens': self.opens,
+            'evictions': self.evictions,
+        }
+
+    def close(self):
+        """Close every open vault"""
+        with self._lock:
+            vaults = list(self._open.values())
+            self._open.clear()
+        for vault in vaults:
+            vault.note_app.close()
+
+
+def set_registry(value):
+    """Set the global vault registry"""
+    global registry
+    registry = value
+
+
+async def use_vault(vault: str):
+    """Route dependency pointing the request at a vault for its duration"""
+    if registry is None:
+        raise HTTPException(status_code=404, detail="Vaults are not enabled")
+    opened = registry.lookup(vault)
+    if opened is None:
+        # Opening reads the whole vault index; keep it off the event loop
+        opened = await asyncio.get_running_loop().run_in_executor(None, registry.acquire, vault)
+    if opened is None:
+        raise HTTPException(status_code=404, detail="Vault not found")
+    current_vault.set(opened)
+    try:
+        yield opened
+    finally:
+        registry.release(opened)
+
+
+async def sweep_idle_vaults():
+    """Close vaults idle past the limits every SWEEP_SECONDS, until cancelled"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(SWEEP_SECONDS)
+        try:
+            await loop.run_in_executor(None, registry.evict)
+        except Exception as e:
+            logger.error("vault sweep failed error=%r", e)
+
+
+class VaultCreate(BaseModel):
+    name: str
+
+class VaultResponse(BaseModel):
+    name: str
+    open: bool
+
+@router.get("/", response_model=List[VaultResponse])
+async def list_vaults():
+    """List the vaults and whether each is open"""
+    if registry is None:
+        raise HTTPException(status_code=404, detail="Vaults are not enabled")
+
+    opened = registry.open_names()
+    names = await asyncio.get_running_loop().run_in_executor(None, registry.names)
+    return [{'name': name, 'open': name in opened} for name in names]
+
+@router.post("/", response_model=VaultResponse, status_code=201)
+async def create_vault(vault: VaultCreate):
+    """Create an empty vault; it opens on its first request"""
+    if registry is None:
+        raise HTTPException(status_code=404, detail="Vaults are not enabled")
+
+    try:
+        registry.create(vault.name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail="Vault already exists")
+    return {'name': vault.name, 'open': False}
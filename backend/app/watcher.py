@@ -0,0 +1,226 @@
+"""Watch the notes directory for markdown files changed by other programs
+
+The watcher keeps the (mtime, size) of every `{id}.md` file as the app
+last read or wrote it. A periodic scan compares that with the directory
+and hands each added, changed or removed file to NoteApp.reload_external,
+which updates only that note. The app reports its own writes through
+note_written(), so they are never mistaken for outside edits. The known
+state is saved to `.watcher.json` at shutdown, so files changed while the
+app was stopped (a git pull, a sync client) are reloaded by the first scan
+after the next start.
+
+Scanning is a stat of every note file. When the optional `watchdog`
+package is installed, filesystem events (inotify and friends) trigger a
+scan right away; the poll interval then only acts as a safety net.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+
+from app.journal import write_file_atomic
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+NOTE_FILE = re.compile(r'^(\d+)\.md$')
+STATE_FILE = '.watcher.json'
+
+
+class ExternalEditConflict(Exception):
+    """A save would overwrite a note file that another program changed"""
+
+    def __init__(self, note_id):
+        super().__init__(f"Note {note_id} was changed on disk by another program")
+        self.note_id = note_id
+
+
+def file_state(path):
+    """Return (mtime_ns, size) of a file, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def scan_files(directory):
+    """Return {note_id: (mtime_ns, size)} for the note files in directory"""
+    states = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            match = NOTE_FILE.match(entry.name)
+            if match and entry.is_file():
+                st = entry.stat()
+                states[int(match.group(1))] = (st.st_mtime_ns, st.st_size)
+    return states
+
+
+def title_from_markdown(content):
+    """Return the text of the first '# ' heading, or None"""
+    for line in content.splitlines():
+        if line.startswith('# '):
+            return line[2:].strip() or None
+    return None
+
+
+class _WakeHandler(FileSystemEventHandler):
+    """Wakes the scan loop on any filesystem event"""
+
+    def __init__(self, wake):
+        self.wake = wake
+
+    def on_any_event(self, event):
+        self.wake.set()
+
+
+class NoteWatcher:
+    """Reloads notes whose files are edited, added or removed outside the app"""
+
+    def __init__(self, note_app, poll_seconds=2.0):
+        self.note_app = note_app
+        self.poll_seconds = poll_seconds
+        self._known = {}
+        # Notes whose files changed while the app was stopped
+        self._changed_offline = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread = threading.Thread(target=self._run, name='note-watcher', daemon=True)
+
+    def start(self):
+        """Start watching from the state saved at the last shutdown
+
+        The first scan then reloads every file changed since. Without a
+        saved state the current files are taken as known.
+        """
+        self.reset(self.load_state())
+        self._thread.start()
+        return self
+
+    def reset(self, saved=None):
+        """Re-read the known state, e.g. after the notes directory changed
+
+        Files of notes the app does not know are left out, so the next
+        scan adds them. saved, as returned by load_state(), replaces the
+        state of the notes it has.
+        """
+        note_app = self.note_app
+        current = scan_files(note_app.notes_dir)
+        known = {nid: state for nid, state in current.items() if note_app.has_note(nid)}
+        saved = {nid: state for nid, state in (saved or {}).items() if note_app.has_note(nid)}
+        known.update(saved)
+        with self._lock:
+            self._known = known
+            self._changed_offline = {nid for nid, state in saved.items() if current.get(nid) != state}
+        self._observe(note_app.notes_dir)
+        self._wake.set()
+
+    def load_state(self):
+        """Return the known state saved by save_state(), or None"""
+        path = self.note_app.notes_dir / STATE_FILE
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            state = {int(nid): tuple(value) for nid, value in data.items()}
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError) as e:
+            logger.error("watcher state load failed path=%s error=%r", path, e)
+            return None
+        logger.info("watcher state loaded notes=%d", len(state))
+        return state
+
+    def save_state(self):
+        """Save the known state, to compare with the files at the next start"""
+        with self._lock:
+            data = {str(nid): list(state) for nid, state in self._known.items()}
+        try:
+            write_file_atomic(self.note_app.notes_dir / STATE_FILE, json.dumps(data))
+        except OSError as e:
+            logger.error("watcher state save failed error=%r", e)
+
+    def _observe(self, directory):
+        """(Re)start filesystem notifications for directory when watchdog is available"""
+        if Observer is None:
+            return
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        self._observer = Observer()
+        self._observer.schedule(_WakeHandler(self._wake), str(directory), recursive=False)
+        self._observer.start()
+
+    def note_written(self, note_ids):
+        """Record files the app itself just wrote or removed"""
+        for nid in note_ids:
+            state = file_state(self.note_app.notes_dir / f"{nid}.md")
+            with self._lock:
+                if state is None:
+                    self._known.pop(nid, None)
+                else:
+                    self._known[nid] = state
+
+    def is_stale(self, note_id):
+        """Return True if a note's file changed since the app last read or wrote it"""
+        state = file_state(self.note_app.notes_dir / f"{note_id}.md")
+        with self._lock:
+            return self._known.get(note_id) != state
+
+    def wake(self):
+        """Scan as soon as possible"""
+        self._wake.set()
+
+    def scan(self):
+        """Reload every note whose file changed; return how many notes changed"""
+        current = scan_files(self.note_app.notes_dir)
+        with self._lock:
+            known = dict(self._known)
+            changed_offline, self._changed_offline = self._changed_offline, set()
+        touched = [nid for nid, state in current.items() if known.get(nid) != state]
+        touched.extend(nid for nid in known if nid not in current)
+
+        reloaded = 0
+        for nid in sorted(touched):
+            try:
+                # The app may have read those files already, so their content
+                # is saved even when it matches what the app holds
+                if self.note_app.reload_external(nid, compare=nid not in changed_offline):
+                    reloaded += 1
+            except Exception as e:
+                # Still unreconciled, so the next scan tries it again
+                logger.error("external change reload failed id=%s error=%r", nid, e)
+        if reloaded:
+            logger.info("external changes reloaded count=%d", reloaded)
+        return reloaded
+
+    def _run(self):
+        """Scan on filesystem events or every poll interval until stopped"""
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.scan()
+            except Exception as e:
+                logger.error("notes directory scan failed error=%r", e)
+
+    def stop(self):
+        """Stop watching"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
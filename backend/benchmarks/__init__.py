@@ -0,0 +1 @@
+"""Benchmarks for the YZC Notes backend"""
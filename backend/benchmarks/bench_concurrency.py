@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Load test: request latency under concurrent readers and writers
+
+Serves a synthetic vault with uvicorn in-process and hammers it from
+reader, writer and health-check threads, then reports p50/p99 latency per
+operation. Run from the backend directory:
+
+    python benchmarks/bench_concurrency.py [--notes 2000] [--readers 8] [--writers 4] [--seconds 10]
+"""
+
+import argparse
+import http.client
+import json
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import uvicorn
+
+from app import models
+from app.models import NoteApp
+from app.server import create_app
+from benchmarks.vault import create_vault
+
+
+def free_port():
+    """Return a free TCP port on localhost"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples, pct):
+    """Return the pct-th percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def worker(port, op, note_count, deadline, results):
+    """Issue one kind of request in a loop until the deadline"""
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    samples = []
+    body = 'x' * 4000
+    while time.perf_counter() < deadline:
+        note_id = random.randint(1, note_count)
+        start = time.perf_counter()
+        if op == 'read':
+            conn.request('GET', f'/api/notes/{note_id}')
+        elif op == 'write':
+            payload = json.dumps({'title': f'Note {note_id}', 'content': f'{body} {start}'})
+            conn.request('PUT', f'/api/notes/{note_id}', body=payload,
+                         headers={'Content-Type': 'application/json'})
+        else:
+            conn.request('GET', '/api/health')
+        conn.getresponse().read()
+        samples.append((time.perf_counter() - start) * 1000)
+        if op == 'health':
+            time.sleep(0.05)
+    conn.close()
+    results.setdefault(op, []).extend(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=2000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # NoteApp saves settings to config.ini; keep them out of the real one
+        models.CONFIG_FILE = Path(tmp) / 'config.ini'
+        models.CONFIG_FILE.write_text(
+            f"[settings]\nnotes_directory = {Path(tmp) / 'vault'}\n\n[logging]\nlevel = WARNING\n",
+            encoding='utf-8'
+        )
+        vault = create_vault(Path(tmp) / 'vault', args.notes)
+        note_app = NoteApp(notes_directory=vault)
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config(
+            create_app(note_app), host='127.0.0.1', port=port, log_level='warning'
+        ))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        results = {}
+        deadline = time.perf_counter() + args.seconds
+        ops = ['read'] * args.readers + ['write'] * args.writers + ['health']
+        threads = [
+            threading.Thread(target=worker, args=(port, op, args.notes, deadline, results))
+            for op in ops
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        server.should_exit = True
+        thread.join()
+
+    print(f"{'op':>8} {'requests':>9} {'req/s':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}")
+    for op in ('read', 'write', 'health'):
+        samples = results.get(op, [])
+        print(f"{op:>8} {len(samples):>9} {len(samples) / args.seconds:>8.0f} "
+              f"{percentile(samples, 50):>9.2f} {percentile(samples, 99):>9.2f} "
+              f"{max(samples, default=0):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Benchmark: memory held per note and disk used by note bodies
+
+On a synthetic vault (100k notes by default), measures with tracemalloc
+what the in-memory note store holds once all content is loaded, both as
+NoteRecords and as the per-note dicts with ISO timestamp strings they
+replaced, and what the whole NoteApp holds after startup, with content
+in memory and in lazy content mode. It then turns
+on `[storage] compress_content`, waits for the bodies to be converted, and
+compares the size of the body files (their bytes and the blocks they
+take on disk) and the time to read every body back. Run from the backend
+directory:
+
+    python benchmarks/bench_memory.py [--notes 100000] [--content-size 2000]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import bodystore, models
+from app.models import NoteApp
+from benchmarks.vault import create_vault
+
+MB = 1024 * 1024
+
+
+def traced(func):
+    """Return (result, bytes still allocated by func once it returned)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def write_config(path, vault, compress=False, lazy=False):
+    path.write_text(
+        f"[settings]\nnotes_directory = {vault}\n\n[logging]\nlevel = WARNING\n\n"
+        f"[cache]\nlazy_content = {'true' if lazy else 'false'}\n\n"
+        f"[storage]\ncompress_content = {'true' if compress else 'false'}\n",
+        encoding='utf-8'
+    )
+
+
+def body_files(vault, suffix):
+    """Return (count, bytes, bytes of the disk blocks) of the body files"""
+    count = size = allocated = 0
+    with os.scandir(vault) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffix) and entry.name[:-len(suffix)].isdigit():
+                st = entry.stat()
+                count += 1
+                size += st.st_size
+                allocated += getattr(st, 'st_blocks', 0) * 512 or st.st_size
+    dictionaries = vault / bodystore.DICTIONARY_DIR
+    if dictionaries.is_dir():
+        size += sum(path.stat().st_size for path in dictionaries.iterdir())
+    return count, size, allocated
+
+
+def read_all(note_app):
+    """Return milliseconds to read every note body from its file"""
+    start = time.perf_counter()
+    for note in note_app.notes:
+        note_app.bodies.read(note.id)
+    return (time.perf_counter() - start) * 1000
+
+
+def open_app(vault):
+    note_app = NoteApp(notes_directory=vault)
+    note_app.contents_loaded.wait()
+    return note_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=100000)
+    parser.add_argument('--content-size', type=int, default=2000)
+    parser.add_argument('--size-sigma', type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vault = create_vault(Path(tmp) / 'vault', args.notes, args.content_size, size_sigma=args.size_sigma)
+        models.CONFIG_FILE = Path(tmp) / 'config.ini'
+        write_config(models.CONFIG_FILE, vault)
+        # First open builds the indexes and writes the snapshot on close
+        NoteApp(notes_directory=vault).close()
+
+        note_app, app_bytes = traced(lambda: open_app(vault))
+        notes = note_app.notes
+        content_bytes = sum(sys.getsizeof(note.content) for note in notes)
+        # Content strings are shared with the records, so only metadata is counted
+        _, dict_bytes = traced(lambda: [note.to_dict(note.content) for note in notes])
+        _, record_bytes = traced(lambda: [
+            models.NoteRecord(note.id, note.title, note.parent_id, note.position, note.created,
+                              note.modified, note.version, note.content)
+            for note in notes
+        ])
+        plain_read_ms = read_all(note_app)
+        note_app.close()
+        plain = body_files(vault, bodystore.PLAIN)
+
+        write_config(models.CONFIG_FILE, vault, lazy=True)
+        note_app, lazy_bytes = traced(lambda: open_app(vault))
+        note_app.close()
+
+        write_config(models.CONFIG_FILE, vault, compress=True)
+        start = time.perf_counter()
+        note_app = open_app(vault)
+        note_app._converter.join()
+        convert_s = time.perf_counter() - start
+        compressed_read_ms = read_all(note_app)
+        note_app.close()
+        compressed = body_files(vault, bodystore.COMPRESSED)
+
+    count = len(notes)
+    codec = 'zstd' if bodystore.zstandard is not None else 'zlib'
+    print(f"{count} notes, {content_bytes / MB:.1f} MB of content in memory")
+    print(f"{'metadata store':<32} {'MB':>8} {'bytes/note':>11}")
+    print(f"{'dicts, ISO timestamps':<32} {dict_bytes / MB:>8.1f} {dict_bytes / count:>11.0f}")
+    print(f"{'NoteRecords':<32} {record_bytes / MB:>8.1f} {record_bytes / count:>11.0f}")
+    # The whole app held dicts before; estimated as the difference of the two stores
+    for name, size in (('NoteApp', app_bytes), ('NoteApp, lazy content', lazy_bytes)):
+        before = size - record_bytes + dict_bytes
+        print(f"{name:<32} {size / MB:>8.1f} {size / count:>11.0f}")
+        print(f"{f'{name} with dicts':<32} {before / MB:>8.1f} {before / count:>11.0f}  (estimated)")
+    print()
+    print(f"{'note bodies':<32} {'files':>8} {'MB':>8} {'MB on disk':>11} {'read all (ms)':>14}")
+    print(f"{'.md':<32} {plain[0]:>8} {plain[1] / MB:>8.1f} {plain[2] / MB:>11.1f} {plain_read_ms:>14.0f}")
+    print(f"{f'.mdz ({codec} + dictionary)':<32} {compressed[0]:>8} {compressed[1] / MB:>8.1f} "
+          f"{compressed[2] / MB:>11.1f} {compressed_read_ms:>14.0f}")
+    print(f"\nconversion to .mdz took {convert_s:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Benchmark: autosave latency as the vault grows
+
+Compares the incremental single-note write path (`update_note`) against
+rewriting the whole vault on every save, as the app did before single-note
+saves. Run from the backend directory:
+
+    python benchmarks/bench_save.py
+"""
+
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import hierarchy, models
+from app.models import NoteApp
+from benchmarks.vault import create_vault
+
+SIZES = [100, 1000, 5000, 20000]
+ROUNDS = 20
+
+
+def time_call(func, rounds):
+    """Return the median duration of `func()` in milliseconds"""
+    samples = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def rewrite_vault(app):
+    """The old full save: write every note file, then replace every row
+
+    Only a baseline: it leaves the search, link and revision indexes
+    and the change feed behind, so it has no place in NoteApp.
+    """
+    for note in app.notes:
+        if note.content is not None:
+            app.bodies.write(note.id, note.content)
+    with app.db.transaction() as conn:
+        conn.execute('DELETE FROM notes')
+        conn.executemany('''
+            INSERT INTO notes (id, title, parent_id, position, created, modified, version)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (note.id, note.title, note.parent_id, note.position, note.created, note.modified, note.version)
+            for note in app.notes
+        ])
+        hierarchy.build(conn, renumber=False)
+
+
+def main():
+    print(f"{'notes':>8} {'update_note (ms)':>18} {'full rewrite (ms)':>18}")
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as tmp:
+            # NoteApp saves settings to config.ini; keep them out of the real one
+            models.CONFIG_FILE = Path(tmp) / 'config.ini'
+            models.CONFIG_FILE.write_text(
+                f"[settings]\nnotes_directory = {Path(tmp) / 'vault'}\n\n[logging]\nlevel = WARNING\n",
+                encoding='utf-8'
+            )
+            vault = create_vault(Path(tmp) / 'vault', size)
+            app = NoteApp(notes_directory=vault)
+            app.contents_loaded.wait()
+            note_id = size // 2
+
+            incremental = time_call(
+                lambda i: app.update_note(note_id, f"Note {note_id}", f"edit {i}"),
+                ROUNDS
+            )
+            full = time_call(lambda i: rewrite_vault(app), 3)
+            app.close()
+            print(f"{size:>8} {incremental:>18.2f} {full:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Benchmark: NoteApp startup time as the vault grows
+
+For each vault size, times the NoteApp constructor with a valid startup
+snapshot and without one (metadata read from SQLite), and how long the
+background loader takes to read all note content afterwards. Run from the
+backend directory:
+
+    python benchmarks/bench_startup.py [--sizes 1000 10000 100000]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import models
+from app.models import NoteApp
+from app.snapshot import SNAPSHOT_FILE
+from benchmarks.vault import create_vault
+
+ROUNDS = 3
+
+
+def time_startup(vault, use_snapshot):
+    """Return the best (constructor ms, content loaded ms) over ROUNDS starts"""
+    best_init = best_loaded = float('inf')
+    for _ in range(ROUNDS):
+        if not use_snapshot:
+            (vault / SNAPSHOT_FILE).unlink(missing_ok=True)
+        start = time.perf_counter()
+        note_app = NoteApp(notes_directory=vault)
+        init = time.perf_counter() - start
+        note_app.contents_loaded.wait()
+        loaded = time.perf_counter() - start
+        note_app.close()
+        best_init = min(best_init, init * 1000)
+        best_loaded = min(best_loaded, loaded * 1000)
+    return best_init, best_loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            # NoteApp saves settings to config.ini; keep them out of the real one
+            models.CONFIG_FILE = Path(tmp) / 'config.ini'
+            models.CONFIG_FILE.write_text(
+                f"[settings]\nnotes_directory = {Path(tmp) / 'vault'}\n\n[logging]\nlevel = WARNING\n",
+                encoding='utf-8'
+            )
+            vault = create_vault(Path(tmp) / 'vault', size)
+            # First open builds the search index and writes the snapshot on close
+            NoteApp(notes_directory=vault).close()
+            snapshot = time_startup(vault, use_snapshot=True)
+            database = time_startup(vault, use_snapshot=False)
+            results.append((size, snapshot, database))
+
+    print(f"{'notes':>8} {'snapshot (ms)':>14} {'database (ms)':>14} {'content loaded (ms)':>20}")
+    for size, snapshot, database in results:
+        print(f"{size:>8} {snapshot[0]:>14.1f} {database[0]:>14.1f} {snapshot[1]:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
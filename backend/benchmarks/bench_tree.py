@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Benchmark: tree construction, lookup and subtree delete at 10k and 100k notes
+
+Run from the backend directory:
+
+    python benchmarks/bench_tree.py
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import models
+from app.models import NoteApp
+from benchmarks.vault import create_vault
+
+SIZES = [10000, 100000]
+LOOKUPS = 10000
+
+
+def timed(func):
+    """Return (result, elapsed milliseconds) of func()"""
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    print(f"{'notes':>8} {'tree (ms)':>10} {'get_note (us)':>14} "
+          f"{'has_note (us)':>14} {'delete subtree (ms)':>20}")
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as tmp:
+            # NoteApp saves settings to config.ini; keep them out of the real one
+            models.CONFIG_FILE = Path(tmp) / 'config.ini'
+            models.CONFIG_FILE.write_text(
+                f"[settings]\nnotes_directory = {Path(tmp) / 'vault'}\n\n[logging]\nlevel = WARNING\n",
+                encoding='utf-8'
+            )
+            vault = create_vault(Path(tmp) / 'vault', size, content_size=64)
+            app = NoteApp(notes_directory=vault)
+
+            _, tree_ms = timed(app.get_notes_tree)
+
+            ids = [(i * 7919) % size + 1 for i in range(LOOKUPS)]
+            _, get_ms = timed(lambda: [app.get_note(i) for i in ids])
+            _, has_ms = timed(lambda: [app.has_note(i) for i in ids])
+
+            # Note 2 roots a subtree of roughly a tenth of the vault
+            _, delete_ms = timed(lambda: app.delete_note(2))
+
+            print(f"{size:>8} {tree_ms:>10.1f} {get_ms * 1000 / LOOKUPS:>14.2f} "
+                  f"{has_ms * 1000 / LOOKUPS:>14.2f} {delete_ms:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""Benchmark suite: NoteApp and the HTTP API on a synthetic vault
+
+Generates a reproducible vault (note count, tree fan-out and depth, content
+size distribution), then times startup, listing, tree, get, HTML rendering, autosave-style
+update (full PUT and patch), subtree delete and notes directory migration, both on NoteApp
+directly and through the FastAPI app with an in-process client. Results are
+written as JSON so runs on two commits can be compared. Run from the
+backend directory:
+
+    python benchmarks/suite.py [--notes 10000] [--output results.json]
+    python benchmarks/suite.py --compare baseline.json
+
+With --compare the run exits with status 1 if any p50 got slower than the
+baseline by more than --threshold.
+"""
+
+import argparse
+import hashlib
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fastapi.testclient import TestClient
+
+from app import models
+from app.models import NoteApp
+from app.render import render
+from app.server import create_app
+from app.snapshot import SNAPSHOT_FILE
+from benchmarks.bench_concurrency import percentile
+from benchmarks.vault import create_vault
+
+LISTING_FIELDS = 'id,title,parent_id,modified'
+
+
+def summarize(samples):
+    """Return summary statistics of millisecond samples"""
+    return {
+        'unit': 'ms',
+        'samples': len(samples),
+        'min': min(samples),
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'mean': statistics.fmean(samples),
+        'max': max(samples),
+    }
+
+
+def measure(func, rounds, setup=None):
+    """Call func(i) rounds times and return the durations in ms
+
+    setup(i), if given, runs untimed before each call and its result is
+    passed to func instead of i.
+    """
+    samples = []
+    for i in range(rounds):
+        arg = setup(i) if setup else i
+        start = time.perf_counter()
+        func(arg)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def git_revision():
+    """Return (commit, dirty) of the working tree, or (None, None) outside git"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def add_subtree(add, parent_id, fanout):
+    """Create a note with fanout children of two children each; return its id"""
+    root = add('subtree', parent_id)
+    for _ in range(fanout):
+        child = add('child', root)
+        for _ in range(2):
+            add('leaf', child)
+    return root
+
+
+def bench_noteapp(vault, args, rng):
+    """Time NoteApp called directly"""
+    results = {}
+
+    def start(use_snapshot):
+        if not use_snapshot:
+            (vault / SNAPSHOT_FILE).unlink(missing_ok=True)
+        note_app = NoteApp(notes_directory=vault)
+        note_app.contents_loaded.wait()
+        note_app.close()
+
+    # First open builds the search index and writes the snapshot on close
+    NoteApp(notes_directory=vault).close()
+    results['startup'] = measure(lambda i: start(True), args.heavy_rounds)
+    results['startup_no_snapshot'] = measure(lambda i: start(False), args.heavy_rounds)
+
+    note_app = NoteApp(notes_directory=vault)
+    note_app.contents_loaded.wait()
+    ids = [note.id for note in note_app.notes]
+    fields = tuple(LISTING_FIELDS.split(','))
+    try:
+        results['list_page'] = measure(lambda i: note_app.list_notes(limit=100, fields=fields), args.rounds)
+        results['list_all'] = measure(lambda i: note_app.get_notes(), args.heavy_rounds)
+        results['tree'] = measure(lambda i: note_app.get_notes_tree(), args.rounds)
+        results['get'] = measure(lambda i: note_app.get_note(rng.choice(ids)), args.rounds)
+        results['backlinks'] = measure(lambda i: note_app.get_backlinks(rng.choice(ids)), args.rounds)
+        results['link_graph'] = measure(lambda i: note_app.get_link_graph(rng.choice(ids), 2), args.rounds)
+        # Markdown to HTML from scratch, then through the render store
+        results['render'] = measure(lambda i: render(note_app.get_note_content(rng.choice(ids))), args.rounds)
+        results['render_note'] = measure(lambda i: note_app.render_note(rng.choice(ids)), args.rounds)
+
+        # Autosave: the same note saved over and over with a growing edit
+        note_id = rng.choice(ids)
+        content = note_app.get_note(note_id)['content']
+        results['update'] = measure(
+            lambda i: note_app.update_note(note_id, f"Note {note_id}", f"{content}\nedit {i}"),
+            args.rounds
+        )
+
+        add = lambda title, parent_id: note_app.add_note(title, 'x', parent_id)['id']
+        roots = [note.id for note in note_app.notes if note.parent_id is None]
+        results['move_subtree'] = measure(
+            lambda root: note_app.move_note(root, rng.choice(roots), 0), args.rounds,
+            setup=lambda i: add_subtree(add, rng.choice(ids), args.fanout)
+        )
+        results['delete_subtree'] = measure(
+            note_app.delete_note, args.rounds,
+            setup=lambda i: add_subtree(add, rng.choice(ids), args.fanout)
+        )
+    finally:
+        note_app.close()
+    return results
+
+
+def bench_api(vault, args, rng):
+    """Time the same operations through the FastAPI app"""
+    results = {}
+    note_app = NoteApp(notes_directory=vault)
+    note_app.contents_loaded.wait()
+    ids = [note.id for note in note_app.notes]
+
+    with TestClient(create_app(note_app)) as client:
+        def call(method, url, **kwargs):
+            response = client.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response.json()
+
+        results['list_page'] = measure(
+            lambda i: call('GET', f'/api/notes/?limit=100&fields={LISTING_FIELDS}'), args.rounds
+        )
+        results['list_all'] = measure(lambda i: call('GET', '/api/notes/'), args.heavy_rounds)
+        results['tree'] = measure(lambda i: call('GET', '/api/notes/tree'), args.rounds)
+        results['get'] = measure(lambda i: call('GET', f'/api/notes/{rng.choice(ids)}'), args.rounds)
+        results['backlinks'] = measure(lambda i: call('GET', f'/api/notes/{rng.choice(ids)}/backlinks'),
+                                       args.rounds)
+        results['note_html'] = measure(lambda i: call('GET', f'/api/notes/{rng.choice(ids)}/html'), args.rounds)
+        results['subtree'] = measure(lambda i: call('GET', f'/api/notes/{rng.choice(ids)}/subtree?depth=2'),
+                                     args.rounds)
+        
+        # The first listing after an edit, which cannot come from the response cache
+        def touch(i):
+            note_id = rng.choice(ids)
+            call('PUT', f'/api/notes/{note_id}', json={'title': f"Note {note_id}", 'content': f"touched {i}"})
+        results['list_all_after_edit'] = measure(lambda i: call('GET', '/api/notes/'), args.heavy_rounds,
+                                                 setup=touch)
+        results['tree_after_edit'] = measure(lambda i: call('GET', '/api/notes/tree'), args.rounds,
+                                             setup=touch)
+
+        note_id = rng.choice(ids)
+        content = call('GET', f'/api/notes/{note_id}')['content']
+        results['update'] = measure(
+            lambda i: call('PUT', f'/api/notes/{note_id}',
+                           json={'title': f"Note {note_id}", 'content': f"{content}\nedit {i}"}),
+            args.rounds
+        )
+
+        # The same autosave sent as a one-edit patch against the previous save
+        def patch(i):
+            nonlocal content
+            base_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+            edit = {'start': len(content), 'end': len(content), 'text': f"\nedit {i}"}
+            call('PATCH', f'/api/notes/{note_id}', json={'base_hash': base_hash, 'edits': [edit]})
+            content += edit['text']
+
+        content = call('GET', f'/api/notes/{note_id}')['content']
+        results['patch'] = measure(patch, args.rounds)
+
+        add = lambda title, parent_id: call(
+            'POST', '/api/notes/', json={'title': title, 'content': 'x', 'parent_id': parent_id}
+        )['id']
+        results['delete_subtree'] = measure(
+            lambda root: call('DELETE', f'/api/notes/{root}'), args.rounds,
+            setup=lambda i: add_subtree(add, rng.choice(ids), args.fanout)
+        )
+    return results
+
+
+def bench_migration(vault, args):
+    """Time moving the notes directory to a new location"""
+    note_app = NoteApp(notes_directory=vault)
+    samples = []
+    try:
+        for i in range(args.heavy_rounds):
+            target = vault.parent / f'moved{i}'
+            start = time.perf_counter()
+            note_app.update_settings({'notes_directory': str(target)})
+            while note_app.migration.running:
+                time.sleep(0.005)
+            samples.append((time.perf_counter() - start) * 1000)
+            if note_app.get_migration()['state'] != 'done':
+                raise RuntimeError(f"migration failed: {note_app.get_migration()}")
+    finally:
+        note_app.close()
+    return {'migrate': samples}
+
+
+def compare(results, baseline, threshold):
+    """Print p50 changes against a baseline run; return the regressed benchmarks"""
+    regressed = []
+    print(f"\n{'benchmark':<28} {'baseline p50':>13} {'p50':>10} {'change':>8}")
+    for name, stats in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        change = stats['p50'] / old['p50'] - 1 if old['p50'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressed.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<28} {old['p50']:>13.2f} {stats['p50']:>10.2f} {change:>+8.0%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=10000)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=None, help='maximum tree depth (default unbounded)')
+    parser.add_argument('--content-size', type=int, default=2000, help='median note size in bytes')
+    parser.add_argument('--size-sigma', type=float, default=1.0,
+                        help='log-normal spread of note sizes (0 = all the same size)')
+    parser.add_argument('--links', type=int, default=3, help='wiki links at the end of every note')
+    parser.add_argument('--rounds', type=int, default=50, help='samples per fast operation')
+    parser.add_argument('--heavy-rounds', type=int, default=3,
+                        help='samples per startup, full listing and migration')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-migration', action='store_true')
+    parser.add_argument('--output', type=Path, help='JSON results file (default bench-<commit>.json)')
+    parser.add_argument('--compare', type=Path, help='baseline JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative p50 slowdown reported as a regression')
+    args = parser.parse_args()
+
+    commit, dirty = git_revision()
+    rng = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Settings changes are saved to config.ini; keep them out of the real one
+        models.CONFIG_FILE = Path(tmp) / 'config.ini'
+        models.CONFIG_FILE.write_text(
+            f"[settings]\nnotes_directory = {Path(tmp) / 'vault'}\n\n[logging]\nlevel = WARNING\n",
+            encoding='utf-8'
+        )
+        vault = create_vault(Path(tmp) / 'vault', args.notes, args.content_size, args.fanout,
+                             args.depth, args.size_sigma, args.seed, args.links)
+        groups = [('noteapp', bench_noteapp(vault, args, rng)), ('api', bench_api(vault, args, rng))]
+        if not args.skip_migration:
+            groups.append(('noteapp', bench_migration(vault, args)))
+        for group, samples in groups:
+            for name, values in samples.items():
+                results[f'{group}.{name}'] = summarize(values)
+
+    print(f"{'benchmark':<28} {'p50 (ms)':>10} {'p95 (ms)':>10} {'max (ms)':>10}")
+    for name, stats in results.items():
+        print(f"{name:<28} {stats['p50']:>10.2f} {stats['p95']:>10.2f} {stats['max']:>10.2f}")
+
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'compare', 'threshold')},
+        'results': results,
+    }
+    output = args.output or Path(f"bench-{commit or 'local'}.json")
+    output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding='utf-8'))
+        if baseline.get('params') != report['params']:
+            print("warning: baseline was run with different parameters")
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
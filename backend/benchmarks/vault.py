@@ -0,0 +1,93 @@
+"""Synthetic vault helpers for the benchmarks"""
+
+import random
+import sqlite3
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+from app.models import NOTES_SCHEMA
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit',
+         'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'magna')
+
+
+def tree_parents(note_count, fanout=10, depth=None):
+    """Return the parent id (or None) of notes 1..note_count, filled breadth-first
+
+    The first `fanout` notes are roots. Every note gets up to `fanout`
+    children, levels fill in order, and notes never sit deeper than `depth`
+    levels (a full tree starts a new root). depth=None means unbounded.
+    """
+    parents = []
+    open_parents = deque()  # (id, level) of notes that can take more children
+    child_counts = {}
+    for note_id in range(1, note_count + 1):
+        if note_id <= fanout or not open_parents:
+            parent_id, level = None, 1
+        else:
+            parent_id, parent_level = open_parents[0]
+            level = parent_level + 1
+            child_counts[parent_id] = child_counts.get(parent_id, 0) + 1
+            if child_counts[parent_id] >= fanout:
+                open_parents.popleft()
+        parents.append(parent_id)
+        if depth is None or level < depth:
+            open_parents.append((note_id, level))
+    return parents
+
+
+def content_sizes(note_count, content_size=2000, size_sigma=0.0, seed=0):
+    """Return note body sizes in bytes
+
+    With size_sigma = 0 every note is content_size bytes; otherwise sizes
+    follow a log-normal distribution with median content_size, which gives
+    the long tail of a real vault (many short notes, a few very long ones).
+    """
+    if not size_sigma:
+        return [content_size] * note_count
+    rng = random.Random(seed)
+    return [max(1, int(content_size * rng.lognormvariate(0, size_sigma))) for _ in range(note_count)]
+
+
+def create_vault(directory, note_count, content_size=2000, fanout=10, depth=None,
+                 size_sigma=0.0, seed=0, links=0):
+    """Create a vault of `note_count` notes in `directory` and return its path
+
+    Notes form a tree (see tree_parents) with bodies sized by content_sizes,
+    each followed by `links` wiki links to random notes.
+    The same arguments always produce the same vault. Rows are bulk inserted
+    directly so that building large vaults stays fast.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    rng = random.Random(seed)
+    sizes = content_sizes(note_count, content_size, size_sigma, seed)
+    # One long random text, twice the longest note; each body is a slice of it
+    text_size = 2 * max(sizes, default=0) + 65536
+    text = ' '.join(rng.choice(WORDS) for _ in range(text_size // 6))
+    parents = tree_parents(note_count, fanout, depth)
+
+    now = datetime.now().isoformat()
+    rows = []
+    for note_id, (parent_id, size) in enumerate(zip(parents, sizes), start=1):
+        rows.append((note_id, f"Note {note_id}", parent_id, now, now))
+        offset = rng.randrange(len(text) - size)
+        body = text[offset:offset + size]
+        if links:
+            body += '\n\n' + ' '.join(f"[[Note {rng.randint(1, note_count)}]]" for _ in range(links))
+        with open(directory / f"{note_id}.md", 'w', encoding='utf-8') as f:
+            f.write(f"# Note {note_id}\n\n{body}")
+
+    # Only the notes table is created here; NoteApp builds its other indexes
+    # (such as full-text search) the first time it opens the vault
+    conn = sqlite3.connect(str(directory / 'note_index.db'))
+    conn.execute(NOTES_SCHEMA)
+    conn.executemany('''
+        INSERT INTO notes (id, title, parent_id, created, modified)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+    return directory
@@ -0,0 +1,77 @@
+"""Command line bulk import and export for YZC Notes
+
+Works on the notes directory from config.ini (or --notes-dir) directly, so
+run it while the app is closed. Run from the backend directory:
+
+    python cli.py import ~/vault              # a folder of .md files
+    python cli.py import export.zip --parent 12
+    python cli.py export backup.tar.gz        # .zip, .tar, .tar.gz or a folder
+    python cli.py export ~/copy --note 12     # one note and its children
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from app import bulk
+from app.models import NoteApp
+
+
+def import_path(note_app, path, parent_id):
+    """Import a folder or archive; return (count, root_ids)"""
+    max_bytes = note_app.options.getint('storage', 'import_max_note_bytes')
+    if path.is_dir():
+        return note_app.import_notes(bulk.read_notes(bulk.DirectorySource(path, max_bytes)), parent_id)
+    with open(path, 'rb') as f:
+        source = bulk.open_archive(f, max_bytes)
+        try:
+            return note_app.import_notes(bulk.read_notes(source), parent_id)
+        finally:
+            source.close()
+
+
+def export_path(note_app, path, note_id):
+    """Export to a folder or an archive named after its format; return the path written"""
+    entries = note_app.export_notes(note_id)
+    format = bulk.archive_format(path)
+    if format is None:
+        bulk.write_tree(entries, path)
+        return path
+    with open(path, 'wb') as f:
+        for chunk in bulk.stream_archive(entries, format):
+            f.write(chunk)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes-dir', type=Path, help='notes directory (default: from config.ini)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import', help='import a folder of .md files or a zip/tar archive')
+    importer.add_argument('path', type=Path)
+    importer.add_argument('--parent', type=int, help='import under this note')
+    exporter = commands.add_parser('export', help='export to a folder or a .zip/.tar/.tar.gz archive')
+    exporter.add_argument('path', type=Path)
+    exporter.add_argument('--note', type=int, help='export only this note and its children')
+    args = parser.parse_args()
+
+    note_app = NoteApp(notes_directory=args.notes_dir, global_settings=args.notes_dir is None)
+    try:
+        if args.command == 'import':
+            if args.parent is not None and not note_app.has_note(args.parent):
+                sys.exit(f"note {args.parent} does not exist")
+            try:
+                count, root_ids = import_path(note_app, args.path, args.parent)
+            except (OSError, ValueError) as e:
+                sys.exit(f"import failed: {e}")
+            print(f"imported {count} notes into {note_app.notes_dir}")
+        else:
+            if args.note is not None and not note_app.has_note(args.note):
+                sys.exit(f"note {args.note} does not exist")
+            print(f"exported to {export_path(note_app, args.path, args.note)}")
+    finally:
+        note_app.close()
+
+
+if __name__ == "__main__":
+    main()
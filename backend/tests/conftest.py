@@ -0,0 +1,50 @@
+"""Shared fixtures: each test gets its own config.ini and notes directory"""
+
+import configparser
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import models
+
+
+def write_config(path, notes_dir, options=None):
+    """Write a config.ini for notes_dir with extra {section: {key: value}} options"""
+    config = configparser.ConfigParser()
+    config.read_dict({'settings': {'notes_directory': str(notes_dir)}, 'logging': {'level': 'WARNING'}})
+    config.read_dict(options or {})
+    with open(path, 'w', encoding='utf-8') as f:
+        config.write(f)
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    """Point NoteApp at a config.ini in the test's directory"""
+    path = tmp_path / 'config.ini'
+    monkeypatch.setattr(models, 'CONFIG_FILE', path)
+    return path
+
+
+@pytest.fixture
+def make_app(tmp_path, config_file):
+    """Return a function opening a NoteApp on the test's vault, closed after the test"""
+    opened = []
+
+    def make(options=None, notes_dir=None):
+        write_config(config_file, notes_dir or tmp_path / 'vault', options)
+        note_app = models.NoteApp()
+        opened.append(note_app)
+        note_app.contents_loaded.wait()
+        return note_app
+
+    yield make
+    for note_app in opened:
+        note_app.close()
+
+
+@pytest.fixture
+def note_app(make_app):
+    return make_app()
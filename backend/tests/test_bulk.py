@@ -0,0 +1,62 @@
+"""Imports refuse note files over the size limit, by declared and by actual size"""
+
+import io
+import tarfile
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import bulk
+from app.server import create_app
+
+
+def zip_archive(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def tar_archive(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+def test_small_notes_import(note_app):
+    source = bulk.open_archive(zip_archive({'A.md': b'a', 'A/B.md': b'b'}), max_bytes=100)
+    assert note_app.import_notes(bulk.read_notes(source))[0] == 2
+
+
+@pytest.mark.parametrize('archive', [
+    lambda: bulk.open_archive(zip_archive({'A.md': b'a', 'Bomb.md': b'0' * 10_000}), max_bytes=100),
+    lambda: bulk.open_archive(tar_archive({'A.md': b'a', 'Bomb.md': b'0' * 10_000}), max_bytes=100),
+])
+def test_oversized_note_fails_before_anything_is_imported(note_app, archive):
+    with pytest.raises(ValueError, match='Bomb.md'):
+        note_app.import_notes(bulk.read_notes(archive()))
+    assert note_app.get_notes_tree() == []
+
+
+def test_reads_stop_at_the_limit_when_the_declared_size_is_wrong(monkeypatch):
+    source = bulk.open_archive(zip_archive({'Bomb.md': b'0' * 10_000}), max_bytes=100)
+    monkeypatch.setattr(source, 'size', lambda path: 10)
+    with pytest.raises(ValueError, match='Bomb.md'):
+        list(bulk.read_notes(source))
+
+
+def test_import_route_answers_400(note_app):
+    note_app.options.set('storage', 'import_max_note_bytes', '100')
+    client = TestClient(create_app(note_app))
+    archive = zip_archive({'Bomb.md': b'0' * 10_000})
+    response = client.post('/api/notes/import', files={'file': ('vault.zip', archive, 'application/zip')})
+    assert response.status_code == 400
+    assert note_app.get_notes_tree() == []
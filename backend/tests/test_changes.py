@@ -0,0 +1,124 @@
+"""change_seq only advances once the in-memory notes hold the change
+
+Cached responses are keyed by the seq read before they are built from
+memory, so a seq visible ahead of the note would cache a stale body
+under it.
+"""
+
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import hierarchy, models
+from app.server import create_app
+
+
+@pytest.fixture
+def seq_at_publish(monkeypatch):
+    """Record change_seq each time a saved note is published"""
+    seen = []
+    publish = models.NoteApp._publish_note
+
+    def record(self, note):
+        seen.append(self.change_seq)
+        publish(self, note)
+
+    monkeypatch.setattr(models.NoteApp, '_publish_note', record)
+    return seen
+
+
+def test_add_publishes_before_the_seq_advances(note_app, seq_at_publish):
+    before = note_app.change_seq
+    note_app.add_note('Title', 'content')
+    assert seq_at_publish == [before]
+    assert note_app.change_seq > before
+
+
+def test_import_publishes_before_the_seq_advances(note_app, seq_at_publish):
+    before = note_app.change_seq
+    note_app.import_notes([('a', None, 'A', 'a', None), ('b', 'a', 'B', 'b', None)])
+    assert seq_at_publish == [before, before]
+    assert note_app.change_seq > before
+
+
+def test_external_file_publishes_before_the_seq_advances(make_app, seq_at_publish):
+    note_app = make_app({'watcher': {'enabled': 'true', 'poll_seconds': '60'}})
+    before = note_app.change_seq
+    (note_app.notes_dir / '7.md').write_text('# Outside\nnew file', encoding='utf-8')
+
+    note_app.watcher.scan()
+    assert seq_at_publish == [before]
+    assert note_app.change_seq > before and note_app.has_note(7)
+
+
+def test_tree_built_during_an_add_is_not_served_as_current(note_app, monkeypatch):
+    client = TestClient(create_app(note_app))
+    publish = models.NoteApp._publish_note
+
+    def publish_after_a_request(self, note):
+        # Another request builds the tree while the new note is on its way to memory
+        request = threading.Thread(target=client.get, args=('/api/notes/tree',))
+        request.start()
+        request.join()
+        publish(self, note)
+
+    monkeypatch.setattr(models.NoteApp, '_publish_note', publish_after_a_request)
+    note = note_app.add_note('Title', 'content')
+
+    response = client.get('/api/notes/tree')
+    assert response.headers['X-Change-Seq'] == str(note_app.change_seq)
+    assert [node['id'] for node in response.json()] == [note['id']]
+
+
+def test_tree_built_during_an_undone_move_is_not_cached(note_app, monkeypatch):
+    client = TestClient(create_app(note_app))
+    a = note_app.add_note('A', 'a')['id']
+    b = note_app.add_note('B', 'b')['id']
+
+    def request_then_fail(*args):
+        # The move is in memory but not yet in the database when the tree is built
+        request = threading.Thread(target=client.get, args=('/api/notes/tree',))
+        request.start()
+        request.join()
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(hierarchy, 'move', request_then_fail)
+    with pytest.raises(RuntimeError):
+        note_app.move_note(b, a)
+
+    response = client.get('/api/notes/tree')
+    assert [node['id'] for node in response.json()] == [a, b]
+
+
+def test_seq_follows_concurrent_writers_in_order(note_app):
+    snapshots = []
+    done = threading.Event()
+
+    def watch():
+        while not done.is_set():
+            seq = note_app.change_seq
+            with note_app._tree_lock:
+                ids = set(note_app._notes_by_id)
+            snapshots.append((seq, ids))
+
+    def add(worker):
+        for i in range(20):
+            note_app.add_note(f'Note {worker}.{i}', 'content')
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    writers = [threading.Thread(target=add, args=(worker,)) for worker in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    done.set()
+    watcher.join()
+
+    seqs = [seq for seq, _ in snapshots]
+    assert seqs == sorted(seqs)
+    recorded = note_app.get_changes(limit=1000)['changes']
+    assert len(recorded) == 80 and note_app.change_seq == recorded[-1]['seq']
+    for seq, ids in snapshots:
+        assert {change['id'] for change in recorded if change['seq'] <= seq} <= ids
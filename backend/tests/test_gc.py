@@ -0,0 +1,79 @@
+"""Background sweeps of revision objects and attachments"""
+
+import io
+
+from app import models
+from app.revisions import RevisionStore
+
+HISTORY = {'history': {'coalesce_seconds': '0'}, 'attachments': {'gc_grace_seconds': '0'}}
+
+
+def open_app(make_app):
+    """Open a vault whose sweeps only run when a test calls them"""
+    note_app = make_app(HISTORY)
+    note_app._last_revision_gc = note_app._last_attachment_gc = models.time.monotonic()
+    return note_app
+
+
+def test_first_sweep_runs_right_after_boot(note_app, monkeypatch):
+    # A freshly booted host: monotonic time is below the gc interval
+    monkeypatch.setattr(models.time, 'monotonic', lambda: 5.0)
+    swept = []
+    monkeypatch.setattr(note_app, 'gc_revisions', lambda: swept.append('revisions'))
+    monkeypatch.setattr(note_app, 'gc_attachments', lambda: swept.append('attachments'))
+    note_app._schedule_revision_gc()
+    note_app._schedule_attachment_gc()
+    note_app._schedule_revision_gc()
+    note_app.executor.shutdown(wait=True)
+    assert sorted(swept) == ['attachments', 'revisions']
+
+
+def test_revision_gc_walks_objects_without_the_write_lock(make_app, monkeypatch):
+    note_app = open_app(make_app)
+    note = note_app.add_note('Title', 'first')
+    note_app.update_note(note['id'], 'Title', 'second')
+    note_app.delete_note(note['id'])
+
+    walk = RevisionStore.garbage
+    def garbage(store, conn):
+        # A save could take the write lock right now
+        assert note_app.db._write_lock.acquire(blocking=False)
+        note_app.db._write_lock.release()
+        return walk(store, conn)
+    monkeypatch.setattr(RevisionStore, 'garbage', garbage)
+
+    assert note_app.gc_revisions() == 2
+    assert not any(path.is_file() for path in note_app.revisions.objects_dir.rglob('*'))
+
+
+def test_revision_gc_keeps_objects_reused_meanwhile(make_app):
+    note_app = open_app(make_app)
+    note = note_app.add_note('Title', 'old')
+    other = note_app.add_note('Other', 'x')
+    note_app.delete_note(note['id'])
+    store = note_app.revisions
+    with note_app.db.connection() as conn:
+        live, unreachable = store.garbage(conn)
+    assert len(unreachable) == 1
+    # Recorded again between the walk and the delete
+    note_app.update_note(other['id'], 'Other', 'old')
+    with note_app.db.transaction() as conn:
+        assert store.delete(conn, live, unreachable) == 0
+    assert note_app.get_revision(other['id'], note_app.list_revisions(other['id'])[0]['id'])['content'] == 'old'
+
+
+def test_attachment_gc_reads_revision_links_from_the_index(make_app, monkeypatch):
+    note_app = open_app(make_app)
+    digest = note_app.add_attachment(io.BytesIO(b'hello'), 'text/plain')['hash']
+    note = note_app.add_note('Title', f'![x](/api/attachments/{digest})')
+    note_app.update_note(note['id'], 'Title', 'link removed')
+
+    def load(*args):
+        raise AssertionError("revision objects read")
+    monkeypatch.setattr(RevisionStore, 'load', load)
+
+    # An old revision still links to it
+    assert note_app.gc_attachments() == 0
+    note_app.delete_note(note['id'])
+    assert note_app.gc_attachments() == 1
+    assert not note_app.attachments.path(digest).exists()
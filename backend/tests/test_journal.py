@@ -0,0 +1,54 @@
+"""The content journal compacts on its one background thread"""
+
+import threading
+import time
+
+import pytest
+
+from app.bodystore import BodyStore
+from app.journal import NoteJournal, WRITE, read_records
+
+
+def test_large_journal_wakes_the_compactor(tmp_path):
+    journal = NoteJournal(tmp_path, BodyStore(tmp_path), compact_interval=60, compact_bytes=1024)
+    try:
+        threads = threading.active_count()
+        for i in range(50):
+            journal.append([(WRITE, i % 5, 'x' * 200 + str(i))])
+        assert threading.active_count() == threads
+        deadline = time.monotonic() + 5
+        while journal.pending(4)[0] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not journal.pending(4)[0]
+        assert (tmp_path / '4.md').read_text(encoding='utf-8') == 'x' * 200 + '49'
+    finally:
+        journal.close()
+
+
+def test_compaction_after_a_failed_one_applies_both_segments(tmp_path):
+    journal = NoteJournal(tmp_path, BodyStore(tmp_path), compact_interval=60)
+    apply = journal._apply
+    segments = []
+
+    def fail_once(latest):
+        if not segments:
+            segments.append(None)
+            raise OSError("disk full")
+        # The failed segment's records are still on disk, ahead of the new ones
+        segments.append([note_id for _, note_id, _ in read_records(journal.old_path)])
+        apply(latest)
+
+    journal._apply = fail_once
+    try:
+        journal.append([(WRITE, 1, 'one')])
+        with pytest.raises(OSError):
+            journal.compact()
+        journal.append([(WRITE, 2, 'two')])
+        journal.compact()
+
+        assert segments[1] == [1, 2]
+        assert not journal.old_path.exists()
+        assert (tmp_path / '1.md').read_text(encoding='utf-8') == 'one'
+        assert (tmp_path / '2.md').read_text(encoding='utf-8') == 'two'
+    finally:
+        journal.close()
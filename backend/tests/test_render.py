@@ -0,0 +1,60 @@
+"""The renderer's output keeps script out, whatever the markdown hides it in"""
+
+import pytest
+
+from app.render import render, sanitize
+
+
+def html(markdown):
+    return render(markdown)[0]
+
+
+@pytest.mark.parametrize('markdown', [
+    '[x](&#106;avascript:alert(1))',
+    '[x](javascript&#58;alert(1))',
+    '[x](javascript&colon;alert(1))',
+    '[x](&#x6A;avascript:alert(1))',
+    '[x](java&#9;script:alert(1))',
+    '[x](<javascript:alert(1)>)',
+    '[x](JaVaScRiPt:alert(1))',
+    '![x](&#106;avascript:alert(1))',
+    '![x](data:text/html;base64,PHNjcmlwdD4=)',
+    '[x][r]\n\n[r]: &#106;avascript:alert(1)',
+])
+def test_script_urls_are_dropped(markdown):
+    rendered = html(markdown)
+    assert 'href' not in rendered and 'src' not in rendered
+    assert 'x' in rendered
+
+
+def test_allowed_urls_are_kept():
+    assert html('[x](http://a.com/?q=1&amp;r=2)') == '<p><a href="http://a.com/?q=1&amp;r=2">x</a></p>'
+    assert html('[x](mailto:a@b.c)') == '<p><a href="mailto:a@b.c">x</a></p>'
+    assert html('[x](notes/a\\_b.md)') == '<p><a href="notes/a_b.md">x</a></p>'
+    assert html('![x](data:image/png;base64,AAA=)') == \
+        '<p><img src="data:image/png;base64,AAA=" alt="x" loading="lazy" /></p>'
+
+
+def test_title_cannot_leave_its_attribute():
+    rendered = html('[x](http://a "`x` \\" onmouseover=alert(1)")')
+    assert rendered == '<p><a href="http://a" title="`x` &quot; onmouseover=alert(1)">x</a></p>'
+
+
+def test_alt_cannot_leave_its_attribute():
+    rendered = html('![a `"` <b> onerror=alert(1)](p.png)')
+    assert rendered == '<p><img src="p.png" alt="a &quot; &lt;b&gt; onerror=alert(1)" loading="lazy" /></p>'
+
+
+def test_code_in_a_link_label():
+    assert html('[a `code` b](http://x)') == '<p><a href="http://x">a <code>code</code> b</a></p>'
+
+
+def test_raw_html_is_text():
+    assert html('<script>alert(1)</script>') == '<p>&lt;script&gt;alert(1)&lt;/script&gt;</p>'
+
+
+def test_sanitize_keeps_only_allowed_markup():
+    assert sanitize('<p onclick="x()">a<script>b</script></p>') == '<p>ab</p>'
+    assert sanitize('<a href="javascript:x()" title="t">a</a>') == '<a title="t">a</a>'
+    assert sanitize('<td style="color: red">a</td>') == '<td>a</td>'
+    assert sanitize('<input type="text" disabled="" />') == '<input disabled="" />'
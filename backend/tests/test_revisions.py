@@ -0,0 +1,13 @@
+"""Quick successive saves coalesce into one revision"""
+
+
+def test_quick_edits_keep_the_first_revision(note_app):
+    note = note_app.add_note('Title', 'first')
+    note_app.update_note(note['id'], 'Title', 'second')
+    latest = note_app.update_note(note['id'], 'Title', 'third')
+
+    revisions = note_app.list_revisions(note['id'])
+    assert len(revisions) == 2
+    assert note_app.get_revision(note['id'], revisions[-1]['id'])['content'] == 'first'
+    assert note_app.get_revision(note['id'], revisions[0]['id'])['content'] == 'third'
+    assert revisions[0]['created'] == latest['modified']
@@ -0,0 +1,64 @@
+"""Failed saves are reported and leave no partial change behind"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import links
+from app.server import create_app
+
+
+class Broken(Exception):
+    pass
+
+
+def fail(*args, **kwargs):
+    raise Broken("index unavailable")
+
+
+@pytest.fixture
+def broken_index(monkeypatch):
+    """Make the link index update, and so every note save transaction, fail"""
+    monkeypatch.setattr(links, 'update_links', fail)
+    monkeypatch.setattr(links, 'add_notes', fail)
+
+
+@pytest.mark.parametrize('lazy', ['false', 'true'])
+def test_failed_update_keeps_the_saved_note(make_app, monkeypatch, lazy):
+    note_app = make_app({'cache': {'lazy_content': lazy}})
+    note = note_app.add_note('Title', 'saved content')
+    monkeypatch.setattr(links, 'update_links', fail)
+    with pytest.raises(Broken):
+        note_app.update_note(note['id'], 'New title', 'unsaved content')
+
+    current = note_app.get_note(note['id'])
+    assert (current['title'], current['content'], current['version']) == ('Title', 'saved content', 1)
+    assert current['modified'] == note['modified']
+    assert note_app.bodies.read(note['id']) == 'saved content'
+    assert note_app.get_notes()[0]['content'] == 'saved content'
+
+
+def test_failed_add_publishes_nothing(note_app, broken_index):
+    with pytest.raises(Broken):
+        note_app.add_note('Title', 'content')
+
+    assert note_app.notes == []
+    assert note_app.get_notes_tree() == []
+    assert note_app.bodies.read(1) is None
+
+
+def test_failed_import_publishes_nothing(note_app, broken_index):
+    entries = [('a', None, 'A', 'a', None), ('b', 'a', 'B', 'b', None)]
+    with pytest.raises(Broken):
+        note_app.import_notes(entries)
+
+    assert note_app.notes == []
+    assert note_app.bodies.read(1) is None and note_app.bodies.read(2) is None
+
+
+def test_failed_save_is_a_server_error(note_app, monkeypatch):
+    client = TestClient(create_app(note_app), raise_server_exceptions=False)
+    note = client.post('/api/notes/', json={'title': 'Title', 'content': 'saved'}).json()
+    monkeypatch.setattr(links, 'update_links', fail)
+    response = client.put(f"/api/notes/{note['id']}", json={'title': 'Title', 'content': 'unsaved'})
+    assert response.status_code == 500
+    assert client.get(f"/api/notes/{note['id']}").json()['content'] == 'saved'
@@ -0,0 +1,19 @@
+"""Search titles and snippets are HTML with the note text escaped"""
+
+
+def test_snippet_escapes_note_text(note_app):
+    note_app.add_note('<b>zebra</b> & co', 'before <script>alert(1)</script> zebra "quoted" after')
+
+    [result] = note_app.search_notes('zebra')['results']
+
+    assert result['title'] == '&lt;b&gt;<mark>zebra</mark>&lt;/b&gt; &amp; co'
+    assert '<script>' not in result['snippet']
+    assert '&lt;script&gt;alert(1)&lt;/script&gt; <mark>zebra</mark> &quot;quoted&quot;' in result['snippet']
+
+
+def test_match_inside_a_tag_is_escaped_around_the_mark(note_app):
+    note_app.add_note('Title', 'a <mark> tag')
+
+    [result] = note_app.search_notes('mark')['results']
+
+    assert result['snippet'] == 'a &lt;<mark>mark</mark>&gt; tag'
@@ -0,0 +1,111 @@
+"""Failed moves and deletes are raised and leave memory matching the database"""
+
+import pytest
+
+from app import hierarchy, links
+
+
+class Broken(Exception):
+    pass
+
+
+def fail(*args, **kwargs):
+    raise Broken("database unavailable")
+
+
+def in_memory(note_app):
+    with note_app._tree_lock:
+        return {(n.id, n.parent_id, n.position, n.version) for n in note_app.notes}
+
+
+def in_database(note_app):
+    with note_app.db.connection() as conn:
+        return set(map(tuple, conn.execute('SELECT id, parent_id, position, version FROM notes')))
+
+
+def child_ids(note_app, parent_id):
+    return list(note_app._children.get(parent_id, ()))
+
+
+@pytest.fixture
+def tree(note_app):
+    """Two top-level notes, the first with two children"""
+    a = note_app.add_note('A', 'a')['id']
+    b = note_app.add_note('B', 'b')['id']
+    c1 = note_app.add_note('C1', 'c1', a)['id']
+    c2 = note_app.add_note('C2', 'c2', a)['id']
+    return a, b, c1, c2
+
+
+def test_failed_move_is_raised_and_undone(note_app, tree, monkeypatch):
+    a, b, c1, c2 = tree
+    before = in_memory(note_app)
+    monkeypatch.setattr(hierarchy, 'move', fail)
+
+    with pytest.raises(Broken):
+        note_app.move_note(c2, b)
+    with pytest.raises(Broken):
+        note_app.reorder_note(c2, 0)
+
+    assert in_memory(note_app) == before == in_database(note_app)
+    assert child_ids(note_app, a) == [c1, c2]
+    assert child_ids(note_app, b) == []
+
+
+def test_failed_renumbering_move_is_undone(note_app, tree, monkeypatch):
+    a, b, c1, c2 = tree
+    # No gap left between the neighbours, so the siblings are renumbered
+    with note_app._tree_lock:
+        note_app._notes_by_id[c2].position = note_app._notes_by_id[c1].position + 1
+    with note_app.db.transaction() as conn:
+        hierarchy.set_positions(conn, [(c2, note_app._notes_by_id[c2].position)])
+    before = in_memory(note_app)
+    monkeypatch.setattr(hierarchy, 'set_positions', fail)
+
+    with pytest.raises(Broken):
+        note_app.move_note(b, a, 1)
+
+    assert in_memory(note_app) == before == in_database(note_app)
+    assert child_ids(note_app, a) == [c1, c2]
+    assert child_ids(note_app, None) == [a, b]
+
+
+def test_failed_delete_is_raised_and_undone(note_app, tree, monkeypatch):
+    a, b, c1, c2 = tree
+    before = in_memory(note_app)
+    seq = note_app.change_seq
+    monkeypatch.setattr(links, 'forget', fail)
+
+    with pytest.raises(Broken):
+        note_app.delete_note(a)
+
+    assert in_memory(note_app) == before == in_database(note_app)
+    assert [node['id'] for node in note_app.get_notes_tree()] == [a, b]
+    assert child_ids(note_app, a) == [c1, c2]
+    assert note_app.get_note(c1)['content'] == 'c1'
+    assert note_app.change_seq == seq
+
+    monkeypatch.undo()
+    note_app.delete_note(a)
+    assert [n.id for n in note_app.notes] == [b]
+    assert in_memory(note_app) == in_database(note_app)
+
+
+def test_failed_external_delete_is_retried(make_app, monkeypatch):
+    note_app = make_app({'watcher': {'enabled': 'true', 'poll_seconds': '60'}})
+    a = note_app.add_note('A', 'a')['id']
+    child = note_app.add_note('Child', 'c', a)['id']
+    note_app.watcher.scan()
+    before = in_memory(note_app)
+    (note_app.notes_dir / f"{a}.md").unlink()
+    monkeypatch.setattr(links, 'forget', fail)
+
+    note_app.watcher.scan()
+    assert in_memory(note_app) == before == in_database(note_app)
+    assert child_ids(note_app, a) == [child]
+
+    monkeypatch.undo()
+    note_app.watcher.scan()
+    assert not note_app.has_note(a)
+    assert note_app.get_note(child)['parent_id'] is None
+    assert in_memory(note_app) == in_database(note_app)
@@ -0,0 +1,53 @@
+"""Vaults leave the default vault's settings and migration state in config.ini alone"""
+
+import pytest
+
+from app.models import NoteApp
+from app.vaults import VaultRegistry
+from conftest import write_config
+
+
+@pytest.fixture
+def registry(tmp_path, config_file):
+    """A registry over tmp_path/vaults, with a move of the default vault pending"""
+    write_config(config_file, tmp_path / 'default', {
+        'migration': {'pending_target': str(tmp_path / 'moved')},
+    })
+    (tmp_path / 'vaults' / 'work').mkdir(parents=True)
+    registry = VaultRegistry(tmp_path / 'vaults')
+    yield registry
+    registry.close()
+
+
+def test_vault_does_not_resume_the_default_vaults_move(registry, tmp_path):
+    vault = registry.acquire('work')
+    registry.release(vault)
+
+    assert vault.note_app.migration is None
+    assert not (tmp_path / 'moved').exists()
+    assert vault.note_app.notes_dir == tmp_path / 'vaults' / 'work'
+
+
+def test_vault_does_not_write_config(registry, tmp_path, config_file):
+    before = config_file.read_text(encoding='utf-8')
+    vault = registry.acquire('work')
+    registry.release(vault)
+
+    vault.note_app.save_settings({'notes_directory': str(tmp_path / 'elsewhere')})
+    vault.note_app.save_migration_target(tmp_path / 'elsewhere')
+    vault.note_app.save_migration_target(None)
+
+    assert config_file.read_text(encoding='utf-8') == before
+    assert vault.note_app.settings['notes_directory'] == str(tmp_path / 'elsewhere')
+
+
+def test_no_config_is_created_without_the_global_settings(tmp_path, config_file):
+    note_app = NoteApp(notes_directory=tmp_path / 'work', global_settings=False)
+    note_app.close()
+
+    assert not config_file.exists()
+
+
+def test_global_settings_are_required_without_a_notes_directory(config_file):
+    with pytest.raises(ValueError):
+        NoteApp(global_settings=False)
@@ -0,0 +1,51 @@
+"""Files changed while the app was stopped are reconciled at startup"""
+
+import os
+import time
+
+WATCHER = {'watcher': {'enabled': 'true', 'poll_seconds': '0.05'}}
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def edit_file(path, content):
+    """Write a note file as another program would, with a later mtime"""
+    path.write_text(content, encoding='utf-8')
+    mtime = time.time() + 10
+    os.utime(path, (mtime, mtime))
+
+
+def test_edits_made_while_stopped_are_reloaded(make_app):
+    note_app = make_app(WATCHER)
+    kept = note_app.add_note('Kept', 'unchanged')
+    edited = note_app.add_note('Edited', 'before the pull')
+    removed = note_app.add_note('Removed', 'deleted by the pull')
+    notes_dir = note_app.notes_dir
+    note_app.close()
+
+    edit_file(notes_dir / f"{edited['id']}.md", 'after the pull zebra')
+    (notes_dir / f"{removed['id']}.md").unlink()
+    edit_file(notes_dir / '100.md', '# Added\nby the pull')
+
+    note_app = make_app(WATCHER)
+    wait_for(lambda: note_app.has_note(100) and not note_app.has_note(removed['id']))
+    wait_for(lambda: note_app.get_note(edited['id'])['version'] == 2)
+    assert note_app.get_note(edited['id'])['content'] == 'after the pull zebra'
+    assert [r['id'] for r in note_app.search_notes('zebra')['results']] == [edited['id']]
+    assert note_app.get_note(100)['title'] == 'Added'
+    assert note_app.get_note(kept['id'])['version'] == 1
+
+
+def test_unchanged_vault_reloads_nothing(make_app):
+    note_app = make_app(WATCHER)
+    note = note_app.add_note('Title', 'content')
+    note_app.close()
+
+    note_app = make_app(WATCHER)
+    note_app.watcher.scan()
+    assert note_app.get_note(note['id'])['version'] == 1
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import './App.css';
 import NotesList from './components/NotesList';
@@ -7,6 +7,71 @@ import Settings from './components/Settings';
 
 const API_BASE_URL = 'http://localhost:8000/api';
 
+// Notes at least this long are saved as a patch instead of the whole text
+const PATCH_MIN_LENGTH = 4096;
+
+const sha256Hex = async (text) => {
+  const digest = await window.crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+  return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+};
+
+// The server's ETag for a note: its version and creation time
+const noteEtag = (note) => `"${note.version}-${note.created}"`;
+
+// The single edit turning base into content: the changed middle between the
+// common prefix and suffix, which is all an autosave usually touches
+const diffEdit = (base, content) => {
+  const max = Math.min(base.length, content.length);
+  let start = 0;
+  while (start < max && base[start] === content[start]) start++;
+  let suffix = 0;
+  while (suffix < max - start &&
+         base[base.length - 1 - suffix] === content[content.length - 1 - suffix]) suffix++;
+  // Never cut a surrogate pair in half
+  const isLowSurrogate = (code) => code >= 0xDC00 && code <= 0xDFFF;
+  if (start > 0 && isLowSurrogate(base.charCodeAt(start))) start--;
+  if (suffix > 0 && isLowSurrogate(base.charCodeAt(base.length - suffix))) suffix--;
+  return {
+    start,
+    end: base.length - suffix,
+    text: content.slice(start, content.length - suffix)
+  };
+};
+
+// Apply change-feed entries to the tree without refetching all of it
+const applyTreeChanges = (tree, changes) => {
+  const nodes = new Map();
+  const flatten = (list) => list.forEach(node => {
+    nodes.set(node.id, { id: node.id, title: node.title, parent_id: node.parent_id, position: node.position });
+    flatten(node.children || []);
+  });
+  flatten(tree);
+
+  changes.forEach(change => {
+    if (change.op === 'delete') {
+      nodes.delete(change.id);
+    } else {
+      nodes.set(change.id, {
+        id: change.id, title: change.title, parent_id: change.parent_id, position: change.position
+      });
+    }
+  });
+
+  const byParent = new Map();
+  nodes.forEach(node => {
+    const key = node.parent_id ?? null;
+    if (!byParent.has(key)) byParent.set(key, []);
+    byParent.get(key).push(node);
+  });
+  // Siblings are ordered by position, then id
+  const byPosition = (a, b) => (a.position || 0) - (b.position || 0) || a.id - b.id;
+  const build = (parentId) => (byParent.get(parentId) || []).sort(byPosition).map(node => ({
+    ...node,
+    children: build(node.id)
+  }));
+  return build(null);
+};
+
 function App() {
   const [notes, setNotes] = useState([]);
   const [notesTree, setNotesTree] = useState([]);
@@ -16,6 +81,17 @@ function App() {
   const [loading, setLoading] = useState(true);
   const [showSettings, setShowSettings] = useState(false);
   const [status, setStatus] = useState('');
+  const changeSeqRef = useRef(0);
+  // Content the server last confirmed for each note: the base of patch saves
+  const savedContentRef = useRef(new Map());
+  // ETag of that content; saves send it as If-Match so that an edit made
+  // meanwhile in another window is not overwritten
+  const savedEtagRef = useRef(new Map());
+
+  const rememberSaved = (note) => {
+    savedContentRef.current.set(note.id, note.content);
+    savedEtagRef.current.set(note.id, noteEtag(note));
+  };
 
   // Load notes on component mount
   useEffect(() => {
@@ -39,7 +115,10 @@ function App() {
       console.log(treeRes)
       
       setNotes(notesRes.data);
+      savedContentRef.current = new Map(notesRes.data.map(n => [n.id, n.content]));
+      savedEtagRef.current = new Map(notesRes.data.map(n => [n.id, noteEtag(n)]));
       setNotesTree(treeRes.data);
+      changeSeqRef.current = Number(treeRes.headers['x-change-seq'] || 0);
       
       if (notesRes.data.length > 0 && !currentNoteId) {
         setCurrentNoteId(notesRes.data[0].id);
@@ -54,6 +133,21 @@ function App() {
     }
   };
 
+  // Fetch only the tree changes since the last sync and patch the tree
+  const syncTree = async () => {
+    const res = await axios.get(`${API_BASE_URL}/notes/changes`, {
+      params: { since: changeSeqRef.current }
+    });
+    if (res.data.reset || res.data.has_more) {
+      const treeRes = await axios.get(`${API_BASE_URL}/notes/tree`);
+      setNotesTree(treeRes.data);
+      changeSeqRef.current = Number(treeRes.headers['x-change-seq'] || 0);
+      return;
+    }
+    setNotesTree(tree => applyTreeChanges(tree, res.data.changes));
+    changeSeqRef.current = res.data.seq;
+  };
+
   const loadSettings = async () => {
     try {
       const res = await axios.get(`${API_BASE_URL}/settings/`);
@@ -76,13 +170,12 @@ function App() {
       });
       
       const newNote = res.data;
+      rememberSaved(newNote);
       setNotes([...notes, newNote]);
       setCurrentNoteId(newNote.id);
       setStatus('Note created');
       
-      // Reload tree
-      const treeRes = await axios.get(`${API_BASE_URL}/notes/tree`);
-      setNotesTree(treeRes.data);
+      await syncTree();
     } catch (error) {
       console.error('Error creating note:', error);
       setStatus('Error creating note');
@@ -98,13 +191,12 @@ function App() {
       });
       
       const newNote = res.data;
+      rememberSaved(newNote);
       setNotes([...notes, newNote]);
       setCurrentNoteId(newNote.id);
       setStatus('Sub-note created');
       
-      // Reload tree
-      const treeRes = await axios.get(`${API_BASE_URL}/notes/tree`);
-      setNotesTree(treeRes.data);
+      await syncTree();
     } catch (error) {
       console.error('Error creating sub-note:', error);
       setStatus('Error creating sub-note');
@@ -117,7 +209,10 @@ function App() {
     }
 
     try {
-      await axios.delete(`${API_BASE_URL}/notes/${noteId}`);
+      const etag = savedEtagRef.current.get(noteId);
+      await axios.delete(`${API_BASE_URL}/notes/${noteId}`, {
+        headers: etag ? { 'If-Match': etag } : {}
+      });
       setNotes(notes.filter(n => n.id !== noteId));
       
       if (currentNoteId === noteId) {
@@ -127,15 +222,45 @@ function App() {
       
       setStatus('Note deleted');
       
-      // Reload tree
-      const treeRes = await axios.get(`${API_BASE_URL}/notes/tree`);
-      setNotesTree(treeRes.data);
+      await syncTree();
     } catch (error) {
+      if (error.response && error.response.status === 412) {
+        setStatus('Note changed in another window; not deleted');
+        await reloadNote(noteId);
+        return;
+      }
       console.error('Error deleting note:', error);
       setStatus('Error deleting note');
     }
   };
 
+  // Move a note (with its sub-notes) under another note, or to the top level
+  const handleMoveNote = async (noteId, parentId) => {
+    try {
+      const etag = savedEtagRef.current.get(noteId);
+      const res = await axios.post(`${API_BASE_URL}/notes/${noteId}/move`, { parent_id: parentId }, {
+        headers: etag ? { 'If-Match': etag } : {}
+      });
+      savedEtagRef.current.set(noteId, noteEtag(res.data));
+      setNotes(notes => notes.map(n => n.id === noteId ? { ...n, ...res.data } : n));
+      setStatus('Note moved');
+
+      await syncTree();
+    } catch (error) {
+      if (error.response && error.response.status === 412) {
+        setStatus('Note changed in another window; not moved');
+        await reloadNote(noteId);
+        return;
+      }
+      if (error.response && error.response.status === 400) {
+        setStatus('A note cannot be moved into its own sub-notes');
+        return;
+      }
+      console.error('Error moving note:', error);
+      setStatus('Error moving note');
+    }
+  };
+
   // Helper function to recursively update a node in the tree
   const updateTreeNode = (nodes, noteId, updatedData) => {
     return nodes.map(node => {
@@ -149,20 +274,53 @@ function App() {
     });
   };
 
+  // Send long notes as a patch against the last saved content, everything
+  // else (or a patch the server cannot apply) as the full text
+  const saveNoteContent = async (noteId, title, content) => {
+    const base = savedContentRef.current.get(noteId);
+    const etag = savedEtagRef.current.get(noteId);
+    const headers = etag ? { 'If-Match': etag } : {};
+    if (base !== undefined && content.length >= PATCH_MIN_LENGTH && window.crypto?.subtle) {
+      try {
+        const res = await axios.patch(`${API_BASE_URL}/notes/${noteId}`, {
+          base_hash: await sha256Hex(base),
+          title,
+          edits: base === content ? [] : [diffEdit(base, content)]
+        }, { headers });
+        return { ...res.data, content };
+      } catch (error) {
+        const response = error.response;
+        const staleBase = response && response.status === 409 && response.headers['x-content-hash'];
+        if (!(staleBase || (response && response.status === 400))) {
+          throw error;
+        }
+      }
+    }
+    const res = await axios.put(`${API_BASE_URL}/notes/${noteId}`, { title, content }, { headers });
+    return res.data;
+  };
+
+  // Replace the local copy of a note with the server's
+  const reloadNote = async (noteId) => {
+    const res = await axios.get(`${API_BASE_URL}/notes/${noteId}`);
+    rememberSaved(res.data);
+    setNotes(notes => notes.map(n => n.id === noteId ? res.data : n));
+    if (currentNoteId === noteId) {
+      setCurrentNote(res.data);
+    }
+  };
+
   const handleSaveNote = async (noteId, title, content) => {
     console.log(`[App] handleSaveNote called: noteId=${noteId}, currentNoteId=${currentNoteId}, title="${title}"`);
     
     if (!noteId) return;
 
     try {
-      const res = await axios.put(`${API_BASE_URL}/notes/${noteId}`, {
-        title: title.trim() || 'Untitled',
-        content
-      });
+      const updatedNote = await saveNoteContent(noteId, title.trim() || 'Untitled', content);
+      rememberSaved(updatedNote);
       
       console.log(`[App] Save successful for note ${noteId}`);
       
-      const updatedNote = res.data;
       setNotes(notes.map(n => n.id === noteId ? updatedNote : n));
       
       // Only update current note if it's still the selected one
@@ -176,24 +334,72 @@ function App() {
       setStatus('Saved ✓');
       setTimeout(() => setStatus(''), 3000);
     } catch (error) {
+      if (error.response && [409, 412].includes(error.response.status)) {
+        // The note was edited by another program (409) or in another
+        // window (412) since it was loaded; show that version instead
+        await reloadNote(noteId);
+        setStatus(error.response.status === 409
+          ? 'Note changed on disk; reloaded'
+          : 'Note changed in another window; reloaded');
+        return;
+      }
       console.error(`[App] Error saving note ${noteId}:`, error);
       setStatus('Error saving note');
     }
   };
 
+  // Poll a background notes directory move until it finishes
+  const waitForMigration = async (migration) => {
+    while (['pending', 'copying', 'finalizing'].includes(migration.state)) {
+      setStatus(`Moving notes: ${migration.files_done}/${migration.files_total} files`);
+      await new Promise(resolve => setTimeout(resolve, 1000));
+      const res = await axios.get(`${API_BASE_URL}/settings/migration`);
+      migration = res.data;
+    }
+    return migration;
+  };
+
   const handleSettingsChange = async (newSettings) => {
     try {
       const res = await axios.put(`${API_BASE_URL}/settings/`, newSettings);
       setSettings(res.data);
       setShowSettings(false);
       
+      if (res.data.migration) {
+        const migration = await waitForMigration(res.data.migration);
+        await loadSettings();
+        if (migration.state !== 'done') {
+          setStatus(`Error moving notes: ${migration.error || migration.state}`);
+          return;
+        }
+      }
+      
       // Reload notes from new location
       await loadNotes();
       setStatus('Settings updated');
       setTimeout(() => setStatus(''), 3000);
     } catch (error) {
       console.error('Error updating settings:', error);
-      setStatus('Error updating settings');
+      const detail = error.response && error.response.data && error.response.data.detail;
+      setStatus(detail ? `Error updating settings: ${detail}` : 'Error updating settings');
+    }
+  };
+
+  // Import a zip or tar archive of markdown files as new top-level notes
+  const handleImport = async (file) => {
+    try {
+      setShowSettings(false);
+      setStatus('Importing notes...');
+      const form = new FormData();
+      form.append('file', file);
+      const res = await axios.post(`${API_BASE_URL}/notes/import`, form);
+      await loadNotes();
+      setStatus(`Imported ${res.data.imported} notes`);
+      setTimeout(() => setStatus(''), 3000);
+    } catch (error) {
+      console.error('Error importing notes:', error);
+      const detail = error.response && error.response.data && error.response.data.detail;
+      setStatus(detail ? `Error importing notes: ${detail}` : 'Error importing notes');
     }
   };
 
@@ -227,6 +433,7 @@ function App() {
             onSelectNote={handleSelectNote}
             onCreateSubNote={handleCreateSubNote}
             onDeleteNote={handleDeleteNote}
+            onMoveNote={handleMoveNote}
           />
         </aside>
 
@@ -237,6 +444,7 @@ function App() {
               onSave={handleSaveNote}
               onDelete={() => handleDeleteNote(currentNoteId)}
               onCreateSubNote={handleCreateSubNote}
+              uploadUrl={`${API_BASE_URL}/attachments/`}
             />
           ) : (
             <div className="no-note">
@@ -252,6 +460,8 @@ function App() {
           settings={settings}
           onClose={() => setShowSettings(false)}
           onSave={handleSettingsChange}
+          exportUrl={`${API_BASE_URL}/notes/export?format=zip`}
+          onImport={handleImport}
         />
       )}
     </div>
@@ -3,7 +3,7 @@ import Vditor from 'vditor';
 import 'vditor/dist/index.css';
 import './NoteEditor.css';
 
-function NoteEditor({ note, onSave, onDelete, onCreateSubNote }) {
+function NoteEditor({ note, onSave, onDelete, onCreateSubNote, uploadUrl }) {
   const [title, setTitle] = useState('');
   const [content, setContent] = useState('');
   const [saveTimeout, setSaveTimeout] = useState(null);
@@ -84,6 +84,25 @@ function NoteEditor({ note, onSave, onDelete, onCreateSubNote }) {
           cache: {
             enable: false
           },
+          // Pasted and dropped files are stored as attachments and linked by URL
+          // instead of being inlined into the note as base64
+          upload: {
+            url: uploadUrl,
+            fieldName: 'file',
+            multiple: false,
+            format: (files, responseText) => {
+              const attachment = JSON.parse(responseText);
+              return JSON.stringify({
+                msg: '',
+                code: 0,
+                data: {
+                  errFiles: [],
+                  succMap: { [files[0].name]: new URL(attachment.url, uploadUrl).href }
+                }
+              });
+            },
+            error: (msg) => console.error('Attachment upload failed:', msg)
+          },
           input: (value) => {
             setContent(value);
             contentRef.current = value;
@@ -109,6 +128,7 @@ function NoteEditor({ note, onSave, onDelete, onCreateSubNote }) {
             'inline-code',
             '|',
             'table',
+            'upload',
             '|',
             'undo',
             'redo',
@@ -1,7 +1,7 @@
 import React, { useState } from 'react';
 import './NotesList.css';
 
-function NotesList({ notes, allNotes, currentNoteId, onSelectNote, onCreateSubNote, onDeleteNote }) {
+function NotesList({ notes, allNotes, currentNoteId, onSelectNote, onCreateSubNote, onDeleteNote, onMoveNote }) {
   const [expandedNodes, setExpandedNodes] = useState(new Set());
   const [contextMenu, setContextMenu] = useState(null);
   const [contextNoteId, setContextNoteId] = useState(null);
@@ -32,6 +32,21 @@ function NotesList({ notes, allNotes, currentNoteId, onSelectNote, onCreateSubNo
     setContextMenu(null);
   };
 
+  // Drag a note onto another to make it a sub-note, or onto the list to move it to the top level
+  const handleDragStart = (e, noteId) => {
+    e.dataTransfer.setData('text/plain', String(noteId));
+    e.dataTransfer.effectAllowed = 'move';
+  };
+
+  const handleDrop = (e, parentId) => {
+    e.preventDefault();
+    e.stopPropagation();
+    const noteId = Number(e.dataTransfer.getData('text/plain'));
+    if (noteId && noteId !== parentId) {
+      onMoveNote(noteId, parentId);
+    }
+  };
+
   // Close context menu when clicking elsewhere
   React.useEffect(() => {
     const handleClick = () => setContextMenu(null);
@@ -51,6 +66,10 @@ function NotesList({ notes, allNotes, currentNoteId, onSelectNote, onCreateSubNo
           className={`note-item ${node.id === currentNoteId ? 'active' : ''}`}
           style={{ marginLeft: `${level * 16}px` }}
           onContextMenu={(e) => handleContextMenu(e, node.id)}
+          draggable
+          onDragStart={(e) => handleDragStart(e, node.id)}
+          onDragOver={(e) => e.preventDefault()}
+          onDrop={(e) => handleDrop(e, node.id)}
         >
           <span 
             className={`note-item-toggle ${node.children?.length > 0 ? '' : 'disabled'}`}
@@ -89,7 +108,11 @@ function NotesList({ notes, allNotes, currentNoteId, onSelectNote, onCreateSubNo
 
   return (
     <>
-      <div className="notes-list">
+      <div
+        className="notes-list"
+        onDragOver={(e) => e.preventDefault()}
+        onDrop={(e) => handleDrop(e, null)}
+      >
         {notes.length === 0 ? (
           <div className="empty-notes">No notes yet</div>
         ) : (
@@ -1,7 +1,7 @@
 import React, { useState } from 'react';
 import './Settings.css';
 
-function Settings({ settings, onClose, onSave }) {
+function Settings({ settings, onClose, onSave, exportUrl, onImport }) {
   const [notesPath, setNotesPath] = useState(settings.notes_directory || '');
 
   const handleSave = () => {
@@ -35,6 +35,19 @@ function Settings({ settings, onClose, onSave }) {
             </div>
             <small>Notes will be stored as Markdown files (.md) in this directory</small>
           </div>
+
+          <div className="setting-group">
+            <label htmlFor="importArchive">Import / Export:</label>
+            <input
+              id="importArchive"
+              type="file"
+              accept=".zip,.tar,.tar.gz,.tgz"
+              onChange={(e) => e.target.files[0] && onImport(e.target.files[0])}
+            />
+            <small>
+              Folders of Markdown files become sub-notes. <a href={exportUrl}>Export all notes</a> as a zip archive.
+            </small>
+          </div>
         </div>
 
         <div className="modal-footer">
@@ -23,7 +23,7 @@ print("\n[Notes Loaded]")
 print(f"Total notes: {len(app.notes)}")
 if app.notes:
     for note in app.notes:
-        print(f"  - Note {note['id']}: {note['title']} (parent: {note.get('parent_id')})")
+        print(f"  - Note {note.id}: {note.title} (parent: {note.parent_id})")
 else:
     print("  No notes found!")
 